@@ -0,0 +1,320 @@
+"""
+Бэктест правил «трёх экранов» на истории из локального хранилища свечей (<BOT_STATE_DIR>/candles).
+
+    cd bot
+    python -m app.backtest --fetch-since 2020-01-01             # один раз докачать историю 4h/1d/1w
+    python -m app.backtest --ma 30 50 100 --macd 12/26/9 8/21/5 --sensitivity low medium high
+    python -m app.backtest --symbols BTC/USDT ETH/USDT --horizons 6 18 42 --out sweep.json
+
+Индикаторы — те же indicators.sma/macd, что у живого бота, но сразу по всей истории (snapshot_series):
+i-я свеча 4h видит только закрытые к её закрытию бары 1d/1w, заглядывания вперёд нет.
+LLM в истории не воспроизвести, поэтому BUY здесь — детерминированное правило: гейт префильтра
+пропустил бы пару (reject_series) и на H4 есть триггер — пересечение MACD снизу вверх;
+при меньшей чувствительности дополнительно требуются зелёные проверки старших экранов.
+
+Для каждого BUY считаются доходности вперёд (close через h свечей 4h к цене входа), доля
+положительных (hit rate) и просадка — минимум low за самый длинный горизонт относительно входа.
+Наборы параметров перебираются параллельно в процессах (по одному набору индикаторов на задачу).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from itertools import product
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .candle_store import CandleStore
+from .exchange import timeframe_ms
+from .indicators import snapshot_series
+from .prefilter import macd_bearish_series, reject_series, trend_down_series
+from .resample import MAX_BASE_LIMIT, can_resample, resample_candles
+
+log = logging.getLogger("backtest")
+
+# экраны в том виде, в каком их ждёт префильтр: старший, средний, рабочий
+TRIPLE = ("1w", "1d", "4h")
+BASE_TF = "4h"
+SENSITIVITIES = ("low", "medium", "high")
+DEFAULT_HORIZONS = (6, 18, 42)  # 1, 3 и 7 суток в свечах 4h
+
+
+@dataclass(frozen=True)
+class Params:
+    ma_window: int
+    macd_fast: int
+    macd_slow: int
+    macd_signal: int
+
+    @property
+    def warmup(self) -> int:
+        # столько же свечей бот требует у биржи перед расчётом (min_len в build_snapshots_triple)
+        return max(self.ma_window, self.macd_slow) + 5
+
+    def label(self) -> str:
+        return f"MA{self.ma_window} MACD{self.macd_fast}/{self.macd_slow}/{self.macd_signal}"
+
+
+# ---------- данные ----------
+def load_triple(store: CandleStore, exchange_id: str, symbol: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Свечи по трём экранам из хранилища. Старший TF, которого нет (или он короче истории 4h),
+    собирается из 4h так же, как при DERIVE_TIMEFRAMES.
+    """
+    base = store.load(exchange_id, symbol, BASE_TF)
+    if base is None or len(base) < 2:
+        return None
+    out = {BASE_TF: base}
+    for tf in TRIPLE:
+        if tf == BASE_TF:
+            continue
+        stored = store.load(exchange_id, symbol, tf)
+        derived = resample_candles(base, BASE_TF, tf, exchange_id) if can_resample(BASE_TF, tf) else None
+        options = [a for a in (stored, derived) if a is not None and len(a)]
+        if not options:
+            return None
+        out[tf] = min(options, key=lambda a: a[0, 0])
+    return out
+
+
+def backfill(exchange_id: str, symbols: Sequence[str], since_ms: int, state_dir: str) -> None:
+    """Докачать историю с since_ms по всем экранам постранично и записать серии в хранилище целиком."""
+    from .exchange import ExchangeClient
+
+    ex = ExchangeClient(exchange_id).ex  # сырой ccxt с прокси из окружения; кэш свечей не нужен
+    store = CandleStore(state_dir)
+    now_ms = int(time.time() * 1000)
+    for symbol in symbols:
+        for tf in TRIPLE:
+            tf_ms = timeframe_ms(tf)
+            rows: List[list] = []
+            since = since_ms
+            while since < now_ms:
+                page = ex.fetch_ohlcv(symbol, timeframe=tf, since=since, limit=MAX_BASE_LIMIT)
+                page = [r for r in page if not rows or r[0] > rows[-1][0]]
+                if not page:
+                    break
+                rows.extend(page)
+                since = int(page[-1][0]) + tf_ms
+            if rows:
+                store.write(exchange_id, symbol, tf, np.asarray(rows, dtype=np.float64), replace=True)
+            log.info("backfill %s %s: %d свечей", symbol, tf, len(rows))
+
+
+# ---------- сигналы ----------
+def _align(base_close_ms: np.ndarray, candles: np.ndarray, tf: str) -> np.ndarray:
+    """Для каждой свечи 4h — индекс последнего бара tf, закрытого к её закрытию (-1, если такого нет)."""
+    closes = candles[:, 0] + timeframe_ms(tf)
+    return np.searchsorted(closes, base_close_ms, side="right") - 1
+
+
+def buy_masks(candles: Dict[str, np.ndarray], params: Params, sensitivities: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Чувствительность -> булева маска BUY по свечам 4h."""
+    base = candles[BASE_TF]
+    base_close_ms = base[:, 0] + timeframe_ms(BASE_TF)
+    valid = np.arange(len(base)) >= params.warmup - 1
+    series: Dict[str, Dict[str, np.ndarray]] = {}
+    for tf in TRIPLE:
+        arr = candles[tf]
+        s = snapshot_series(arr[:, 4], arr[:, 5], params.ma_window, params.macd_fast,
+                            params.macd_slow, params.macd_signal)
+        if tf == BASE_TF:
+            series[tf] = s
+            continue
+        idx = _align(base_close_ms, arr, tf)
+        valid &= idx >= params.warmup - 1
+        idx = np.maximum(idx, 0)
+        series[tf] = {k: v[idx] for k, v in s.items()}
+
+    h4 = series[BASE_TF]
+    weekly_ok = ~trend_down_series(series["1w"])
+    daily_ok = ~macd_bearish_series(series["1d"])
+    trigger = valid & h4["macd_cross_up"]
+    out = {}
+    for sens in sensitivities:
+        mask = trigger & ~reject_series(series, sens)
+        if sens == "medium":
+            mask &= weekly_ok
+        elif sens == "low":
+            mask &= weekly_ok & daily_ok & (h4["volume_spike"] | h4["price_above_ma"])
+        out[sens] = mask
+    return out
+
+
+def forward_outcomes(base: np.ndarray, entries: np.ndarray, horizons: Sequence[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (доходности (n, len(horizons)), просадки (n,)) для входов по close свечей entries.
+    NaN — если история после входа короче горизонта.
+    """
+    close, low = base[:, 4], base[:, 3]
+    n = len(close)
+    entry = close[entries]
+    rets = np.full((len(entries), len(horizons)), np.nan)
+    for j, h in enumerate(horizons):
+        ok = entries + h < n
+        rets[ok, j] = close[entries[ok] + h] / entry[ok] - 1.0
+    longest = max(horizons)
+    dd = np.full(len(entries), np.nan)
+    if n > longest:
+        # окно i — минимум low по свечам i+1 .. i+longest
+        window_min = np.lib.stride_tricks.sliding_window_view(low[1:], longest).min(axis=-1)
+        ok = entries < len(window_min)
+        dd[ok] = np.minimum(window_min[entries[ok]] / entry[ok] - 1.0, 0.0)
+    return rets, dd
+
+
+def summarize(rets: np.ndarray, dd: np.ndarray, horizons: Sequence[int], symbols_with_signals: int) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"signals": int(len(dd)), "symbols_with_signals": symbols_with_signals, "horizons": {}}
+    for j, h in enumerate(horizons):
+        r = rets[:, j]
+        r = r[~np.isnan(r)]
+        out["horizons"][str(h)] = {
+            "n": int(len(r)),
+            "hit_rate": round(float((r > 0).mean()), 4) if len(r) else None,
+            "mean_return": round(float(r.mean()), 5) if len(r) else None,
+            "median_return": round(float(np.median(r)), 5) if len(r) else None,
+        }
+    d = dd[~np.isnan(dd)]
+    out["drawdown"] = {
+        "n": int(len(d)),
+        "mean": round(float(d.mean()), 5) if len(d) else None,
+        "q05": round(float(np.percentile(d, 5)), 5) if len(d) else None,
+        "worst": round(float(d.min()), 5) if len(d) else None,
+    }
+    return out
+
+
+def evaluate(data: Dict[str, Dict[str, np.ndarray]], params: Params, sensitivities: Sequence[str],
+             horizons: Sequence[int]) -> List[Dict[str, Any]]:
+    """Один набор индикаторов по всем парам; по результату на каждую чувствительность."""
+    acc: Dict[str, List[tuple]] = {s: [] for s in sensitivities}
+    for candles in data.values():
+        for sens, mask in buy_masks(candles, params, sensitivities).items():
+            entries = np.flatnonzero(mask)
+            if len(entries):
+                acc[sens].append(forward_outcomes(candles[BASE_TF], entries, horizons))
+    results = []
+    for sens in sensitivities:
+        parts = acc[sens]
+        rets = np.concatenate([p[0] for p in parts]) if parts else np.empty((0, len(horizons)))
+        dd = np.concatenate([p[1] for p in parts]) if parts else np.empty(0)
+        results.append({**asdict(params), "sensitivity": sens, **summarize(rets, dd, horizons, len(parts))})
+    return results
+
+
+# ---------- перебор параметров ----------
+# данные воркера: каждый процесс читает хранилище сам (memmap), по каналу между процессами идут только итоги
+_worker_data: Dict[str, Dict[str, np.ndarray]] = {}
+
+
+def load_data(state_dir: str, exchange_id: str, symbols: Sequence[str]) -> Dict[str, Dict[str, np.ndarray]]:
+    store = CandleStore(state_dir)
+    data = {}
+    for symbol in symbols:
+        candles = load_triple(store, exchange_id, symbol)
+        if candles is None:
+            log.warning("backtest: нет истории %s в %s — пропускаю", symbol, store.root)
+            continue
+        data[symbol] = candles
+    return data
+
+
+def _init_worker(state_dir: str, exchange_id: str, symbols: Sequence[str]) -> None:
+    global _worker_data
+    _worker_data = load_data(state_dir, exchange_id, symbols)
+
+
+def _evaluate_in_worker(params: Params, sensitivities: Sequence[str], horizons: Sequence[int]) -> List[Dict[str, Any]]:
+    return evaluate(_worker_data, params, sensitivities, horizons)
+
+
+def sweep(
+    state_dir: str,
+    exchange_id: str,
+    symbols: Sequence[str],
+    grid: Sequence[Params],
+    sensitivities: Sequence[str] = SENSITIVITIES,
+    horizons: Sequence[int] = DEFAULT_HORIZONS,
+    workers: int = 0,
+) -> List[Dict[str, Any]]:
+    """Все наборы grid × sensitivities; workers=0 — по числу ядер, 1 — в текущем процессе."""
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(grid))
+    if workers <= 1:
+        data = load_data(state_dir, exchange_id, symbols)
+        return [r for params in grid for r in evaluate(data, params, sensitivities, horizons)]
+    # spawn, а не fork: у вызывающего процесса могут быть треды (тредпул, клиент БД)
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(state_dir, exchange_id, list(symbols))) as pool:
+        futures = [pool.submit(_evaluate_in_worker, params, tuple(sensitivities), tuple(horizons)) for params in grid]
+        return [r for f in futures for r in f.result()]
+
+
+def _parse_macd(text: str) -> tuple[int, int, int]:
+    fast, slow, signal = (int(x) for x in text.split("/"))
+    return fast, slow, signal
+
+
+def _parse_date_ms(text: str) -> int:
+    return int(datetime.strptime(text, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def main() -> None:
+    env = os.getenv
+    default_macd = f"{env('MACD_FAST', '12')}/{env('MACD_SLOW', '26')}/{env('MACD_SIGNAL', '9')}"
+    p = argparse.ArgumentParser(prog="python -m app.backtest", description="Бэктест правил трёх экранов")
+    p.add_argument("--symbols", nargs="+",
+                   default=[s.strip().upper().replace(":", "/") for s in env("SYMBOLS", "BTC/USDT").split(",") if s.strip()])
+    p.add_argument("--exchange", default=env("EXCHANGE_ID", "binance"))
+    p.add_argument("--state-dir", default=env("BOT_STATE_DIR", "/state"))
+    p.add_argument("--ma", type=int, nargs="+", default=[int(env("MA_WINDOW", "50"))])
+    p.add_argument("--macd", nargs="+", default=[default_macd], help="fast/slow/signal, например 12/26/9")
+    p.add_argument("--sensitivity", nargs="+", choices=SENSITIVITIES, default=list(SENSITIVITIES))
+    p.add_argument("--horizons", type=int, nargs="+", default=list(DEFAULT_HORIZONS), help="в свечах 4h")
+    p.add_argument("--workers", type=int, default=0, help="процессов (0 — по числу ядер)")
+    p.add_argument("--fetch-since", help="YYYY-MM-DD: сначала докачать историю с биржи в хранилище")
+    p.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = p.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(name)s: %(message)s")
+
+    if args.fetch_since:
+        backfill(args.exchange, args.symbols, _parse_date_ms(args.fetch_since), args.state_dir)
+
+    grid = [Params(ma, *_parse_macd(m)) for ma, m in product(args.ma, args.macd)]
+    t0 = time.perf_counter()
+    results = sweep(args.state_dir, args.exchange, args.symbols, grid, args.sensitivity, args.horizons, args.workers)
+    elapsed = time.perf_counter() - t0
+
+    main_h = str(args.horizons[0])
+    results.sort(key=lambda r: (r["horizons"][main_h]["hit_rate"] or 0.0), reverse=True)
+    for r in results:
+        h = r["horizons"][main_h]
+        label = Params(r["ma_window"], r["macd_fast"], r["macd_slow"], r["macd_signal"]).label()
+        print(f"{label:>24} {r['sensitivity']:>6}: {r['signals']:>6} BUY, hit@{main_h} {h['hit_rate']}, "
+              f"mean@{main_h} {h['mean_return']}, worst dd {r['drawdown']['worst']}", file=sys.stderr)
+    log.info("backtest: %d наборов × %d пар за %.1fs", len(grid) * len(args.sensitivity), len(args.symbols), elapsed)
+
+    text = json.dumps({
+        "exchange": args.exchange,
+        "symbols": args.symbols,
+        "horizons": args.horizons,
+        "created_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "results": results,
+    }, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import re
+import struct
+import threading
+import logging
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: остаётся только блокировка внутри процесса
+    fcntl = None
+
+import numpy as np
+
+log = logging.getLogger("candle_store")
+
+# Формат файла серии (одна пара/TF = один файл):
+#   заголовок 64 байта: magic(8) | capacity(int64) | count(int64) | резерв
+#   затем 6 колонок по capacity элементов: ts(int64), open, high, low, close, volume (float64)
+# Колонки фиксированной ширины, поэтому каждую можно отобразить через np.memmap без копирования.
+_MAGIC = b"OHLCV\x00\x01\x00"
+_HEADER = struct.Struct("<8sqq")
+_HEADER_SIZE = 64
+_COLUMNS = ("timestamp", "open", "high", "low", "close", "volume")
+_DTYPES = (np.int64, np.float64, np.float64, np.float64, np.float64, np.float64)
+_ITEM = 8
+_MIN_CAPACITY = 1024
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", name)
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Межпроцессная блокировка серии (воркеры пула и стример пишут в один каталог)."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CandleStore:
+    """
+    Локальное хранилище свечей рядом со state.db: <state_dir>/candles/<exchange>/<SYMBOL>_<tf>.ohlcv.
+    Файлы только дописываются; перезаписывается лишь хвост, начиная с формирующейся свечи.
+    Запись серии идёт под flock на <файл>.lock, так что писать могут несколько процессов.
+    """
+
+    def __init__(self, state_dir: str):
+        self.root = os.path.join(state_dir, "candles")
+        self._lock = threading.Lock()
+
+    def path(self, exchange_id: str, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, _safe(exchange_id), f"{_safe(symbol)}_{_safe(timeframe)}.ohlcv")
+
+    # ---------- чтение ----------
+    def _header(self, path: str) -> Optional[tuple[int, int]]:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read(_HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(raw) < _HEADER.size:
+            return None
+        magic, capacity, count = _HEADER.unpack(raw)
+        if magic != _MAGIC or count < 0 or count > capacity:
+            log.warning("Candle store: битый заголовок %s — игнорирую", path)
+            return None
+        return capacity, count
+
+    def columns(self, exchange_id: str, symbol: str, timeframe: str) -> Optional[dict[str, np.ndarray]]:
+        """Колонки серии как read-only memmap-представления (без копирования данных)."""
+        path = self.path(exchange_id, symbol, timeframe)
+        hdr = self._header(path)
+        if not hdr or hdr[1] == 0:
+            return None
+        capacity, count = hdr
+        return {
+            name: np.memmap(path, dtype=dtype, mode="r", offset=_HEADER_SIZE + i * capacity * _ITEM, shape=(count,))
+            for i, (name, dtype) in enumerate(zip(_COLUMNS, _DTYPES))
+        }
+
+    def load(self, exchange_id: str, symbol: str, timeframe: str, limit: Optional[int] = None) -> Optional[np.ndarray]:
+        """Последние `limit` свечей массивом (n, 6) float64 — в формате CandleCache."""
+        cols = self.columns(exchange_id, symbol, timeframe)
+        if not cols:
+            return None
+        n = len(cols["timestamp"])
+        start = 0 if limit is None else max(0, n - limit)
+        out = np.empty((n - start, 6), dtype=np.float64)
+        for i, name in enumerate(_COLUMNS):
+            out[:, i] = cols[name][start:]
+        return out
+
+    # ---------- запись ----------
+    def write(self, exchange_id: str, symbol: str, timeframe: str, candles: np.ndarray, replace: bool = False) -> None:
+        """
+        Дописывает свечи. Всё, что в файле начиная с timestamp первой новой свечи, перезаписывается
+        (так обновляется формирующийся бар). replace=True — серия пишется с нуля (разрыв в истории).
+        """
+        candles = np.asarray(candles, dtype=np.float64).reshape(-1, 6)
+        if len(candles) == 0:
+            return
+        path = self.path(exchange_id, symbol, timeframe)
+        with self._lock, _file_lock(path):
+            hdr = None if replace else self._header(path)
+            if hdr is None:
+                self._rewrite(path, candles)
+                return
+            capacity, count = hdr
+            ts = np.memmap(path, dtype=np.int64, mode="r", offset=_HEADER_SIZE, shape=(count,)) if count else np.empty(0, np.int64)
+            start = int(np.searchsorted(ts, int(candles[0, 0]), side="left"))
+            del ts
+            if start + len(candles) > capacity:
+                old = self.load(exchange_id, symbol, timeframe)
+                keep = old[:start] if old is not None else np.empty((0, 6))
+                self._rewrite(path, np.concatenate((keep, candles)))
+                return
+            with open(path, "r+b") as f:
+                for i, dtype in enumerate(_DTYPES):
+                    f.seek(_HEADER_SIZE + (i * capacity + start) * _ITEM)
+                    f.write(np.ascontiguousarray(candles[:, i], dtype=dtype).tobytes())
+                # счётчик пишем последним: оборванная запись не «видна» читателям
+                f.flush()
+                f.seek(0)
+                f.write(_HEADER.pack(_MAGIC, capacity, start + len(candles)))
+
+    def _rewrite(self, path: str, candles: np.ndarray) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        n = len(candles)
+        capacity = max(_MIN_CAPACITY, 1 << (2 * n - 1).bit_length()) if n else _MIN_CAPACITY
+        # уникальное имя: общий path + ".tmp" два писателя затирали бы друг у друга
+        tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, capacity, n).ljust(_HEADER_SIZE, b"\x00"))
+                for i, dtype in enumerate(_DTYPES):
+                    col = np.zeros(capacity, dtype=dtype)
+                    col[:n] = candles[:, i]
+                    f.write(col.tobytes())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
@@ -21,11 +21,42 @@ class Settings:
     macd_slow: int
     macd_signal: int
     schedule_seconds: int
+    schedule_mode: str                 # close — по закрытию свечи младшего TF; interval — раз в SCHEDULE_SECONDS
+    schedule_grace_seconds: int        # пауза после закрытия свечи, пока биржа отдаст новый бар
     literature_urls: list[str]
     report_locale: str
     state_dir: str
     buy_cooldown_hours: int
     triple_timeframes: list[str]       # <<< НОВОЕ: ["1w","1d","4h"]
+    exchange_async: bool               # автоцикл на ccxt.async_support вместо тредпула
+    pipeline_fetch_concurrency: int    # сколько пар одновременно качают свечи
+    pipeline_indicator_concurrency: int
+    pipeline_llm_concurrency: int
+    derive_timeframes: bool            # собирать 1d/1w из 4h локально, когда хватает истории
+    llm_cache_persist: bool            # хранить кэш решений LLM в state.db
+    llm_batch_size: int                # пар в одном запросе к LLM (1 = по одной)
+    signals_keep_days: int             # полная история сигналов; старше — NO_BUY сворачиваются (0 = выкл.)
+    retention_chunk: int
+    retention_interval_seconds: int
+    outbox_global_rate: float          # сообщений/с на бота (лимит Telegram ~30)
+    outbox_chat_rate: float            # сообщений/с в личный чат
+    outbox_group_per_minute: float     # сообщений/мин в группу или канал
+    worker_processes: int              # >0 — свечи и индикаторы автоцикла считают отдельные процессы
+    stream_klines: bool                # свечи через WebSocket kline-стримы вместо опроса REST
+    stream_url: str                    # пусто — адрес по умолчанию для биржи
+    stream_max_per_conn: int
+    screener_auto: bool                # добавлять top K скринера к парам автоцикла
+    screener_top_k: int
+    screener_quote: str
+    screener_min_quote_volume: float
+    screener_min_change: float
+    screener_max_change: float
+    screener_klines: bool              # уточнять кандидатов по дневным свечам (выше MA)
+    screener_refresh_seconds: int
+    admin_ids: list[int]               # кому доступны служебные команды (/stats)
+    metrics_port: int                  # >0 — Prometheus-текст на http://METRICS_HOST:port/metrics
+    metrics_host: str
+    record_path: str                   # непусто — писать запросы к бирже и решения LLM в файл (recorder.py)
 
 def load_settings() -> Settings:
     symbols = [s.strip().upper().replace(":", "/") for s in _get("SYMBOLS", "BTC/USDT").split(",") if s.strip()]
@@ -44,9 +75,40 @@ def load_settings() -> Settings:
         macd_slow=int(_get("MACD_SLOW", "26")),
         macd_signal=int(_get("MACD_SIGNAL", "9")),
         schedule_seconds=int(_get("SCHEDULE_SECONDS", "900")),
+        schedule_mode=_get("SCHEDULE_MODE", "interval").strip().lower(),
+        schedule_grace_seconds=int(_get("SCHEDULE_GRACE_SECONDS", "15")),
         literature_urls=literature_raw,
         report_locale=_get("REPORT_LOCALE", "ru"),
         state_dir=_get("BOT_STATE_DIR", "/state"),
         buy_cooldown_hours=int(_get("BUY_COOLDOWN_HOURS", "6")),
         triple_timeframes=triple_tfs,
+        exchange_async=_get("EXCHANGE_ASYNC", "0").strip().lower() in {"1", "true", "yes"},
+        pipeline_fetch_concurrency=int(_get("PIPELINE_FETCH_CONCURRENCY", "16")),
+        pipeline_indicator_concurrency=int(_get("PIPELINE_INDICATOR_CONCURRENCY", "4")),
+        pipeline_llm_concurrency=int(_get("PIPELINE_LLM_CONCURRENCY", "4")),
+        derive_timeframes=_get("DERIVE_HTF", "0").strip().lower() in {"1", "true", "yes"},
+        llm_cache_persist=_get("LLM_CACHE_PERSIST", "1").strip().lower() in {"1", "true", "yes"},
+        llm_batch_size=int(_get("LLM_BATCH_SIZE", "1")),
+        signals_keep_days=int(_get("SIGNALS_KEEP_DAYS", "0")),
+        retention_chunk=int(_get("RETENTION_CHUNK", "500")),
+        retention_interval_seconds=int(_get("RETENTION_INTERVAL_SECONDS", "3600")),
+        outbox_global_rate=float(_get("OUTBOX_GLOBAL_RATE", "25")),
+        outbox_chat_rate=float(_get("OUTBOX_CHAT_RATE", "1")),
+        outbox_group_per_minute=float(_get("OUTBOX_GROUP_PER_MINUTE", "20")),
+        worker_processes=int(_get("WORKER_PROCESSES", "0")),
+        stream_klines=_get("STREAM_KLINES", "0").strip().lower() in {"1", "true", "yes"},
+        stream_url=_get("STREAM_URL", ""),
+        stream_max_per_conn=int(_get("STREAM_MAX_PER_CONN", "200")),
+        screener_auto=_get("SCREENER_AUTO", "0").strip().lower() in {"1", "true", "yes"},
+        screener_top_k=int(_get("SCREENER_TOP_K", "10")),
+        screener_quote=_get("SCREENER_QUOTE", "USDT").strip().upper(),
+        screener_min_quote_volume=float(_get("SCREENER_MIN_QUOTE_VOLUME", "5000000")),
+        screener_min_change=float(_get("SCREENER_MIN_CHANGE", "-5")),
+        screener_max_change=float(_get("SCREENER_MAX_CHANGE", "40")),
+        screener_klines=_get("SCREENER_KLINES", "0").strip().lower() in {"1", "true", "yes"},
+        screener_refresh_seconds=int(_get("SCREENER_REFRESH_SECONDS", "900")),
+        admin_ids=[int(x) for x in _get("ADMIN_IDS", "").replace(",", " ").split() if x.strip().lstrip("-").isdigit()],
+        metrics_port=int(_get("METRICS_PORT", "0")),
+        metrics_host=_get("METRICS_HOST", "127.0.0.1"),
+        record_path=_get("RECORD_PATH", "").strip(),
     )
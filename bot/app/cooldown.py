@@ -0,0 +1,45 @@
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def iso_to_epoch(ts: str) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+
+class CooldownIndex:
+    """
+    Время последнего BUY по (пара, TF) в памяти: проверка cooldown — словарь, без SQL и разбора ISO.
+    Заполняется из БД один раз при старте и обновляется при каждой вставке сигнала.
+    """
+
+    def __init__(self):
+        self._last_buy: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[Tuple[str, str, str]]) -> None:
+        """rows: (symbol, timeframe, ts_utc) последних BUY."""
+        with self._lock:
+            for symbol, timeframe, ts in rows:
+                epoch = iso_to_epoch(ts)
+                if epoch is not None:
+                    self._bump(symbol, timeframe, epoch)
+
+    def _bump(self, symbol: str, timeframe: str, epoch: float) -> None:
+        key = (symbol, timeframe)
+        if epoch > self._last_buy.get(key, 0.0):
+            self._last_buy[key] = epoch
+
+    def record_buy(self, symbol: str, timeframe: str, epoch: float) -> None:
+        with self._lock:
+            self._bump(symbol, timeframe, epoch)
+
+    def last_buy(self, symbol: str, timeframe: str) -> Optional[float]:
+        return self._last_buy.get((symbol, timeframe))
+
+    def within(self, symbol: str, timeframe: str, hours: float, now: float) -> bool:
+        last = self._last_buy.get((symbol, timeframe))
+        return last is not None and now - last < hours * 3600.0
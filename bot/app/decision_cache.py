@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+log = logging.getLogger("decision_cache")
+
+# Кэш решений LLM. Пока 4h-свеча не закрылась, повторные /check и циклы автопроверки
+# шлют почти одинаковые промпты — отвечаем из кэша. Ключ: пара, модель, чувствительность,
+# хэш шаблона промпта и «огрублённый» отпечаток трёх снапшотов.
+
+
+def _q_rel(x: Any, base: float, scale: float) -> Optional[int]:
+    """Значение в долях цены (scale=1e3 -> шаг 0.1%). Так MACD около нуля не «дрожит» в ключе."""
+    try:
+        v = float(x)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(v) or not base:
+        return None
+    return round(v / base * scale)
+
+
+def _q_ratio(a: Any, b: Any) -> Optional[float]:
+    try:
+        a, b = float(a), float(b)
+    except (TypeError, ValueError):
+        return None
+    if not b or math.isnan(a) or math.isnan(b):
+        return None
+    return round(a / b, 1)
+
+
+def snapshot_fingerprint(snapshots: Dict[str, Dict[str, Any]]) -> str:
+    parts = {}
+    for tf in sorted(snapshots):
+        s = snapshots[tf] or {}
+        close = float(s.get("close") or 0.0)
+        parts[tf] = [
+            _q_rel(s.get("close"), s.get("ma") or close, 1e3),
+            _q_rel(s.get("macd"), close, 1e4),
+            _q_rel(s.get("macd_signal"), close, 1e4),
+            _q_rel(s.get("macd_hist"), close, 1e4),
+            _q_ratio(s.get("volume"), s.get("volume_ma")),
+            bool(s.get("ma_trend_up")),
+            bool(s.get("price_above_ma")),
+            bool(s.get("macd_cross_up")),
+            bool(s.get("volume_spike")),
+        ]
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def prompt_hash(*parts: Optional[str]) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update((p or "").encode())
+        h.update(b"\x00")
+    return h.hexdigest()[:16]
+
+
+class DecisionCache:
+    """
+    TTL + LRU. Если подключено хранилище (attach_storage), записи дублируются в SQLite
+    и подгружаются при старте (await warm()) — попадания переживают рестарт.
+    """
+
+    def __init__(self, ttl_seconds: float = 1800.0, max_entries: int = 2048):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._storage = None
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def attach_storage(self, storage) -> None:
+        self._storage = storage
+        self._loaded = False
+
+    @staticmethod
+    def make_key(symbol: str, model: str, sensitivity: str, template_hash: str, snapshots: Dict[str, Dict[str, Any]]) -> str:
+        return "|".join((symbol, model, sensitivity, template_hash, snapshot_fingerprint(snapshots)))
+
+    async def warm(self) -> int:
+        """
+        Подгрузить живые записи из хранилища (один раз, при старте): запрос идёт в потоке БД,
+        event loop не ждёт его синхронно. Возвращает число загруженных записей.
+        """
+        if self._loaded or self._storage is None:
+            return 0
+        self._loaded = True
+        try:
+            rows = await self._storage.run(self._storage.load_llm_cache, time.time(), self.max_entries)
+        except Exception as e:
+            log.warning("decision cache: не удалось загрузить из БД: %s", e)
+            return 0
+        loaded = 0
+        with self._lock:
+            for k, v, expires_at in rows:
+                if k in self._data:
+                    continue  # уже успели положить свежее решение
+                try:
+                    self._data[k] = (expires_at, json.loads(v))
+                except Exception:
+                    continue
+                loaded += 1
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        log.info("decision cache: из БД загружено %d решений", loaded)
+        return loaded
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.time():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return dict(item[1])
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        if self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, dict(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        if self._storage is not None:
+            try:
+                self._storage.put_llm_cache(key, json.dumps(value, ensure_ascii=False), expires_at)
+            except Exception as e:
+                log.warning("decision cache: не удалось сохранить в БД: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
+
+
+# Один кэш на процесс (анализаторы в командах создаются заново, кэш — общий)
+DECISION_CACHE = DecisionCache(
+    ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", "1800")),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048")),
+)
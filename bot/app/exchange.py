@@ -1,14 +1,270 @@
+import asyncio
 import ccxt
+import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Callable, Optional, Tuple
 import os
+import threading
+import time
 import logging
 
+from .candle_store import CandleStore
+from .metrics import METRICS
+
 log = logging.getLogger("exchange")
 
-class ExchangeClient:
-    def __init__(self, exchange_id: str):
+_REQ_TAIL = METRICS.histogram("bot_exchange_request_seconds", "REST-запрос свечей к бирже", kind="tail")
+_REQ_FULL = METRICS.histogram("bot_exchange_request_seconds", "REST-запрос свечей к бирже", kind="full")
+
+OHLCV_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+_TF_UNITS_MS = {
+    "s": 1000,
+    "m": 60 * 1000,
+    "h": 60 * 60 * 1000,
+    "d": 24 * 60 * 60 * 1000,
+    "w": 7 * 24 * 60 * 60 * 1000,
+    "M": 30 * 24 * 60 * 60 * 1000,
+    "y": 365 * 24 * 60 * 60 * 1000,
+}
+
+
+# Больше этого за один запрос большинство бирж не отдаёт; длинная история качается страницами
+FETCH_PAGE_LIMIT = 1000
+
+
+def timeframe_ms(timeframe: str) -> int:
+    """'4h' -> 14400000. Месяц/год — приблизительно, как и в ccxt."""
+    amount, unit = timeframe[:-1], timeframe[-1]
+    if unit not in _TF_UNITS_MS or not amount.isdigit():
+        raise ValueError(f"Unsupported timeframe: {timeframe}")
+    return int(amount) * _TF_UNITS_MS[unit]
+
+
+def candles_to_frame(candles: np.ndarray) -> pd.DataFrame:
+    """Массив (n, 6) [ts_ms, o, h, l, c, v] -> DataFrame с UTC-индексом, как раньше отдавал fetch_ohlcv."""
+    df = pd.DataFrame(candles, columns=OHLCV_COLUMNS)
+    df["timestamp"] = pd.to_datetime(df["timestamp"].astype("int64"), unit="ms", utc=True)
+    df.set_index("timestamp", inplace=True)
+    return df
+
+
+class CandleCache:
+    """
+    Общий на процесс кэш свечей: (exchange, symbol, timeframe) -> массив (n, 6) float64.
+
+    Последняя свеча в кэше считается формирующейся: при следующем запросе
+    история докачивается с её timestamp (since), и она перезаписывается свежей версией.
+    Массивы не мутируются — merge собирает новый, так что выданные ранее срезы остаются валидными.
+    """
+
+    def __init__(self, max_candles: int = 3000, fresh_seconds: float = 10.0):
+        self.max_candles = max_candles
+        self.fresh_seconds = fresh_seconds
+        self._data: dict[tuple, np.ndarray] = {}
+        self._fetched_at: dict[tuple, float] = {}
+        self._exhausted: dict[tuple, bool] = {}  # биржа отдала меньше, чем просили — глубже истории нет
+        self._locks: dict[tuple, threading.Lock] = {}
+        self._guard = threading.Lock()
+        # статистика (для оценки экономии запросов)
+        self.hits = 0
+        self.tail_fetches = 0
+        self.full_fetches = 0
+
+    def lock(self, key: tuple) -> threading.Lock:
+        with self._guard:
+            lk = self._locks.get(key)
+            if lk is None:
+                lk = self._locks[key] = threading.Lock()
+            return lk
+
+    def get(self, key: tuple) -> Optional[np.ndarray]:
+        return self._data.get(key)
+
+    def has_depth(self, key: tuple, limit: int) -> bool:
+        arr = self._data.get(key)
+        if arr is None or len(arr) == 0:
+            return False
+        return len(arr) >= limit or self._exhausted.get(key, False)
+
+    def is_fresh(self, key: tuple) -> bool:
+        ts = self._fetched_at.get(key)
+        return ts is not None and (time.monotonic() - ts) < self.fresh_seconds
+
+    def tail_since(self, key: tuple) -> Optional[int]:
+        """С какого timestamp (ms) докачивать: с последней (возможно, незакрытой) свечи."""
+        arr = self._data.get(key)
+        if arr is None or len(arr) == 0:
+            return None
+        return int(arr[-1, 0])
+
+    def seed(self, key: tuple, candles: np.ndarray) -> None:
+        """Подкладывает историю с диска; свежей она не считается — следующий запрос докачает хвост."""
+        self._data[key] = candles[-self.max_candles:]
+        self._exhausted[key] = False
+
+    def replace(self, key: tuple, rows, requested: int) -> np.ndarray:
+        arr = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+        old = self._data.get(key)
+        # полная выгрузка перекрывает то, что уже есть (например, с диска) — старую часть не теряем
+        if old is not None and len(old) and len(arr) and arr[0, 0] <= old[-1, 0]:
+            cut = int(np.searchsorted(old[:, 0], arr[0, 0], side="left"))
+            arr = np.concatenate((old[:cut], arr))
+        arr = arr[-self.max_candles:]
+        self._data[key] = arr
+        self._exhausted[key] = len(arr) < requested
+        self._fetched_at[key] = time.monotonic()
+        self.full_fetches += 1
+        return arr
+
+    def merge(self, key: tuple, rows) -> np.ndarray:
+        """Вливает хвост: всё, что в кэше начиная с первой новой свечи, заменяется новыми данными."""
+        new = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+        old = self._data.get(key)
+        if old is None or len(old) == 0:
+            merged = new
+        elif len(new) == 0:
+            merged = old
+        else:
+            cut = int(np.searchsorted(old[:, 0], new[0, 0], side="left"))
+            merged = np.concatenate((old[:cut], new))
+        merged = merged[-self.max_candles:]
+        self._data[key] = merged
+        self._fetched_at[key] = time.monotonic()
+        self.tail_fetches += 1
+        return merged
+
+    def put_bar(self, key: tuple, row) -> Optional[np.ndarray]:
+        """Одна закрытая свеча из потока. Без истории в кэше ряд не начинаем — его подтянет REST."""
+        old = self._data.get(key)
+        if old is None or len(old) == 0:
+            return None
+        bar = np.asarray(row, dtype=np.float64).reshape(1, 6)
+        cut = int(np.searchsorted(old[:, 0], bar[0, 0], side="left"))
+        # всё, что в кэше после этой свечи, — устаревшие версии формирующегося бара
+        merged = np.concatenate((old[:cut], bar))[-self.max_candles:]
+        self._data[key] = merged
+        self._fetched_at[key] = time.monotonic()
+        return merged
+
+    def touch(self, key: tuple) -> None:
+        """Ряд подтверждён живым потоком — считать его свежим (REST не нужен)."""
+        self._fetched_at[key] = time.monotonic()
+
+    def expire(self, key: tuple) -> None:
+        """Снять свежесть: следующий запрос обязательно сходит за хвостом на биржу."""
+        self._fetched_at.pop(key, None)
+
+    def drop(self, key: tuple) -> None:
+        """Забыть ряд (пара ушла из наблюдения или к другому процессу)."""
+        self._data.pop(key, None)
+        self._fetched_at.pop(key, None)
+        self._exhausted.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self._data),
+            "hits": self.hits,
+            "tail_fetches": self.tail_fetches,
+            "full_fetches": self.full_fetches,
+        }
+
+
+# Один кэш на процесс: его разделяют все ExchangeClient (автоцикл, /check, /checkall)
+CANDLE_CACHE = CandleCache(
+    max_candles=int(os.getenv("CANDLE_CACHE_MAX", "3000")),
+    fresh_seconds=float(os.getenv("CANDLE_CACHE_FRESH_SECONDS", "10")),
+)
+
+
+class _CandleSource:
+    """
+    Общая логика кэша/хранилища для синхронного и асинхронного клиентов.
+    Сами клиенты только делают сетевой запрос: шаги _plan -> (tail) -> (full).
+    """
+
+    exchange_id: str
+    cache: CandleCache
+    store: Optional[CandleStore]
+    clock: Callable[[], float]  # «сейчас» в секундах (time.time); бенчмарк подставляет часы синтетической биржи
+
+    def _plan(self, key: tuple, timeframe: str, limit: int):
+        """(готовый массив | None, since | None, tail_limit)."""
+        cache = self.cache
+        if not cache.has_depth(key, limit):
+            return None, None, limit
+        if cache.is_fresh(key):
+            cache.hits += 1
+            return cache.get(key), None, limit
+        since = cache.tail_since(key)
+        now_ms = int(self.clock() * 1000)
+        expected = max(1, (now_ms - since) // timeframe_ms(timeframe) + 1)
+        return None, since, min(expected + 1, limit)
+
+    def _pages(self, timeframe: str, limit: int) -> Optional[Tuple[int, int]]:
+        """
+        Полная выгрузка длиннее страницы идёт страницами вперёд: (since первой страницы, начало текущего бара).
+        None — хватит одного запроса.
+        """
+        if limit <= FETCH_PAGE_LIMIT:
+            return None
+        tf = timeframe_ms(timeframe)
+        now_ms = int(self.clock() * 1000)
+        current = now_ms - now_ms % tf
+        return current - (limit - 1) * tf, current
+
+    @staticmethod
+    def _extend_page(rows: list, page: list, current: int) -> Optional[int]:
+        """Дописывает страницу к rows; возвращает since следующей страницы или None, если дошли до конца."""
+        last = rows[-1][0] if rows else None
+        fresh = [r for r in page if last is None or r[0] > last]
+        rows.extend(fresh)
+        if len(page) < FETCH_PAGE_LIMIT or not fresh or fresh[-1][0] >= current:
+            return None
+        return int(fresh[-1][0]) + 1
+
+    # _apply_* только обновляют кэш и возвращают (массив, запись на диск | None): писать на диск клиент
+    # решает сам — синхронный сразу, асинхронный в треде (flock файла может держать другой процесс)
+    def _apply_tail(self, key: tuple, rows, tail_limit: int) -> Tuple[Optional[np.ndarray], Optional[tuple]]:
+        # полная страница — возможно, догнали не до конца (долгий простой); тогда качаем заново
+        if rows and len(rows) < tail_limit:
+            return self.cache.merge(key, rows), (key, rows, False)
+        if not rows and tail_limit <= 2:
+            return self.cache.merge(key, []), None
+        return None, None
+
+    def _apply_full(self, key: tuple, rows, limit: int) -> Tuple[Optional[np.ndarray], Optional[tuple]]:
+        if not rows:
+            return None, None
+        prev = self.cache.get(key)
+        arr = self.cache.replace(key, rows, limit)
+        overlap = prev is not None and len(prev) > 0 and rows[0][0] <= prev[-1, 0]
+        return arr, (key, rows, not overlap)
+
+    def _load_from_store(self, key: tuple) -> None:
+        if self.store is None or self.cache.get(key) is not None:
+            return
+        try:
+            candles = self.store.load(*key, limit=self.cache.max_candles)
+        except Exception as e:
+            log.warning("Candle store: не удалось прочитать %s: %s", key, e)
+            return
+        if candles is not None and len(candles):
+            self.cache.seed(key, candles)
+
+    def persist(self, key: tuple, rows, replace: bool = False) -> None:
+        """Дописать свечи в локальное хранилище (если оно включено). Синхронная запись на диск."""
+        if self.store is None or not rows:
+            return
+        try:
+            self.store.write(*key, np.asarray(rows, dtype=np.float64), replace=replace)
+        except Exception as e:
+            log.warning("Candle store: не удалось записать %s: %s", key, e)
+
+
+class ExchangeClient(_CandleSource):
+    def __init__(self, exchange_id: str, cache: Optional[CandleCache] = None, state_dir: Optional[str] = None):
         proxy_url = os.getenv("PROXY_URL")
         params = {
             "enableRateLimit": True,
@@ -23,6 +279,11 @@ class ExchangeClient:
 
         ex_class = getattr(ccxt, exchange_id)
         self.ex = ex_class(params)
+        self.exchange_id = exchange_id
+        self.cache = cache or CANDLE_CACHE
+        self.clock = time.time
+        # локальное хранилище свечей: тёплый рестарт начинается с докачки хвоста, а не с полной истории
+        self.store = CandleStore(state_dir) if state_dir else None
 
         # покажем, что ccxt реально видит прокси
         try:
@@ -31,18 +292,168 @@ class ExchangeClient:
         except Exception:
             pass
 
+    def fetch_candles(
+        self, symbol: str, timeframe: str, limit: int
+    ) -> Optional[np.ndarray]:
+        """
+        Последние `limit` свечей массивом (n, 6) [ts_ms, o, h, l, c, v].
+        Полная история качается один раз, дальше — только хвост начиная с формирующейся свечи.
+        """
+        key = (self.exchange_id, symbol, timeframe)
+        with self.cache.lock(key):
+            self._load_from_store(key)
+            arr, since, tail_limit = self._plan(key, timeframe, limit)
+            if arr is None and since is not None:
+                with _REQ_TAIL.time():
+                    rows = self.ex.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=tail_limit)
+                arr, write = self._apply_tail(key, rows, tail_limit)
+                if write:
+                    self.persist(*write)
+            if arr is None:
+                with _REQ_FULL.time():
+                    rows = self._fetch_full(symbol, timeframe, limit)
+                arr, write = self._apply_full(key, rows, limit)
+                if write:
+                    self.persist(*write)
+        return None if arr is None else arr[-limit:]
+
+    def _fetch_full(self, symbol: str, timeframe: str, limit: int) -> list:
+        pages = self._pages(timeframe, limit)
+        if pages is None:
+            return self.ex.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+        since, current = pages
+        rows: list = []
+        for _ in range(limit // FETCH_PAGE_LIMIT + 2):
+            page = self.ex.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=FETCH_PAGE_LIMIT)
+            since = self._extend_page(rows, page, current)
+            if since is None:
+                break
+        return rows
+
     def fetch_ohlcv(
         self, symbol: str, timeframe: str, limit: int
     ) -> Optional[pd.DataFrame]:
-        data = self.ex.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
-        if not data:
+        candles = self.fetch_candles(symbol, timeframe, limit)
+        if candles is None or len(candles) == 0:
             return None
-        df = pd.DataFrame(
-            data, columns=["timestamp", "open", "high", "low", "close", "volume"]
+        return candles_to_frame(candles)
+
+    def load_markets(self) -> None:
+        """Загрузить справочник рынков заранее, чтобы первый запрос команды не платил за него."""
+        self.ex.load_markets()
+
+    def fetch_tickers(self) -> dict:
+        """Тикеры всех пар биржи одним запросом."""
+        return self.ex.fetch_tickers()
+
+
+# Одна HTTP-сессия на процесс для всех асинхронных клиентов (keep-alive, ограниченный пул соединений)
+_http_session = None
+
+
+def _shared_http_session():
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=int(os.getenv("EXCHANGE_POOL_SIZE", "64")),
+            limit_per_host=int(os.getenv("EXCHANGE_POOL_PER_HOST", "32")),
+            keepalive_timeout=60,
+            enable_cleanup_closed=True,
         )
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="ms", utc=True)
-        df.set_index("timestamp", inplace=True)
-        return df
+        _http_session = aiohttp.ClientSession(connector=connector, trust_env=False)
+    return _http_session
+
+
+class AsyncExchangeClient(_CandleSource):
+    """
+    То же, что ExchangeClient, но на ccxt.async_support: запросы не занимают треды из run_sync,
+    поэтому сотни пар/TF можно качать одновременно (предел — пул соединений и rate limit биржи).
+    Создавать внутри работающего event loop; закрывать через close().
+    """
+
+    def __init__(self, exchange_id: str, cache: Optional[CandleCache] = None, state_dir: Optional[str] = None):
+        import ccxt.async_support as ccxt_async
+
+        proxy_url = os.getenv("PROXY_URL")
+        params = {
+            "enableRateLimit": True,
+            "timeout": 60000,
+            "session": _shared_http_session(),
+        }
+        ex_class = getattr(ccxt_async, exchange_id)
+        self.ex = ex_class(params)
+        if proxy_url:
+            # aiohttp принимает прокси на уровне запроса — ccxt прокидывает его сам
+            self.ex.aiohttp_proxy = proxy_url
+        self.exchange_id = exchange_id
+        self.cache = cache or CANDLE_CACHE
+        self.clock = time.time
+        self.store = CandleStore(state_dir) if state_dir else None
+        self._locks: dict[tuple, asyncio.Lock] = {}
+
+    async def fetch_candles(
+        self, symbol: str, timeframe: str, limit: int
+    ) -> Optional[np.ndarray]:
+        key = (self.exchange_id, symbol, timeframe)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        async with lock:
+            if self.store is not None and self.cache.get(key) is None:
+                await asyncio.to_thread(self._load_from_store, key)
+            arr, since, tail_limit = self._plan(key, timeframe, limit)
+            if arr is None and since is not None:
+                with _REQ_TAIL.time():
+                    rows = await self.ex.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=tail_limit)
+                arr, write = self._apply_tail(key, rows, tail_limit)
+                if write and self.store is not None:
+                    await asyncio.to_thread(self.persist, *write)
+            if arr is None:
+                with _REQ_FULL.time():
+                    rows = await self._fetch_full(symbol, timeframe, limit)
+                arr, write = self._apply_full(key, rows, limit)
+                if write and self.store is not None:
+                    await asyncio.to_thread(self.persist, *write)
+        return None if arr is None else arr[-limit:]
+
+    async def _fetch_full(self, symbol: str, timeframe: str, limit: int) -> list:
+        pages = self._pages(timeframe, limit)
+        if pages is None:
+            return await self.ex.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+        since, current = pages
+        rows: list = []
+        for _ in range(limit // FETCH_PAGE_LIMIT + 2):
+            page = await self.ex.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=FETCH_PAGE_LIMIT)
+            since = self._extend_page(rows, page, current)
+            if since is None:
+                break
+        return rows
+
+    async def fetch_ohlcv(
+        self, symbol: str, timeframe: str, limit: int
+    ) -> Optional[pd.DataFrame]:
+        candles = await self.fetch_candles(symbol, timeframe, limit)
+        if candles is None or len(candles) == 0:
+            return None
+        return candles_to_frame(candles)
+
+    async def load_markets(self) -> None:
+        await self.ex.load_markets()
+
+    async def fetch_tickers(self) -> dict:
+        return await self.ex.fetch_tickers()
+
+    async def close(self) -> None:
+        await self.ex.close()
+
+
+async def close_http_session() -> None:
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
 
 
 def ts_now_iso() -> str:
@@ -0,0 +1,206 @@
+import math
+import threading
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .indicators import vol_ma_window_for
+
+# Потоковые индикаторы: на каждую новую свечу — O(1) работы вместо пересчёта всех 300.
+# Математика та же, что в indicators.snapshot_arrays (SMA-затравка EMA, сигнальная линия
+# стартует с первого валидного MACD). Разница с пакетным расчётом — только в точке старта EMA
+# (у пакетного она «ездит» вместе с окном 300 свечей), после сотни баров это ~1e-9 относительно.
+
+_NAN = float("nan")
+
+
+class _Ema:
+    __slots__ = ("length", "alpha", "value", "_n", "_seed", "_saved")
+
+    def __init__(self, length: int):
+        self.length = length
+        self.alpha = 2.0 / (length + 1)
+        self.value = _NAN
+        self._n = 0
+        self._seed = 0.0
+        self._saved = (_NAN, 0, 0.0)
+
+    def push(self, x: float) -> float:
+        self._saved = (self.value, self._n, self._seed)
+        self._n += 1
+        if self._n < self.length:
+            self._seed += x
+        elif self._n == self.length:
+            self._seed += x
+            self.value = self._seed / self.length
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+    def revise(self, x: float) -> float:
+        """Пересчитать последнее значение для обновлённой (формирующейся) свечи."""
+        self.value, self._n, self._seed = self._saved
+        return self.push(x)
+
+
+class _RollingMean:
+    __slots__ = ("window", "_buf", "_pos", "_n", "_total")
+
+    def __init__(self, window: int):
+        self.window = window
+        self._buf = [0.0] * window
+        self._pos = 0
+        self._n = 0
+        self._total = 0.0
+
+    def push(self, x: float) -> None:
+        if self._n >= self.window:
+            self._total -= self._buf[self._pos]
+        self._buf[self._pos] = x
+        self._total += x
+        self._pos = (self._pos + 1) % self.window
+        self._n += 1
+        if self._pos == 0:
+            # раз за оборот кольца пересчитываем сумму — чтобы не копилась ошибка округления
+            self._total = math.fsum(self._buf)
+
+    def revise(self, x: float) -> None:
+        last = (self._pos - 1) % self.window
+        self._total += x - self._buf[last]
+        self._buf[last] = x
+
+    @property
+    def value(self) -> float:
+        return self._total / self.window if self._n >= self.window else _NAN
+
+
+class IndicatorState:
+    """
+    Состояние индикаторов одной пары/TF: бегущие EMA для MACD, кольцевые буферы для MA и MA объёма,
+    значения предыдущего бара для детекции пересечений.
+    update() — новая свеча, revise_last() — обновление текущей (ещё не закрытой) свечи.
+    """
+
+    def __init__(self, ma_window: int, fast: int, slow: int, signal: int):
+        if fast > slow:
+            fast, slow = slow, fast
+        self.ma_window = ma_window
+        self.fast = fast
+        self.slow = slow
+        self.signal = signal
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self._ema_fast = _Ema(self.fast)
+        self._ema_slow = _Ema(self.slow)
+        self._ema_signal = _Ema(self.signal)
+        self._ma = _RollingMean(self.ma_window)
+        self._vol_ma = _RollingMean(vol_ma_window_for(self.ma_window))
+        self._n = 0
+        self.last_ts: Optional[float] = None
+        # (close, volume, ma, macd, macd_signal) для предыдущего и последнего бара
+        self._prev = (_NAN,) * 5
+        self._last = (_NAN,) * 5
+
+    @classmethod
+    def from_candles(cls, candles: np.ndarray, ma_window: int, fast: int, slow: int, signal: int) -> "IndicatorState":
+        st = cls(ma_window, fast, slow, signal)
+        st.feed(candles)
+        return st
+
+    def feed(self, candles: np.ndarray) -> None:
+        for row in candles.tolist():
+            self.update(row)
+
+    def _apply(self, candle: Sequence[float], revise: bool) -> None:
+        close = float(candle[4])
+        volume = float(candle[5])
+        if revise:
+            self._ma.revise(close)
+            self._vol_ma.revise(volume)
+            fast = self._ema_fast.revise(close)
+            slow = self._ema_slow.revise(close)
+        else:
+            self._ma.push(close)
+            self._vol_ma.push(volume)
+            fast = self._ema_fast.push(close)
+            slow = self._ema_slow.push(close)
+            self._n += 1
+        line = fast - slow
+        sig = _NAN
+        if self._n >= self.slow:
+            # сигнальная линия получает MACD начиная с первого валидного значения
+            sig = self._ema_signal.revise(line) if revise else self._ema_signal.push(line)
+        self.last_ts = float(candle[0])
+        self._last = (close, volume, self._ma.value, line, sig)
+
+    def update(self, candle: Sequence[float]) -> None:
+        self._prev = self._last
+        self._apply(candle, revise=False)
+
+    def revise_last(self, candle: Sequence[float]) -> None:
+        if self._n == 0:
+            self.update(candle)
+            return
+        self._apply(candle, revise=True)
+
+    def snapshot(self) -> dict:
+        """Те же поля, что indicators.latest_snapshot."""
+        close, volume, ma, line, sig = self._last
+        p_close, p_volume, p_ma, p_line, p_sig = self._prev
+        vol_ma = self._vol_ma.value
+        return {
+            "close": close,
+            "ma": ma,
+            "macd": line,
+            "macd_signal": sig,
+            "macd_hist": line - sig,
+            "volume": volume,
+            "volume_ma": vol_ma,
+            "ma_trend_up": bool(ma > p_ma),
+            "price_above_ma": bool(close >= ma),
+            "macd_cross_up": bool(line > sig and p_line <= p_sig),
+            "volume_spike": bool(volume > 1.5 * vol_ma),
+        }
+
+
+class IndicatorBook:
+    """
+    Реестр IndicatorState: (exchange, symbol, tf) + параметры индикаторов -> состояние.
+    snapshot() сверяет состояние с массивом свечей из кэша: последнюю известную свечу
+    пересчитывает (она могла дорисоваться), новые докидывает через update().
+    Если история «разошлась» (дыра, другой хвост) — состояние строится заново.
+    """
+
+    def __init__(self):
+        self._states: dict[tuple, IndicatorState] = {}
+        self._guard = threading.Lock()
+
+    def snapshot(self, key: tuple, candles: np.ndarray, ma_window: int, fast: int, slow: int, signal: int) -> dict:
+        full_key = (*key, ma_window, fast, slow, signal)
+        with self._guard:
+            st = self._states.get(full_key)
+            if st is None:
+                st = self._states[full_key] = IndicatorState(ma_window, fast, slow, signal)
+        with st.lock:
+            ts = candles[:, 0]
+            idx = -1
+            if st.last_ts is not None:
+                idx = int(np.searchsorted(ts, st.last_ts, side="left"))
+                if idx >= len(ts) or ts[idx] != st.last_ts:
+                    idx = -1
+            if idx < 0:
+                st.reset()
+                st.feed(candles)
+            else:
+                rows = candles[idx:].tolist()
+                st.revise_last(rows[0])
+                for row in rows[1:]:
+                    st.update(row)
+            return st.snapshot()
+
+    def drop(self, key: tuple) -> None:
+        with self._guard:
+            for k in [k for k in self._states if k[:len(key)] == key]:
+                del self._states[k]
@@ -1,25 +1,189 @@
+import numpy as np
 import pandas as pd
-import pandas_ta as ta
+
+# Индикаторы считаются на numpy: непрерывные float64-массивы, любые fast/slow/signal.
+# Последняя ось — время, так что те же функции считают и одну пару (T,), и пакет (N пар, T свечей).
+
+
+def vol_ma_window_for(ma_window: int) -> int:
+    return max(10, ma_window // 2)
+
+
+def sma(x: np.ndarray, window: int) -> np.ndarray:
+    """Простая скользящая по последней оси; первые window-1 значений — NaN (как rolling().mean())."""
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    n = x.shape[-1]
+    if window <= 0 or n < window:
+        return out
+    cs = np.cumsum(x, axis=-1)
+    out[..., window - 1] = cs[..., window - 1]
+    out[..., window:] = cs[..., window:] - cs[..., :-window]
+    out[..., window - 1:] /= window
+    return out
+
+
+def ema(x: np.ndarray, length: int, start: int = 0) -> np.ndarray:
+    """
+    EMA с затравкой SMA по первым `length` значениям (как pandas_ta.ema по умолчанию).
+    start — индекс первого валидного значения (для сигнальной линии MACD всё до него NaN).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    n = x.shape[-1]
+    first = start + length - 1
+    if length <= 0 or n <= first:
+        return out
+    alpha = 2.0 / (length + 1)
+    if x.ndim == 1:
+        # одна пара: рекурсия на питоновских float заметно быстрее numpy-скаляров
+        vals = x.tolist()
+        prev = sum(vals[start:first + 1]) / length
+        res = vals  # переиспользуем список под результат
+        res[first] = prev
+        for t in range(first + 1, n):
+            prev += alpha * (vals[t] - prev)
+            res[t] = prev
+        out[first:] = res[first:]
+        return out
+    prev = x[..., start:first + 1].mean(axis=-1)
+    out[..., first] = prev
+    for t in range(first + 1, n):
+        prev = prev + alpha * (x[..., t] - prev)
+        out[..., t] = prev
+    return out
+
+
+def macd(close: np.ndarray, fast: int, slow: int, signal: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(macd, signal, hist) — та же математика, что у pandas_ta.macd, но с любыми параметрами."""
+    if fast > slow:
+        fast, slow = slow, fast
+    line = ema(close, fast) - ema(close, slow)
+    sig = ema(line, signal, start=slow - 1)
+    return line, sig, line - sig
+
+
+def _snapshot_from_tail(
+    close: np.ndarray,
+    volume: np.ndarray,
+    ma: np.ndarray,
+    macd_line: np.ndarray,
+    macd_sig: np.ndarray,
+    vol_ma: np.ndarray,
+) -> dict:
+    """Аргументы — пары значений [prev, last] для одной пары."""
+    return {
+        "close": float(close[-1]),
+        "ma": float(ma[-1]),
+        "macd": float(macd_line[-1]),
+        "macd_signal": float(macd_sig[-1]),
+        "macd_hist": float(macd_line[-1] - macd_sig[-1]),
+        "volume": float(volume[-1]),
+        "volume_ma": float(vol_ma[-1]),
+        "ma_trend_up": bool(ma[-1] > ma[-2]),
+        "price_above_ma": bool(close[-1] >= ma[-1]),
+        "macd_cross_up": bool(macd_line[-1] > macd_sig[-1] and macd_line[-2] <= macd_sig[-2]),
+        "volume_spike": bool(volume[-1] > 1.5 * vol_ma[-1]),
+    }
+
+
+def _tail_sma(x: np.ndarray, window: int) -> np.ndarray:
+    """SMA только для двух последних свечей: [..., prev, last]."""
+    last = x[..., -window:].mean(axis=-1)
+    if x.shape[-1] > window:
+        prev = x[..., -window - 1:-1].mean(axis=-1)
+    else:
+        prev = np.full(np.shape(last), np.nan)
+    return np.stack((prev, last), axis=-1)
+
+
+def snapshot_arrays(
+    close: np.ndarray,
+    volume: np.ndarray,
+    ma_window: int,
+    fast: int,
+    slow: int,
+    signal: int,
+) -> dict | list[dict]:
+    """
+    Поля latest_snapshot прямо из массивов close/volume, без DataFrame.
+    1-D вход -> dict, 2-D (пары × свечи) -> list[dict] в порядке строк.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    volume = np.ascontiguousarray(volume, dtype=np.float64)
+    line, sig, _ = macd(close, fast, slow, signal)
+    ma = _tail_sma(close, ma_window)
+    vol_ma = _tail_sma(volume, vol_ma_window_for(ma_window))
+    if close.ndim == 1:
+        return _snapshot_from_tail(close[-2:], volume[-2:], ma, line[-2:], sig[-2:], vol_ma)
+    return [
+        _snapshot_from_tail(close[i, -2:], volume[i, -2:], ma[i], line[i, -2:], sig[i, -2:], vol_ma[i])
+        for i in range(close.shape[0])
+    ]
+
+
+def snapshot_series(
+    close: np.ndarray,
+    volume: np.ndarray,
+    ma_window: int,
+    fast: int,
+    slow: int,
+    signal: int,
+) -> dict[str, np.ndarray]:
+    """
+    Поля latest_snapshot сразу для каждой свечи: i-й элемент — снапшот по истории close[:i + 1]
+    (EMA считается от начала ряда). Для бэктеста — вся история одним проходом, без цикла по барам.
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    volume = np.ascontiguousarray(volume, dtype=np.float64)
+    ma = sma(close, ma_window)
+    vol_ma = sma(volume, vol_ma_window_for(ma_window))
+    line, sig, hist = macd(close, fast, slow, signal)
+    # «предыдущая свеча» для первой — она же (как prev = last в latest_snapshot); NaN-сравнения дают False
+    ma_prev = np.concatenate((ma[:1], ma[:-1]))
+    line_prev = np.concatenate((line[:1], line[:-1]))
+    sig_prev = np.concatenate((sig[:1], sig[:-1]))
+    return {
+        "close": close,
+        "ma": ma,
+        "macd": line,
+        "macd_signal": sig,
+        "macd_hist": hist,
+        "volume": volume,
+        "volume_ma": vol_ma,
+        "ma_trend_up": ma > ma_prev,
+        "price_above_ma": close >= ma,
+        "macd_cross_up": (line > sig) & (line_prev <= sig_prev),
+        "volume_spike": volume > 1.5 * vol_ma,
+    }
+
+
+def compute_snapshot(candles: np.ndarray, ma_window: int, fast: int, slow: int, signal: int) -> dict:
+    """Снапшот по массиву свечей (n, 6) [ts, o, h, l, c, v] из ExchangeClient.fetch_candles."""
+    return snapshot_arrays(candles[:, 4], candles[:, 5], ma_window, fast, slow, signal)
+
 
 def add_indicators(df: pd.DataFrame, ma_window: int, fast: int, slow: int, signal: int) -> pd.DataFrame:
     # Защита
     df = df.copy()
+    close = df["close"].to_numpy(dtype=np.float64)
+    volume = df["volume"].to_numpy(dtype=np.float64)
+
     # Простая скользящая
-    df[f"ma_{ma_window}"] = df["close"].rolling(ma_window).mean()
+    df[f"ma_{ma_window}"] = sma(close, ma_window)
 
-    # MACD (используем pandas_ta)
-    macd = ta.macd(df["close"], fast=fast, slow=slow, signal=signal)
-    df["macd"] = macd["MACD_12_26_9"]
-    df["macd_signal"] = macd["MACDs_12_26_9"]
-    df["macd_hist"] = macd["MACDh_12_26_9"]
+    # MACD
+    line, sig, hist = macd(close, fast, slow, signal)
+    df["macd"] = line
+    df["macd_signal"] = sig
+    df["macd_hist"] = hist
 
     # Объём и его MA для оценки всплесков
-    vol_ma_window = max(10, ma_window // 2)
-    df[f"vol_ma_{vol_ma_window}"] = df["volume"].rolling(vol_ma_window).mean()
-
-    # Флаги состояний (последняя свеча)
+    vol_ma_window = vol_ma_window_for(ma_window)
+    df[f"vol_ma_{vol_ma_window}"] = sma(volume, vol_ma_window)
     return df
 
+
 def latest_snapshot(df: pd.DataFrame, ma_window: int) -> dict:
     last = df.iloc[-1]
     prev = df.iloc[-2] if len(df) >= 2 else last
@@ -1,20 +1,35 @@
 import asyncio
+import functools
+import html
 import logging
+import os
+import time
 from contextlib import asynccontextmanager
-from datetime import datetime, timezone, timedelta
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Optional
 
 from aiogram import Bot, Dispatcher, Router
 from aiogram.enums import ParseMode
-from aiogram.types import Message
+from aiogram.types import FSInputFile, Message
 from aiogram.filters import CommandStart, Command
 
-from .config import load_settings
-from .exchange import ExchangeClient, ts_now_iso
-from .indicators import add_indicators, latest_snapshot
+from .config import Settings, load_settings
+from .exchange import ExchangeClient, AsyncExchangeClient, close_http_session, timeframe_ms, ts_now_iso
+from .snapshots import build_snapshots_triple, fetch_triple, snapshots_from_candles
 from .analyzer import LLMAnalyzer
+from .prefilter import gate_stats
+from .decision_cache import DECISION_CACHE
 from .storage import Storage
-from .scheduler import run_sync
+from .retention import Retention
+from .scheduler import CandleCloseScheduler, run_sync
+from .pipeline import BatchingDecider, Pipeline, add_stage_observer
+from .metrics import METRICS, start_http
+from .profiler import profile_for
+from .recorder import install_recorder
+from .outbox import Outbox
+from .workers import WorkerPool
+from .streaming import KlineStreamer
+from .screener import Screener, ScreenerParams
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 log = logging.getLogger("bot")
@@ -27,69 +42,115 @@ async def lifespan(dp: Dispatcher):
 active = True
 router = Router()
 
+_CYCLE_SECONDS = METRICS.histogram("bot_cycle_seconds", "Один проход автоцикла")
+_CYCLE_PAIRS = METRICS.counter("bot_cycle_pairs_total", "Пар обработано автоциклом")
+_DECIDE_SECONDS = METRICS.histogram("bot_stage_seconds", stage="decide")
+
 # ----------------- Утилиты -----------------
 
-def _within_cooldown(storage: Storage, symbol: str, timeframe: str, hours: int) -> bool:
-    last = storage.last_buy_ts(symbol, timeframe)
-    if not last:
-        return False
-    try:
-        last_dt = datetime.fromisoformat(last.replace("Z", "+00:00"))
-    except Exception:
-        return False
-    return (datetime.now(timezone.utc) - last_dt) < timedelta(hours=hours)
+def _timed(command: str):
+    """Длительность хендлера команды -> bot_command_seconds{command=...}. aiogram видит исходную сигнатуру."""
+    hist = METRICS.histogram("bot_command_seconds", "Обработка команды целиком", command=command)
+
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with hist.time():
+                return await fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def _is_admin(msg: Message, settings: Settings) -> bool:
+    return msg.from_user is not None and msg.from_user.id in settings.admin_ids
 
 def _norm_symbol(s: str) -> str:
     return s.upper().replace(":", "/").replace(" ", "")
 
-async def _build_snapshots_triple(
-    ex: ExchangeClient,
-    symbol: str,
-    tfs: List[str],
-    ma_window: int,
-    macd_fast: int,
-    macd_slow: int,
-    macd_signal: int,
-):
-    """
-    Возвращает dict: { '1w': snapshot, '1d': snapshot, '4h': snapshot }
-    или None если по какому-то TF не хватает данных.
-    """
-    result = {}
-    for tf in tfs:
-        df = await run_sync(ex.fetch_ohlcv, symbol, tf, 300)
-        if df is None or len(df) < max(ma_window, macd_slow) + 5:
-            return None
-        df = add_indicators(df, ma_window, macd_fast, macd_slow, macd_signal)
-        snap = latest_snapshot(df, ma_window)
-        result[tf] = snap
-    return result
+def _local_stages(settings, ex: ExchangeClient | AsyncExchangeClient, closed_by_ms: Optional[int] = None):
+    """(fetch, compute) в процессе бота: свечи с биржи, индикаторы — в тредпуле."""
+    min_len = max(settings.ma_window, settings.macd_slow) + 5
+
+    async def fetch(symbol: str):
+        return await fetch_triple(ex, symbol, settings.triple_timeframes, min_len,
+                                  derive=settings.derive_timeframes, closed_by_ms=closed_by_ms)
+
+    async def compute(symbol: str, candles):
+        return await run_sync(
+            snapshots_from_candles, ex.exchange_id, symbol, candles,
+            settings.ma_window, settings.macd_fast, settings.macd_slow, settings.macd_signal
+        )
+
+    return fetch, compute
+
+def _pool_stages(pool: WorkerPool, closed_by_ms: Optional[int] = None):
+    """(fetch, compute) через воркер-процессы: свечи и индикаторы считает процесс, которому принадлежит пара."""
+
+    async def fetch(symbol: str):
+        return await pool.snapshots(symbol, closed_by_ms)
+
+    async def compute(symbol: str, snapshots):
+        return snapshots
+
+    return fetch, compute
+
+def _make_pipeline(settings, ex: ExchangeClient | AsyncExchangeClient, llm: LLMAnalyzer,
+                   pool: Optional[WorkerPool] = None, closed_by_ms: Optional[int] = None) -> Pipeline:
+    """Конвейер «свечи -> индикаторы -> LLM» для /checkall и автоцикла (closed_by_ms — см. fetch_triple)."""
+    if pool is not None:
+        fetch, compute = _pool_stages(pool, closed_by_ms)
+    else:
+        fetch, compute = _local_stages(settings, ex, closed_by_ms)
+
+    decide_limit = settings.pipeline_llm_concurrency
+    if settings.llm_batch_size > 1:
+        # несколько пар — один запрос к LLM; лимит параллельности теперь на пакеты, а не на пары
+        async def decide_batch(items):
+            return await llm.aanalyze_batch(items, settings.literature_urls, settings.report_locale)
+
+        batcher = BatchingDecider(
+            decide_batch,
+            max_batch=settings.llm_batch_size,
+            concurrency=settings.pipeline_llm_concurrency,
+        )
+        decide = batcher.decide
+        decide_limit = settings.pipeline_llm_concurrency * settings.llm_batch_size
+    else:
+        async def decide(symbol: str, snapshots):
+            return await llm.aanalyze_triple(symbol, snapshots, settings.literature_urls, settings.report_locale)
+
+    return Pipeline(
+        fetch, compute, decide,
+        fetch_limit=settings.pipeline_fetch_concurrency,
+        compute_limit=settings.pipeline_indicator_concurrency,
+        decide_limit=decide_limit,
+    )
 
 def _format_card(symbol: str, tfs: List[str], buy: bool, conf: float, checks: dict, reason: str) -> str:
+    # карточки уходят с parse_mode=HTML и склеиваются в одно сообщение: всё, что пришло извне
+    # (ответ LLM, символ), экранируем, иначе один «<» ломает разметку всей пачки
+    esc = html.escape
     return (
         f"{'🟢' if buy else '🔸'} <b>Результат (три экрана Элдера)</b>\n"
-        f"Инструмент: <code>{symbol}</code>\n"
+        f"Инструмент: <code>{esc(symbol)}</code>\n"
         f"TF: <code>{'/'.join(tfs)}</code>\n"
         f"Время (UTC): <code>{ts_now_iso()}</code>\n\n"
         f"Сигнал: <b>{'ПОКУПАТЬ' if buy else 'нет'}</b>\n"
         f"Уверенность: <b>{conf:.2f}</b>\n"
-        f"Проверки: weekly_trend_ok={checks.get('weekly_trend_ok')}, "
-        f"daily_macd_ok={checks.get('daily_macd_ok')}, "
-        f"h4_volume_confirmation={checks.get('h4_volume_confirmation')}\n"
-        f"Комментарий: {reason}"
+        f"Проверки: weekly_trend_ok={esc(str(checks.get('weekly_trend_ok')))}, "
+        f"daily_macd_ok={esc(str(checks.get('daily_macd_ok')))}, "
+        f"h4_volume_confirmation={esc(str(checks.get('h4_volume_confirmation')))}\n"
+        f"Комментарий: {esc(reason)}"
     )
 
 # ----------------- Команды -----------------
 
 @router.message(CommandStart())
-async def cmd_start(msg: Message):
+async def cmd_start(msg: Message, settings: Settings, storage: Storage):
     global active
     active = True
-    settings = load_settings()
-    storage = Storage(settings.state_dir)
 
     # что сейчас мониторим
-    stored = storage.get_global_symbols()
+    stored = await storage.run(storage.get_global_symbols)
     current_list = stored if stored else (settings.symbols if settings.symbols else ["BTC/USDT"])
     await msg.answer(
         "✅ Бот запущен!\n"
@@ -100,6 +161,8 @@ async def cmd_start(msg: Message):
         "• /clearpairs — очистить список (возврат к .env SYMBOLS)\n"
         "• /check [SYMBOL/QUOTE] — анализ одной пары\n"
         "• /checkall [S1,S2,...] — пакетный анализ (если список не указан, берём /pairs)\n"
+        "• /screen — скринер всего рынка: лучшие пары по тикерам -> три экрана\n"
+        "• /llmstats — сколько вызовов LLM сэкономили префильтр и кэш решений\n"
         "• /stop — выключить автопубликацию в канал, /start — включить\n\n"
         f"Текущее наблюдение: <code>{', '.join(current_list)}</code>",
         parse_mode=ParseMode.HTML
@@ -112,13 +175,11 @@ async def cmd_stop(msg: Message):
     await msg.answer("⛔️ Автопубликация в канал остановлена. Ручные команды работают.")
 
 @router.message(Command("setpairs"))
-async def cmd_setpairs(msg: Message):
+async def cmd_setpairs(msg: Message, storage: Storage):
     """
     /setpairs BTC/USDT,ETH/USDT,HYPE/USDT
     Сохраняет список пар в БД, которые будут мониториться автоциклом и по умолчанию в /checkall.
     """
-    settings = load_settings()
-    storage = Storage(settings.state_dir)
 
     parts = (msg.text or "").strip().split(maxsplit=1)
     if len(parts) < 2 or not parts[1].strip():
@@ -134,14 +195,12 @@ async def cmd_setpairs(msg: Message):
         return
 
     # Сохраняем
-    storage.set_global_symbols(",".join(pairs))
+    await storage.run(storage.set_global_symbols, ",".join(pairs))
     await msg.answer("✅ Пары сохранены и будут мониториться: <code>" + ", ".join(pairs) + "</code>", parse_mode=ParseMode.HTML)
 
 @router.message(Command("pairs"))
-async def cmd_pairs(msg: Message):
-    settings = load_settings()
-    storage = Storage(settings.state_dir)
-    stored = storage.get_global_symbols()
+async def cmd_pairs(msg: Message, settings: Settings, storage: Storage):
+    stored = await storage.run(storage.get_global_symbols)
     if stored:
         await msg.answer("📈 Текущий список пар (из БД): <code>" + ", ".join(stored) + "</code>", parse_mode=ParseMode.HTML)
     else:
@@ -150,30 +209,25 @@ async def cmd_pairs(msg: Message):
                          parse_mode=ParseMode.HTML)
 
 @router.message(Command("clearpairs"))
-async def cmd_clearpairs(msg: Message):
-    settings = load_settings()
-    storage = Storage(settings.state_dir)
-    storage.clear_global_symbols()
+async def cmd_clearpairs(msg: Message, settings: Settings, storage: Storage):
+    await storage.run(storage.clear_global_symbols)
     base = settings.symbols if settings.symbols else ["BTC/USDT"]
     await msg.answer("🧹 Список пар очищен. Будут использованы .env SYMBOLS: <code>" + ", ".join(base) + "</code>",
                      parse_mode=ParseMode.HTML)
 
 @router.message(Command("check"))
-async def cmd_check(msg: Message, bot: Bot):
+@_timed("check")
+async def cmd_check(msg: Message, settings: Settings, storage: Storage,
+                    ex: ExchangeClient | AsyncExchangeClient, llm: LLMAnalyzer, outbox: Outbox):
     """
     /check [SYMBOL/QUOTE] — тройной анализ одной пары (1w/1d/4h).
     Если пара не указана — берём первую из /pairs (или из .env, если список пуст).
     """
-    settings = load_settings()
-    storage = Storage(settings.state_dir)
-    ex = ExchangeClient(settings.exchange_id)
-    llm = LLMAnalyzer(settings.openai_api_key, settings.openai_model)
-
     parts = (msg.text or "").strip().split(maxsplit=1)
     if len(parts) > 1 and parts[1].strip():
         symbol = _norm_symbol(parts[1])
     else:
-        stored = storage.get_global_symbols()
+        stored = await storage.run(storage.get_global_symbols)
         symbol = stored[0] if stored else (settings.symbols[0] if settings.symbols else "BTC/USDT")
 
     if "/" not in symbol:
@@ -182,98 +236,85 @@ async def cmd_check(msg: Message, bot: Bot):
 
     await msg.answer(f"⏳ Тройной анализ <b>{symbol}</b> (1w/1d/4h)…", parse_mode=ParseMode.HTML)
 
-    snapshots = await _build_snapshots_triple(
+    snapshots = await build_snapshots_triple(
         ex, symbol, settings.triple_timeframes,
-        settings.ma_window, settings.macd_fast, settings.macd_slow, settings.macd_signal
+        settings.ma_window, settings.macd_fast, settings.macd_slow, settings.macd_signal,
+        derive=settings.derive_timeframes,
     )
     if not snapshots:
         await msg.answer("❌ Недостаточно данных от биржи для расчёта индикаторов на одном из TF.")
         return
 
-    analysis = await run_sync(
-        LLMAnalyzer.analyze_triple, llm,
-        symbol, snapshots, settings.literature_urls, settings.report_locale
-    )
+    with _DECIDE_SECONDS.time():
+        analysis = await llm.aanalyze_triple(symbol, snapshots, settings.literature_urls, settings.report_locale)
     buy = bool(analysis.get("buy_signal"))
     conf = float(analysis.get("confidence", 0.0))
     reason = str(analysis.get("reason", ""))
     checks = analysis.get("checks", {})
 
     decision = "BUY" if buy else "NO_BUY"
-    # для cooldown ведём по дневному экрану
+    # для cooldown ведём по дневному экрану; проверяем до записи, иначе BUY «видит» сам себя
+    in_cooldown = buy and storage.within_cooldown(symbol, "1d", settings.buy_cooldown_hours)
     storage.insert_signal(symbol, "1d", decision, conf, reason)
+    await storage.run(storage.flush)
 
+    # дальше всё через очередь отправки: она держит лимиты Telegram и порядок сообщений в чате
     card = _format_card(symbol, settings.triple_timeframes, buy, conf, checks, reason)
-    await msg.answer(card, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    outbox.send(msg.chat.id, card)
 
     if buy:
-        if _within_cooldown(storage, symbol, "1d", settings.buy_cooldown_hours):
-            await msg.answer(f"⏸ BUY найден, но публикация пропущена: cooldown {settings.buy_cooldown_hours} ч. (по дневному экрану).")
+        if in_cooldown:
+            outbox.send(msg.chat.id, f"⏸ BUY найден, но публикация пропущена: cooldown {settings.buy_cooldown_hours} ч. (по дневному экрану).")
         elif not active:
-            await msg.answer("⏸ Сигнал найден, но автопубликация выключена (/start, чтобы включить).")
+            outbox.send(msg.chat.id, "⏸ Сигнал найден, но автопубликация выключена (/start, чтобы включить).")
         else:
-            await bot.send_message(
-                settings.telegram_channel_id,
-                "🟢 <b>Сигнал на покупку (три экрана Элдера)</b>\n" + card.split("\n", 3)[3],
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-            await msg.answer("✅ Сигнал опубликован в канал.")
-
-@router.message(Command("checkall"))
-async def cmd_checkall(msg: Message, bot: Bot):
-    """
-    /checkall
-    /checkall BTC/USDT,ETH/USDT,BNB/USDT
-    Пакетный анализ: берёт пары из аргумента или из /pairs (БД) или из .env.
-    """
-    settings = load_settings()
-    storage = Storage(settings.state_dir)
-    ex = ExchangeClient(settings.exchange_id)
-    llm = LLMAnalyzer(settings.openai_api_key, settings.openai_model)
-
-    parts = (msg.text or "").strip().split(maxsplit=1)
-    if len(parts) > 1 and parts[1].strip():
-        symbols = [_norm_symbol(s) for s in parts[1].split(",") if s.strip()]
-    else:
-        stored = storage.get_global_symbols()
-        symbols = stored if stored else (settings.symbols if settings.symbols else ["BTC/USDT"])
-
-    symbols = symbols[:12]  # защита от слишком больших пакетов
-    await msg.answer(f"⏳ Пакетный анализ ({len(symbols)} пар) по трём экранам…")
-
+            try:
+                await outbox.send(
+                    settings.telegram_channel_id,
+                    "🟢 <b>Сигнал на покупку (три экрана Элдера)</b>\n" + card.split("\n", 3)[3],
+                )
+                outbox.send(msg.chat.id, "✅ Сигнал опубликован в канал.")
+            except Exception:
+                outbox.send(msg.chat.id, "❌ Не удалось опубликовать сигнал в канал.")
+
+async def _analyze_and_report(msg: Message, symbols: List[str], settings: Settings, storage: Storage,
+                              ex: ExchangeClient | AsyncExchangeClient, llm: LLMAnalyzer, outbox: Outbox,
+                              title: str = "📊 Сводка пакетного анализа:"):
+    """Пары конвейером через три экрана и LLM: карточки в чат, BUY — в канал, в конце сводка."""
     buys_to_publish = []
     results_lines = []
 
-    for i, symbol in enumerate(symbols, start=1):
+    # пары идут конвейером: карточки приходят по мере готовности, а не в порядке списка
+    pipeline = _make_pipeline(settings, ex, llm)
+    i = 0
+    async for res in pipeline.run(symbols):
+        i += 1
+        symbol = res.symbol
+        if res.error is not None:
+            results_lines.append(f"{i}. {html.escape(symbol)}: ❌ ошибка анализа")
+            continue
+        if res.snapshots is None:
+            results_lines.append(f"{i}. {html.escape(symbol)}: ❌ недостаточно данных")
+            continue
         try:
-            snapshots = await _build_snapshots_triple(
-                ex, symbol, settings.triple_timeframes,
-                settings.ma_window, settings.macd_fast, settings.macd_slow, settings.macd_signal
-            )
-            if not snapshots:
-                results_lines.append(f"{i}. {symbol}: ❌ недостаточно данных")
-                continue
-
-            analysis = await run_sync(
-                LLMAnalyzer.analyze_triple, llm,
-                symbol, snapshots, settings.literature_urls, settings.report_locale
-            )
+            analysis = res.analysis
             buy = bool(analysis.get("buy_signal"))
             conf = float(analysis.get("confidence", 0.0))
             reason = str(analysis.get("reason", ""))
             checks = analysis.get("checks", {})
 
             decision = "BUY" if buy else "NO_BUY"
+            in_cooldown = buy and storage.within_cooldown(symbol, "1d", settings.buy_cooldown_hours)
             storage.insert_signal(symbol, "1d", decision, conf, reason)
 
+            # карточки одного чата очередь склеивает в сообщения до 4096 символов
             card = _format_card(symbol, settings.triple_timeframes, buy, conf, checks, reason)
-            await msg.answer(card, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+            outbox.send(msg.chat.id, card)
 
-            results_lines.append(f"{i}. {symbol}: {'🟢 BUY' if buy else '—'} (conf={conf:.2f})")
+            results_lines.append(f"{i}. {html.escape(symbol)}: {'🟢 BUY' if buy else '—'} (conf={conf:.2f})")
 
             if buy:
-                if _within_cooldown(storage, symbol, "1d", settings.buy_cooldown_hours):
+                if in_cooldown:
                     results_lines[-1] += f" ⏸ cooldown {settings.buy_cooldown_hours}ч"
                 elif not active:
                     results_lines[-1] += " ⏸ публикация выключена"
@@ -281,22 +322,178 @@ async def cmd_checkall(msg: Message, bot: Bot):
                     buys_to_publish.append(("🟢 <b>Сигнал на покупку (пакетный, три экрана)</b>\n" + card.split("\n", 3)[3]))
         except Exception as e:
             log.exception("checkall error on %s: %s", symbol, e)
-            results_lines.append(f"{i}. {symbol}: ❌ ошибка анализа")
+            results_lines.append(f"{i}. {html.escape(symbol)}: ❌ ошибка анализа")
+    # сигналы пачки — одной транзакцией
+    await storage.run(storage.flush)
 
-    # Публикуем найденные BUY в канал (если включено)
+    # Публикуем найденные BUY в канал (если включено); доставка — в фоне
     for text in buys_to_publish:
-        try:
-            await bot.send_message(
-                settings.telegram_channel_id,
-                text,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-        except Exception as e:
-            log.exception("send to channel failed: %s", e)
+        outbox.send(settings.telegram_channel_id, text)
 
-    summary = "📊 Сводка пакетного анализа:\n" + "\n".join(results_lines)
-    await msg.answer(summary, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    summary = title + "\n" + "\n".join(results_lines)
+    outbox.send(msg.chat.id, summary)
+
+@router.message(Command("checkall"))
+@_timed("checkall")
+async def cmd_checkall(msg: Message, settings: Settings, storage: Storage,
+                       ex: ExchangeClient | AsyncExchangeClient, llm: LLMAnalyzer, outbox: Outbox):
+    """
+    /checkall
+    /checkall BTC/USDT,ETH/USDT,BNB/USDT
+    Пакетный анализ: берёт пары из аргумента или из /pairs (БД) или из .env.
+    """
+    parts = (msg.text or "").strip().split(maxsplit=1)
+    if len(parts) > 1 and parts[1].strip():
+        symbols = [_norm_symbol(s) for s in parts[1].split(",") if s.strip()]
+    else:
+        stored = await storage.run(storage.get_global_symbols)
+        symbols = stored if stored else (settings.symbols if settings.symbols else ["BTC/USDT"])
+
+    await msg.answer(f"⏳ Пакетный анализ ({len(symbols)} пар) по трём экранам…")
+    await _analyze_and_report(msg, symbols, settings, storage, ex, llm, outbox)
+
+@router.message(Command("screen"))
+@_timed("screen")
+async def cmd_screen(msg: Message, settings: Settings, storage: Storage,
+                     ex: ExchangeClient | AsyncExchangeClient, llm: LLMAnalyzer, outbox: Outbox,
+                     screener: Screener):
+    """
+    /screen — скринер всего рынка: один запрос тикеров, фильтры по обороту/изменению/отклонению от средней,
+    top K пар — через три экрана и LLM.
+    """
+    await msg.answer("⏳ Скринер рынка…")
+    try:
+        symbols = await screener.screen()
+    except Exception as e:
+        log.exception("screener failed: %s", e)
+        await msg.answer("❌ Не удалось получить тикеры биржи.")
+        return
+    if not symbols:
+        await msg.answer("🔎 Скринер: ни одна пара не прошла фильтры.")
+        return
+    await msg.answer(
+        f"🔎 Из {screener.last_universe} пар фильтры прошли {screener.last_passed}, "
+        f"анализируем top {len(symbols)}: <code>{', '.join(symbols)}</code>",
+        parse_mode=ParseMode.HTML
+    )
+    await _analyze_and_report(msg, symbols, settings, storage, ex, llm, outbox, title="📊 Сводка скринера:")
+
+@router.message(Command("llmstats"))
+async def cmd_llmstats(msg: Message):
+    g = gate_stats.as_dict()
+    c = DECISION_CACHE.stats()
+    await msg.answer(
+        "🧮 <b>Вызовы LLM</b>\n"
+        f"Префильтр: оценено {g['evaluated']}, отсечено локально {g['rejected']}, "
+        f"передано в LLM {g['escalated']} (сэкономлено {g['saved_ratio']:.0%})\n"
+        f"Кэш решений: попаданий {c['hits']}, промахов {c['misses']} ({c['hit_ratio']:.0%}), "
+        f"записей {c['size']}, вытеснено {c['evictions']}",
+        parse_mode=ParseMode.HTML
+    )
+
+def _fmt_seconds(sec: float) -> str:
+    if sec >= 1:
+        return f"{sec:.2f}с"
+    return f"{sec * 1000:.1f}мс" if sec < 0.01 else f"{sec * 1000:.0f}мс"
+
+def _hist_line(title: str, h) -> str:
+    p50, p95, p99 = h.quantiles()
+    return f"{title}: n={h.count} p50 {_fmt_seconds(p50)} · p95 {_fmt_seconds(p95)} · p99 {_fmt_seconds(p99)}"
+
+def _format_stats() -> str:
+    v = METRICS.value
+    up = int(time.time() - METRICS.started)
+    lines = [f"📈 <b>Метрики</b> (аптайм {up // 3600}ч {up % 3600 // 60}м)", "<pre>"]
+
+    cycle = METRICS.histograms("bot_cycle_seconds")
+    if cycle and cycle[0][1].count:
+        h = cycle[0][1]
+        pairs = v("bot_cycle_pairs_total") or 0
+        lines.append(_hist_line("Цикл", h))
+        lines.append(f"  пар {pairs:.0f}, ≈{pairs / h.sum if h.sum else 0:.1f} пар/с")
+    for labels, h in METRICS.histograms("bot_command_seconds"):
+        if h.count:
+            lines.append(_hist_line(f"/{labels['command']}", h))
+    for labels, h in METRICS.histograms("bot_stage_seconds"):
+        if h.count:
+            lines.append(_hist_line(f"стадия {labels['stage']}", h))
+    for labels, h in METRICS.histograms("bot_exchange_request_seconds"):
+        if h.count:
+            lines.append(_hist_line(f"биржа {labels['kind']}", h))
+    for _, h in METRICS.histograms("bot_llm_request_seconds"):
+        if h.count:
+            lines.append(_hist_line("LLM", h))
+    lines.append(
+        f"  токены: вход {v('bot_llm_tokens_total', kind='prompt') or 0:.0f}, "
+        f"выход {v('bot_llm_tokens_total', kind='completion') or 0:.0f}"
+    )
+    for _, h in METRICS.histograms("bot_db_flush_seconds"):
+        if h.count:
+            lines.append(_hist_line("SQLite flush", h))
+    lines.append(f"  записано {v('bot_db_signals_written_total') or 0:.0f}, ждут записи {v('bot_db_pending_signals') or 0:.0f}")
+    for _, h in METRICS.histograms("bot_telegram_send_seconds"):
+        if h.count:
+            lines.append(_hist_line("Telegram", h))
+    lines.append(
+        f"  очередь {v('bot_outbox_queue_depth') or 0:.0f}, отправлено {v('bot_outbox_sent_total') or 0:.0f}, "
+        f"склеено {v('bot_outbox_merged_total') or 0:.0f}, retry_after {v('bot_outbox_retry_after_total') or 0:.0f}"
+    )
+    lines.append(
+        f"Кэш свечей: {(v('bot_candle_cache_hit_ratio') or 0):.0%} попаданий, "
+        f"кэш решений: {(v('bot_decision_cache_hit_ratio') or 0):.0%}"
+    )
+    lines.append("</pre>")
+    return "\n".join(lines)
+
+@router.message(Command("stats"))
+async def cmd_stats(msg: Message, settings: Settings):
+    """/stats — задержки по стадиям, пропускная способность, очереди и кэши (только для ADMIN_IDS)."""
+    if not _is_admin(msg, settings):
+        await msg.answer("⛔ Команда только для администраторов (ADMIN_IDS).")
+        return
+    await msg.answer(_format_stats(), parse_mode=ParseMode.HTML)
+
+_PROFILE_MAX_SECONDS = 600
+
+@router.message(Command("profile"))
+async def cmd_profile(msg: Message, settings: Settings):
+    """
+    /profile [N] — N секунд (по умолчанию 30) сэмплировать стеки event loop, тредпула run_sync и потока БД.
+    Collapsed stacks пишутся в BOT_STATE_DIR/profiles (flamegraph.pl / speedscope), топ кадров — в чат.
+    """
+    if not _is_admin(msg, settings):
+        await msg.answer("⛔ Команда только для администраторов (ADMIN_IDS).")
+        return
+    parts = (msg.text or "").split()
+    try:
+        seconds = int(parts[1]) if len(parts) > 1 else 30
+    except ValueError:
+        await msg.answer("⚠️ Формат: <code>/profile 60</code> (секунды)", parse_mode=ParseMode.HTML)
+        return
+    seconds = max(1, min(seconds, _PROFILE_MAX_SECONDS))
+
+    await msg.answer(f"⏺ Профилирую {seconds} с…")
+    try:
+        result = await profile_for(seconds)
+    except RuntimeError:
+        await msg.answer("⏳ Профайлер уже запущен.")
+        return
+    path = await run_sync(result.write, os.path.join(settings.state_dir, "profiles"))
+
+    busy = ", ".join(f"{name} {b / t:.0%}" for name, (b, t) in sorted(result.busy().items()) if t)
+    lines = [f"🔥 <b>Профиль {result.seconds:.0f} с</b>, сэмплов {result.samples}", f"Занятость: {busy or '—'}", "<pre>"]
+    total = max(1, result.samples)
+    lines.append("Собственное время:")
+    lines += [f"{n / total:6.1%}  {html.escape(frame)}" for frame, n in result.top_self(10)]
+    lines.append("Вместе с вызовами:")
+    lines += [f"{n / total:6.1%}  {html.escape(frame)}" for frame, n in result.top_total(10)]
+    lines.append("</pre>")
+    await msg.answer("\n".join(lines), parse_mode=ParseMode.HTML)
+    try:
+        await msg.answer_document(FSInputFile(path), caption=os.path.basename(path))
+    except Exception as e:
+        log.warning("profile upload failed: %s", e)
+        await msg.answer(f"Файл: <code>{html.escape(path)}</code>", parse_mode=ParseMode.HTML)
 
 # Диагностика: любой необработанный апдейт
 @router.message()
@@ -305,88 +502,268 @@ async def any_message(msg: Message):
 
 # ----------------- Автоцикл -----------------
 
-async def periodic_task(settings, bot: Bot, storage: Storage, ex: ExchangeClient, llm: LLMAnalyzer):
-    while True:
+async def run_cycle(settings, outbox: Outbox, storage: Storage, ex: ExchangeClient | AsyncExchangeClient,
+                    llm: LLMAnalyzer, symbols: List[str], pool: Optional[WorkerPool] = None,
+                    closed_by_ms: Optional[int] = None) -> set:
+    """
+    Один проход автоцикла по парам. Возвращает пары, по которым дошли до решения или до «нет данных».
+    closed_by_ms — цикл по закрытию свечи: снапшоты только по барам, закрытым к этому моменту.
+    """
+    processed = set()
+    started = time.perf_counter()
+    log.info("Triple cycle: %d pairs, %s", len(symbols), "/".join(settings.triple_timeframes))
+    pipeline = _make_pipeline(settings, ex, llm, pool, closed_by_ms)
+    async for res in pipeline.run(symbols):
+        symbol = res.symbol
+        if res.error is not None:
+            continue  # уже залогировано конвейером; повторим на следующем пробуждении
+        processed.add(symbol)
+        if res.snapshots is None:
+            log.warning("Not enough data for %s on one of tfs", symbol)
+            continue
         try:
-            # Берём пары в приоритете из БД, иначе из .env
-            pairs = storage.get_global_symbols()
-            symbols = pairs if pairs else (settings.symbols if settings.symbols else ["BTC/USDT"])
-
-            for symbol in symbols:
-                try:
-                    log.info("Triple fetch %s %s ...", symbol, "/".join(settings.triple_timeframes))
-                    snapshots = await _build_snapshots_triple(
-                        ex, symbol, settings.triple_timeframes,
-                        settings.ma_window, settings.macd_fast, settings.macd_slow, settings.macd_signal
-                    )
-                    if not snapshots:
-                        log.warning("Not enough data for %s on one of tfs", symbol)
-                        continue
-
-                    analysis = await run_sync(
-                        LLMAnalyzer.analyze_triple, llm,
-                        symbol, snapshots, settings.literature_urls, settings.report_locale
-                    )
-                    buy = bool(analysis.get("buy_signal"))
-                    conf = float(analysis.get("confidence", 0.0))
-                    reason = str(analysis.get("reason", ""))
-
-                    decision = "BUY" if buy else "NO_BUY"
-                    storage.insert_signal(symbol, "1d", decision, conf, reason)
-
-                    if buy:
-                        if _within_cooldown(storage, symbol, "1d", settings.buy_cooldown_hours):
-                            log.info("⏸ Пропускаю BUY по %s — cooldown %d ч. (дневной экран)", symbol, settings.buy_cooldown_hours)
-                            continue
-
-                        text = (
-                            f"🟢 <b>Сигнал на покупку (три экрана Элдера)</b>\n"
-                            f"Инструмент: <code>{symbol}</code>\n"
-                            f"TF: <code>{'/'.join(settings.triple_timeframes)}</code>\n"
-                            f"Время (UTC): <code>{ts_now_iso()}</code>\n"
-                            f"Уверенность: <b>{conf:.2f}</b>\n"
-                            f"Комментарий: {reason}"
-                        )
-                        if active:
-                            await bot.send_message(
-                                settings.telegram_channel_id,
-                                text,
-                                parse_mode=ParseMode.HTML,
-                                disable_web_page_preview=True
-                            )
-                            log.info("✅ Сигнал отправлен в канал: %s", settings.telegram_channel_id)
-                        else:
-                            log.info("⏸ Сигнал не отправлен (бот в режиме stop)")
-                except Exception as e:
-                    log.exception("Error on symbol %s: %s", symbol, e)
-        except Exception as e:
-            log.exception("Periodic loop error: %s", e)
+            analysis = res.analysis
+            buy = bool(analysis.get("buy_signal"))
+            conf = float(analysis.get("confidence", 0.0))
+            reason = str(analysis.get("reason", ""))
 
-        await asyncio.sleep(settings.schedule_seconds)
+            decision = "BUY" if buy else "NO_BUY"
+            in_cooldown = buy and storage.within_cooldown(symbol, "1d", settings.buy_cooldown_hours)
+            storage.insert_signal(symbol, "1d", decision, conf, reason)
+
+            if buy:
+                if in_cooldown:
+                    log.info("⏸ Пропускаю BUY по %s — cooldown %d ч. (дневной экран)", symbol, settings.buy_cooldown_hours)
+                    continue
+
+                text = (
+                    f"🟢 <b>Сигнал на покупку (три экрана Элдера)</b>\n"
+                    f"Инструмент: <code>{html.escape(symbol)}</code>\n"
+                    f"TF: <code>{'/'.join(settings.triple_timeframes)}</code>\n"
+                    f"Время (UTC): <code>{ts_now_iso()}</code>\n"
+                    f"Уверенность: <b>{conf:.2f}</b>\n"
+                    f"Комментарий: {html.escape(reason)}"
+                )
+                if active:
+                    outbox.send(settings.telegram_channel_id, text)
+                    log.info("✅ Сигнал поставлен в очередь в канал: %s", settings.telegram_channel_id)
+                else:
+                    log.info("⏸ Сигнал не отправлен (бот в режиме stop)")
+        except Exception as e:
+            log.exception("Error on symbol %s: %s", symbol, e)
+    await storage.run(storage.flush)
+    _CYCLE_SECONDS.record(time.perf_counter() - started)
+    _CYCLE_PAIRS.inc(len(processed))
+    return processed
+
+async def _cycle_symbols(settings, storage: Storage) -> List[str]:
+    # Берём пары в приоритете из БД, иначе из .env
+    pairs = await storage.run(storage.get_global_symbols)
+    return pairs if pairs else (settings.symbols if settings.symbols else ["BTC/USDT"])
+
+async def periodic_task(settings, outbox: Outbox, storage: Storage, ex: ExchangeClient | AsyncExchangeClient,
+                        llm: LLMAnalyzer, pool: Optional[WorkerPool] = None,
+                        streamer: Optional[KlineStreamer] = None, screener: Optional[Screener] = None):
+    last_symbols: List[str] = []
+
+    async def cycle_symbols() -> List[str]:
+        nonlocal last_symbols
+        symbols = await _cycle_symbols(settings, storage)
+        if screener is not None:
+            # автоскринер: к списку наблюдения добавляем лучшие пары рынка
+            try:
+                symbols = symbols + [s for s in await screener.screen() if s not in symbols]
+            except Exception as e:
+                log.warning("screener failed: %s", e)
+        if pool is not None and symbols != last_symbols:
+            # список пар сменился — воркеры забывают пары, которые больше не их
+            pool.rebalance(symbols)
+        if streamer is not None:
+            streamer.set_targets(symbols, settings.triple_timeframes)
+        last_symbols = symbols
+        return symbols
+
+    if settings.schedule_mode == "interval":
+        # старый режим: проход раз в SCHEDULE_SECONDS
+        while True:
+            try:
+                await run_cycle(settings, outbox, storage, ex, llm, await cycle_symbols(), pool)
+            except Exception as e:
+                log.exception("Periodic loop error: %s", e)
+            await asyncio.sleep(settings.schedule_seconds)
+
+    # по закрытию свечи решающего (младшего) TF: новый бар — один проход, без повторов внутри бара
+    decision_tf = min(settings.triple_timeframes, key=timeframe_ms)
+    scheduler = CandleCloseScheduler(ex.exchange_id, grace_seconds=settings.schedule_grace_seconds)
+
+    async def get_jobs():
+        return {symbol: decision_tf for symbol in await cycle_symbols()}
+
+    async def handler(close_ms: int, symbols: List[str]):
+        log.info("Bar close %s %s: %d pairs", decision_tf,
+                 datetime.fromtimestamp(close_ms / 1000, timezone.utc).isoformat(timespec="minutes"), len(symbols))
+        # пробуждение через grace после закрытия: последний бар только открылся — решаем по закрытому
+        return await run_cycle(settings, outbox, storage, ex, llm, symbols, pool, closed_by_ms=close_ms)
+
+    await scheduler.run(get_jobs, handler)
 
 # ----------------- Bootstrap -----------------
 
-def build_bot() -> tuple[Dispatcher, Bot, Storage, ExchangeClient, LLMAnalyzer]:
+def build_bot() -> tuple[Dispatcher, Bot, Storage, ExchangeClient | AsyncExchangeClient, LLMAnalyzer]:
     settings = load_settings()
     bot = Bot(token=settings.telegram_token)
     dp = Dispatcher(lifespan=lifespan)
     dp.include_router(router)
 
     storage = Storage(state_dir=settings.state_dir)
-    ex = ExchangeClient(settings.exchange_id)
+    if settings.llm_cache_persist:
+        DECISION_CACHE.attach_storage(storage)
+    if settings.exchange_async:
+        ex = AsyncExchangeClient(settings.exchange_id, state_dir=settings.state_dir)
+    else:
+        ex = ExchangeClient(settings.exchange_id, state_dir=settings.state_dir)
     llm = LLMAnalyzer(settings.openai_api_key, settings.openai_model)
+    recorder = None
+    if settings.record_path:
+        # запись для офлайн-прогонов (python -m bench --replay): свечи с биржи и решения LLM
+        recorder, llm = install_recorder(ex, llm, settings.record_path)
+
+    # одни и те же объекты на весь процесс: aiogram передаёт их в хендлеры по имени параметра
+    dp["settings"] = settings
+    dp["storage"] = storage
+    dp["ex"] = ex
+    dp["llm"] = llm
+    dp["recorder"] = recorder
+    dp["screener"] = Screener(
+        ex,
+        ScreenerParams(
+            quote=settings.screener_quote,
+            min_quote_volume=settings.screener_min_quote_volume,
+            min_change=settings.screener_min_change,
+            max_change=settings.screener_max_change,
+            top_k=settings.screener_top_k,
+            use_klines=settings.screener_klines,
+            ma_window=settings.ma_window,
+        ),
+        refresh_seconds=settings.screener_refresh_seconds,
+    )
+    dp["outbox"] = Outbox(
+        bot,
+        global_rate=settings.outbox_global_rate,
+        chat_rate=settings.outbox_chat_rate,
+        group_per_minute=settings.outbox_group_per_minute,
+    )
     return dp, bot, storage, ex, llm
 
+def _register_gauges(storage: Storage, outbox: Outbox, ex: ExchangeClient | AsyncExchangeClient, llm: LLMAnalyzer,
+                     pool: Optional[WorkerPool] = None, streamer: Optional[KlineStreamer] = None) -> None:
+    """Значения, которые объекты и так считают сами: читаются только при выдаче /stats и /metrics."""
+    g = METRICS.gauge
+    g("bot_outbox_queue_depth", outbox.pending, "Сообщений в очереди отправки")
+    g("bot_outbox_sent_total", lambda: outbox.sent, kind="counter")
+    g("bot_outbox_merged_total", lambda: outbox.merged, kind="counter")
+    g("bot_outbox_retry_after_total", lambda: outbox.retry_after_hits, kind="counter")
+    g("bot_db_pending_signals", storage.pending_signals, "Сигналов ждут записи в SQLite")
+    g("bot_publishing_enabled", lambda: int(active))
+
+    cache = ex.cache
+    for result, attr in (("hit", "hits"), ("tail", "tail_fetches"), ("full", "full_fetches")):
+        g("bot_candle_cache_requests_total", functools.partial(getattr, cache, attr),
+          "Запросы свечей: из кэша / докачка хвоста / полная история", kind="counter", result=result)
+
+    def candle_hit_ratio() -> float:
+        total = cache.hits + cache.tail_fetches + cache.full_fetches
+        return cache.hits / total if total else 0.0
+
+    g("bot_candle_cache_hit_ratio", candle_hit_ratio)
+    g("bot_decision_cache_hit_ratio", lambda: DECISION_CACHE.stats()["hit_ratio"])
+    g("bot_decision_cache_entries", lambda: DECISION_CACHE.stats()["size"])
+    g("bot_prefilter_total", lambda: gate_stats.as_dict()["rejected"], kind="counter", result="rejected")
+    g("bot_prefilter_total", lambda: gate_stats.as_dict()["escalated"], kind="counter", result="escalated")
+    g("bot_llm_retries_total", lambda: llm.retries, kind="counter")
+    g("bot_llm_hedged_total", lambda: llm.hedged, kind="counter")
+    if pool is not None:
+        g("bot_workers_alive", lambda: pool.stats()["alive"])
+        g("bot_workers_in_flight", lambda: pool.stats()["in_flight"])
+    if streamer is not None:
+        g("bot_stream_messages_total", lambda: streamer.messages, kind="counter")
+        g("bot_stream_gaps_total", lambda: streamer.gaps, kind="counter")
+
+async def _warm_markets(ex: ExchangeClient | AsyncExchangeClient) -> None:
+    try:
+        if isinstance(ex, AsyncExchangeClient):
+            await ex.load_markets()
+        else:
+            await run_sync(ex.load_markets)
+        log.info("Markets loaded: %s", ex.exchange_id)
+    except Exception as e:
+        # не фатально: ccxt догрузит рынки при первом запросе
+        log.warning("load_markets failed: %s", e)
+
 async def main():
     dp, bot, storage, ex, llm = build_bot()
-    settings = load_settings()
-    task = asyncio.create_task(periodic_task(settings, bot, storage, ex, llm))
+    settings = dp["settings"]
+    outbox: Outbox = dp["outbox"]
+    outbox.start()
+    await _warm_markets(ex)
+    if settings.llm_cache_persist:
+        await DECISION_CACHE.warm()
+    pool = None
+    if settings.worker_processes > 0:
+        pool = WorkerPool(settings, settings.worker_processes)
+        pool.start()
+        if dp["recorder"] is not None:
+            log.warning("RECORD_PATH: свечи автоцикла качают воркер-процессы — в запись попадут только команды и LLM")
+    streamer = None
+    if settings.stream_klines:
+        streamer = KlineStreamer(ex, settings.stream_url or None, settings.stream_max_per_conn)
+        if pool is not None or not streamer.supported:
+            # воркеры держат свои кэши свечей, а стрим кормит кэш процесса бота
+            log.warning("Kline streaming disabled: %s", "worker mode" if pool is not None else "no stream URL for exchange")
+            streamer = None
+    screener = dp["screener"] if settings.screener_auto else None
+    add_stage_observer(METRICS.stage_observer("bot_stage_seconds", "Стадии конвейера пары: свечи / индикаторы / решение"))
+    _register_gauges(storage, outbox, ex, llm, pool, streamer)
+    metrics_http = None
+    if settings.metrics_port > 0:
+        try:
+            metrics_http = await start_http(METRICS, settings.metrics_host, settings.metrics_port)
+        except OSError as e:
+            log.warning("metrics endpoint disabled: %s", e)
+    task = asyncio.create_task(periodic_task(settings, outbox, storage, ex, llm, pool, streamer, screener))
+    tasks = [task]
+    if settings.signals_keep_days > 0:
+        retention = Retention(storage, settings.signals_keep_days, settings.retention_chunk)
+        tasks.append(asyncio.create_task(retention.run_forever(settings.retention_interval_seconds)))
     try:
         await dp.start_polling(bot)
     finally:
-        task.cancel()
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await t
+        if metrics_http is not None:
+            with contextlib.suppress(Exception):
+                await metrics_http.cleanup()
+        if streamer is not None:
+            with contextlib.suppress(Exception):
+                await streamer.close()
+        if pool is not None:
+            with contextlib.suppress(Exception):
+                await pool.close()
+        with contextlib.suppress(Exception):
+            await outbox.close()
+        if isinstance(ex, AsyncExchangeClient):
+            with contextlib.suppress(Exception):
+                await ex.close()
+            await close_http_session()
         with contextlib.suppress(Exception):
-            await task
+            await llm.aclose()
+        if dp["recorder"] is not None:
+            dp["recorder"].close()
+        # дописываем отложенные сигналы и закрываем соединение с БД
+        storage.close()
 
 if __name__ == "__main__":
     import contextlib
@@ -0,0 +1,244 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger("metrics")
+
+# Лёгкие метрики процесса: гистограммы задержек (HDR-подобные лог-линейные корзины — массив счётчиков
+# фиксированного размера, запись без аллокаций), счётчики и «ленивые» значения, которые читаются
+# только при выдаче (/stats, Prometheus-текст на localhost).
+
+# 2^_SUB_BITS линейных корзин до 32 мкс, дальше по 16 корзин на каждое удвоение: погрешность ≤ ~6%
+_SUB_BITS = 5
+_SUB_COUNT = 1 << _SUB_BITS
+_HALF = _SUB_COUNT >> 1
+_MAX_US = (1 << 40) - 1  # ~12 дней — всё длиннее кладём в последнюю корзину
+_BUCKETS = _SUB_COUNT + (_MAX_US.bit_length() - _SUB_BITS) * _HALF
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _bucket(us: int) -> int:
+    if us < _SUB_COUNT:
+        return us
+    e = us.bit_length() - _SUB_BITS
+    return _SUB_COUNT + (e - 1) * _HALF + (us >> e) - _HALF
+
+
+def _bucket_mid_us(idx: int) -> float:
+    if idx < _SUB_COUNT:
+        return float(idx)
+    e, sub = divmod(idx - _SUB_COUNT, _HALF)
+    e += 1
+    lower = (sub + _HALF) << e
+    return lower + ((1 << e) - 1) / 2.0
+
+
+class Histogram:
+    """Гистограмма длительностей в секундах. Квантили — с точностью корзины."""
+
+    __slots__ = ("_counts", "count", "sum", "max", "_lock")
+
+    def __init__(self):
+        self._counts = [0] * _BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        us = int(seconds * 1_000_000)
+        idx = _bucket(us if 0 <= us <= _MAX_US else (_MAX_US if us > 0 else 0))
+        with self._lock:
+            self._counts[idx] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def time(self) -> "Span":
+        return Span(self)
+
+    def quantiles(self, qs: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> List[float]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self.count
+            top = self.max
+        out = []
+        for q in qs:
+            if not total:
+                out.append(0.0)
+                continue
+            rank = max(1, int(q * total + 0.5))
+            seen = 0
+            for idx, c in enumerate(counts):
+                seen += c
+                if seen >= rank:
+                    out.append(min(_bucket_mid_us(idx) / 1_000_000, top))
+                    break
+        return out
+
+
+class Span:
+    """with hist.time(): ... — записать длительность блока (работает и внутри корутин)."""
+
+    __slots__ = ("_hist", "_t0")
+
+    def __init__(self, hist: Histogram):
+        self._hist = hist
+
+    def __enter__(self) -> "Span":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._hist.record(time.perf_counter() - self._t0)
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1) -> None:
+        with self._lock:
+            self.value += n
+
+
+def _labels(kw: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in kw.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.started = time.time()
+        self._help: Dict[str, Tuple[str, str]] = {}  # имя -> (тип, описание)
+        self._hists: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], Counter] = {}
+        self._callbacks: Dict[Tuple[str, Labels], Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def _declare(self, name: str, kind: str, help: str) -> None:
+        if name not in self._help or (help and not self._help[name][1]):
+            self._help[name] = (kind, help)
+
+    def histogram(self, name: str, help: str = "", **labels) -> Histogram:
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = Histogram()
+                self._declare(name, "summary", help)
+            return h
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        key = (name, _labels(labels))
+        with self._lock:
+            c = self._counters.get(key)
+            if c is None:
+                c = self._counters[key] = Counter()
+                self._declare(name, "counter", help)
+            return c
+
+    def gauge(self, name: str, fn: Callable[[], float], help: str = "", kind: str = "gauge", **labels) -> None:
+        """Значение, которое считается при выдаче (глубина очереди, доля попаданий в кэш, счётчики объектов)."""
+        with self._lock:
+            self._callbacks[(name, _labels(labels))] = fn
+            self._declare(name, kind, help)
+
+    def stage_observer(self, name: str, help: str = "") -> Callable[[str, float], None]:
+        """Наблюдатель для pipeline.add_stage_observer: гистограмма name{stage=...}."""
+        cache: Dict[str, Histogram] = {}
+
+        def observe(stage: str, seconds: float) -> None:
+            h = cache.get(stage)
+            if h is None:
+                h = cache[stage] = self.histogram(name, help, stage=stage)
+            h.record(seconds)
+
+        return observe
+
+    # ---------- чтение ----------
+    def histograms(self, name: str) -> List[Tuple[Dict[str, str], Histogram]]:
+        with self._lock:
+            items = [(dict(lbl), h) for (n, lbl), h in self._hists.items() if n == name]
+        return sorted(items, key=lambda x: sorted(x[0].items()))
+
+    def value(self, name: str, **labels) -> Optional[float]:
+        key = (name, _labels(labels))
+        with self._lock:
+            c = self._counters.get(key)
+            fn = self._callbacks.get(key)
+        if c is not None:
+            return c.value
+        if fn is not None:
+            try:
+                return float(fn())
+            except Exception:
+                return None
+        return None
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат Prometheus 0.0.4; гистограммы отдаются как summary (квантили, _sum, _count)."""
+        with self._lock:
+            hists = sorted(self._hists.items())
+            counters = sorted(self._counters.items())
+            callbacks = sorted(self._callbacks.items(), key=lambda x: x[0])
+            helps = dict(self._help)
+        by_name: Dict[str, List[str]] = {}
+        for (name, labels), h in hists:
+            lines = by_name.setdefault(name, [])
+            for q, v in zip((0.5, 0.95, 0.99), h.quantiles()):
+                value = f"{v:.6f}" if h.count else "NaN"
+                lines.append(f"{name}{_fmt_labels(labels, ('quantile', str(q)))} {value}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {h.sum:.6f}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {h.count}")
+        for (name, labels), c in counters:
+            by_name.setdefault(name, []).append(f"{name}{_fmt_labels(labels)} {c.value}")
+        for (name, labels), fn in callbacks:
+            try:
+                v = float(fn())
+            except Exception as e:
+                log.debug("metric %s failed: %s", name, e)
+                continue
+            by_name.setdefault(name, []).append(f"{name}{_fmt_labels(labels)} {v:g}")
+        out = []
+        for name in sorted(by_name):
+            kind, help = helps.get(name, ("untyped", ""))
+            if help:
+                out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(by_name[name])
+        out.append(f"# TYPE bot_uptime_seconds gauge\nbot_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(out) + "\n"
+
+
+# Общий на процесс реестр (как DECISION_CACHE и gate_stats)
+METRICS = Registry()
+
+
+async def start_http(registry: Registry, host: str, port: int):
+    """GET /metrics в текстовом формате Prometheus. Возвращает runner (закрыть через cleanup())."""
+    from aiohttp import web
+
+    async def handle(_request):
+        return web.Response(text=registry.render_prometheus(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("metrics: http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from .metrics import METRICS
+
+log = logging.getLogger("outbox")
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу/канал
+TELEGRAM_MAX_LEN = 4096
+
+_SEND_SECONDS = METRICS.histogram("bot_telegram_send_seconds", "Вызов sendMessage")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # после retry_after
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до свободного токена (0 — можно слать)."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+# HTML-разметка Telegram: теги и сущности (&lt; и т.п.) резать нельзя
+_HTML_TOKEN = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>|&#?\w+;")
+
+
+def _html_atoms(text: str) -> List[Tuple[str, int, str]]:
+    """Текст по неделимым кускам: (кусок, +1/-1/0 — открывающий/закрывающий тег/прочее, имя тега)."""
+    atoms, pos = [], 0
+    for m in _HTML_TOKEN.finditer(text):
+        atoms.extend((ch, 0, "") for ch in text[pos:m.start()])
+        if m.group(2):
+            atoms.append((m.group(0), -1 if m.group(1) else 1, m.group(2).lower()))
+        else:
+            atoms.append((m.group(0), 0, ""))
+        pos = m.end()
+    atoms.extend((ch, 0, "") for ch in text[pos:])
+    return atoms
+
+
+def _split_outside_tags(text: str, sep: str) -> List[str]:
+    """Режет по sep только там, где не открыт ни один тег."""
+    pieces, cur, depth = [], [], 0
+    for atom, kind, _ in _html_atoms(text):
+        depth = max(0, depth + kind)
+        cur.append(atom)
+        if depth == 0 and "".join(cur[-len(sep):]) == sep:
+            pieces.append("".join(cur[:-len(sep)]))
+            cur = []
+    pieces.append("".join(cur))
+    return pieces
+
+
+def _hard_cut(text: str, limit: int) -> List[str]:
+    """Крайний случай — строка длиннее лимита: режем между атомами, открытые теги закрываем и открываем заново."""
+    parts, cur, stack = [], "", []  # stack: (имя, исходный открывающий тег)
+    for atom, kind, name in _html_atoms(text):
+        closers = "".join(f"</{n}>" for n, _ in reversed(stack))
+        if cur and len(cur) + len(atom) + len(closers) > limit:
+            parts.append(cur + closers)
+            cur = "".join(tag for _, tag in stack)
+        cur += atom
+        if kind > 0:
+            stack.append((name, atom))
+        elif kind < 0 and stack and stack[-1][0] == name:
+            stack.pop()
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def _pack(text: str, limit: int, seps: Tuple[str, ...], html: bool) -> List[str]:
+    if len(text) <= limit:
+        return [text]
+    if not seps:
+        if html:
+            return _hard_cut(text, limit)
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    sep, rest = seps[0], seps[1:]
+    pieces = _split_outside_tags(text, sep) if html else text.split(sep)
+    parts, cur = [], None
+    for piece in pieces:
+        if len(piece) > limit:
+            if cur is not None:
+                parts.append(cur)
+                cur = None
+            parts.extend(_pack(piece, limit, rest, html))
+        elif cur is not None and len(cur) + len(sep) + len(piece) <= limit:
+            cur = cur + sep + piece
+        else:
+            if cur is not None:
+                parts.append(cur)
+            cur = piece
+    if cur is not None:
+        parts.append(cur)
+    return parts
+
+
+def split_text(text: str, limit: int = TELEGRAM_MAX_LEN, html: bool = True) -> List[str]:
+    """
+    Режет длинный текст, чтобы каждая часть влезла в лимит: сначала по границам карточек (пустая строка),
+    затем по строкам — и то и другое только вне тегов; строку-монстра — между тегами/сущностями,
+    переоткрывая незакрытые теги в следующей части.
+    """
+    return _pack(text, limit, ("\n\n", "\n"), html)
+
+
+@dataclass
+class _Item:
+    text: str
+    parse_mode: Optional[str]
+    disable_web_page_preview: bool
+    coalesce: bool
+    futures: List[asyncio.Future] = field(default_factory=list)
+    parts: List["_Item"] = field(default_factory=list)  # исходные сообщения, если это склейка
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    queue: Deque[_Item] = field(default_factory=deque)
+    busy: bool = False
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений. send() не ждёт доставки: текст встаёт в очередь чата,
+    фоновый воркер отправляет с учётом лимитов (глобальный и по чату), склеивает подряд идущие
+    сообщения одного чата до 4096 символов и выдерживает retry_after от Telegram.
+    Если склейку отвергли, её части досылаются по одному. Внутри одного чата порядок сохраняется.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        group_per_minute: float = 20.0,
+        max_in_flight: int = 8,
+    ):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_per_minute / 60.0
+        self._chats: Dict[str, _Chat] = {}
+        self._wakeup = asyncio.Event()
+        self._sem = asyncio.Semaphore(max(1, max_in_flight))
+        self._worker: Optional[asyncio.Task] = None
+        self._sending: set[asyncio.Task] = set()
+        self._closing = False
+        self.sent = 0
+        self.merged = 0
+        self.retry_after_hits = 0
+
+    def _chat(self, chat_id) -> _Chat:
+        key = str(chat_id)
+        chat = self._chats.get(key)
+        if chat is None:
+            # отрицательные id и @username — группы/каналы, у них лимит поминутный
+            group = key.startswith("-") or key.startswith("@")
+            rate = self.group_rate if group else self.chat_rate
+            chat = self._chats[key] = _Chat(TokenBucket(rate, 3 if group else 1))
+        return chat
+
+    def send(
+        self,
+        chat_id,
+        text: str,
+        parse_mode: Optional[str] = ParseMode.HTML,
+        disable_web_page_preview: bool = True,
+        coalesce: bool = True,
+    ) -> asyncio.Future:
+        """Поставить сообщение в очередь. Future завершится после доставки (ждать не обязательно)."""
+        fut = asyncio.get_running_loop().create_future()
+        # ошибку доставки уже залогировали; не ругаемся на «never retrieved», если future никто не ждёт
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        chat = self._chat(chat_id)
+        parts = split_text(text, html=parse_mode == ParseMode.HTML)
+        for i, part in enumerate(parts):
+            item = _Item(part, parse_mode, disable_web_page_preview, coalesce)
+            if i == len(parts) - 1:
+                item.futures.append(fut)
+            chat.queue.append(item)
+        self._wakeup.set()
+        return fut
+
+    def pending(self) -> int:
+        return sum(len(c.queue) for c in self._chats.values())
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._closing = False
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Дослать очередь (не дольше timeout) и остановить воркер."""
+        deadline = time.monotonic() + timeout
+        while (self.pending() or self._sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        # wait_for в 3.11 может «проглотить» отмену, если событие сработало одновременно с ней —
+        # поэтому воркер ещё и сам выходит по флагу
+        self._closing = True
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        for chat in self._chats.values():
+            for item in chat.queue:
+                for f in item.futures:
+                    if not f.done():
+                        f.cancel()
+            chat.queue.clear()
+
+    # ---------- воркер ----------
+    def _take_batch(self, chat: _Chat) -> _Item:
+        item = chat.queue.popleft()
+        while (
+            item.coalesce
+            and chat.queue
+            and chat.queue[0].coalesce
+            and chat.queue[0].parse_mode == item.parse_mode
+            and chat.queue[0].disable_web_page_preview == item.disable_web_page_preview
+            and len(item.text) + 2 + len(chat.queue[0].text) <= TELEGRAM_MAX_LEN
+        ):
+            nxt = chat.queue.popleft()
+            item = _Item(item.text + "\n\n" + nxt.text, item.parse_mode, item.disable_web_page_preview,
+                         True, item.futures + nxt.futures, (item.parts or [item]) + [nxt])
+            self.merged += 1
+        return item
+
+    async def _run(self) -> None:
+        while not self._closing:
+            now = time.monotonic()
+            wait: Optional[float] = None
+            for chat_id, chat in self._chats.items():
+                if chat.busy or not chat.queue:
+                    continue
+                delay = max(chat.bucket.delay(now), self.global_bucket.delay(now))
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                chat.bucket.take(now)
+                self.global_bucket.take(now)
+                chat.busy = True
+                item = self._take_batch(chat)
+                task = asyncio.create_task(self._deliver(chat_id, chat, item))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, chat_id: str, chat: _Chat, item: _Item) -> None:
+        try:
+            async with self._sem:
+                with _SEND_SECONDS.time():
+                    await self.bot.send_message(
+                        chat_id,
+                        item.text,
+                        parse_mode=item.parse_mode,
+                        disable_web_page_preview=item.disable_web_page_preview,
+                    )
+            self.sent += 1
+            for f in item.futures:
+                if not f.done():
+                    f.set_result(None)
+        except TelegramRetryAfter as e:
+            # Telegram сам сказал, сколько ждать: сообщение возвращается в голову очереди чата
+            self.retry_after_hits += 1
+            log.warning("outbox: retry_after %ss for chat %s", e.retry_after, chat_id)
+            chat.bucket.block(float(e.retry_after))
+            chat.queue.appendleft(item)
+        except asyncio.CancelledError:
+            chat.queue.appendleft(item)
+            raise
+        except Exception as e:
+            if item.parts:
+                # склейку целиком не теряем: куски уходят по одному, и ошибка достанется только «плохому»
+                log.warning("outbox: merged send to %s failed (%s), resending %d parts one by one",
+                            chat_id, e, len(item.parts))
+                chat.queue.extendleft(replace(part, coalesce=False) for part in reversed(item.parts))
+                return
+            if isinstance(e, TelegramBadRequest):
+                log.error("outbox: telegram rejected message to %s: %s", chat_id, e)
+            else:
+                log.exception("outbox: send to %s failed: %s", chat_id, e)
+            for f in item.futures:
+                if not f.done():
+                    f.set_exception(e)
+        finally:
+            chat.busy = False
+            self._wakeup.set()
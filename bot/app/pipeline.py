@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+
+log = logging.getLogger("pipeline")
+
+# Стадии конвейера: свечи -> индикаторы -> решение LLM.
+FetchFn = Callable[[str], Awaitable[Optional[Any]]]
+ComputeFn = Callable[[str, Any], Awaitable[Optional[Dict[str, Dict[str, Any]]]]]
+DecideFn = Callable[[str, Dict[str, Dict[str, Any]]], Awaitable[Dict[str, Any]]]
+
+# Наблюдатели длительности стадий: fn(stage, seconds) — время работы стадии без ожидания в семафоре.
+_stage_observers: list[Callable[[str, float], None]] = []
+
+
+def add_stage_observer(fn: Callable[[str, float], None]) -> None:
+    _stage_observers.append(fn)
+
+
+def remove_stage_observer(fn: Callable[[str, float], None]) -> None:
+    if fn in _stage_observers:
+        _stage_observers.remove(fn)
+
+
+def _observe(stage: str, started: float) -> None:
+    if not _stage_observers:
+        return
+    elapsed = time.perf_counter() - started
+    for fn in _stage_observers:
+        try:
+            fn(stage, elapsed)
+        except Exception:
+            log.exception("stage observer failed")
+
+
+@dataclass
+class SymbolResult:
+    symbol: str
+    snapshots: Optional[Dict[str, Dict[str, Any]]] = None
+    analysis: Optional[Dict[str, Any]] = None
+    error: Optional[BaseException] = None
+    stage: str = ""  # на какой стадии остановились: fetch / indicators / decide / done
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.analysis is not None
+
+    @property
+    def no_data(self) -> bool:
+        return self.error is None and self.snapshots is None
+
+
+class Pipeline:
+    """
+    Конвейер по парам: у каждой стадии свой лимит параллельности, так что пока одни пары
+    ждут LLM, другие уже качают свечи. Результаты отдаются по мере готовности,
+    ошибка одной пары не роняет остальные.
+    """
+
+    def __init__(
+        self,
+        fetch: FetchFn,
+        compute: ComputeFn,
+        decide: DecideFn,
+        fetch_limit: int = 16,
+        compute_limit: int = 4,
+        decide_limit: int = 4,
+    ):
+        self.fetch = fetch
+        self.compute = compute
+        self.decide = decide
+        self._fetch_sem = asyncio.Semaphore(max(1, fetch_limit))
+        self._compute_sem = asyncio.Semaphore(max(1, compute_limit))
+        self._decide_sem = asyncio.Semaphore(max(1, decide_limit))
+
+    async def _process(self, symbol: str) -> SymbolResult:
+        res = SymbolResult(symbol=symbol)
+        try:
+            res.stage = "fetch"
+            async with self._fetch_sem:
+                t0 = time.perf_counter()
+                raw = await self.fetch(symbol)
+                _observe("fetch", t0)
+            if raw is None:
+                return res
+
+            res.stage = "indicators"
+            async with self._compute_sem:
+                t0 = time.perf_counter()
+                res.snapshots = await self.compute(symbol, raw)
+                _observe("indicators", t0)
+            if not res.snapshots:
+                res.snapshots = None
+                return res
+
+            res.stage = "decide"
+            async with self._decide_sem:
+                t0 = time.perf_counter()
+                res.analysis = await self.decide(symbol, res.snapshots)
+                _observe("decide", t0)
+            res.stage = "done"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception("pipeline error on %s (%s): %s", symbol, res.stage, e)
+            res.error = e
+        return res
+
+    async def run(self, symbols: Iterable[str]) -> AsyncIterator[SymbolResult]:
+        tasks = [asyncio.create_task(self._process(s)) for s in symbols]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            # потребитель мог прервать итерацию — не оставляем висящих задач
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+
+class BatchingDecider:
+    """
+    Собирает пары, дошедшие до стадии решения, в пакеты для одного запроса к LLM:
+    пакет уходит, когда набралось max_batch пар или прошло max_wait секунд с первой.
+    Параллельно в полёте не больше `concurrency` пакетов.
+    """
+
+    def __init__(
+        self,
+        decide_batch: Callable[[list], Awaitable[Dict[str, Dict[str, Any]]]],
+        max_batch: int = 8,
+        max_wait: float = 0.5,
+        concurrency: int = 4,
+    ):
+        self.decide_batch = decide_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._pending: list[tuple[str, Dict[str, Dict[str, Any]], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def decide(self, symbol: str, snapshots: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((symbol, snapshots, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list) -> None:
+        try:
+            async with self._sem:
+                results = await self.decide_batch([(symbol, snaps) for symbol, snaps, _ in batch])
+        except Exception as e:
+            for *_, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for symbol, _, fut in batch:
+            if fut.done():
+                continue
+            if symbol in results:
+                fut.set_result(results[symbol])
+            else:
+                fut.set_exception(RuntimeError(f"no batch decision for {symbol}"))
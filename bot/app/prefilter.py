@@ -0,0 +1,154 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+import numpy as np
+
+# Детерминированный фильтр «трёх экранов» Элдера перед LLM.
+# Отсекает только очевидные NO_BUY (против тренда старшего ТФ, медвежий D1, нет триггера на H4);
+# всё спорное уходит в LLM как раньше.
+
+
+@dataclass
+class GateVerdict:
+    escalate: bool
+    reason: str
+    checks: Dict[str, Any] = field(default_factory=dict)
+
+    def as_analysis(self) -> Dict[str, Any]:
+        """Тот же формат, что возвращает LLMAnalyzer.analyze_triple."""
+        return {
+            "buy_signal": False,
+            "confidence": 0.0,
+            "reason": self.reason,
+            "checks": self.checks,
+            "source": "prefilter",
+        }
+
+
+class GateStats:
+    """Счётчики на процесс: сколько снапшотов оценили и сколько вызовов LLM сэкономили."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.evaluated = 0
+        self.rejected = 0
+        self.escalated = 0
+
+    def record(self, escalate: bool) -> None:
+        with self._lock:
+            self.evaluated += 1
+            if escalate:
+                self.escalated += 1
+            else:
+                self.rejected += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = (self.rejected / self.evaluated) if self.evaluated else 0.0
+            return {
+                "evaluated": self.evaluated,
+                "rejected": self.rejected,
+                "escalated": self.escalated,
+                "saved_ratio": saved,
+            }
+
+
+gate_stats = GateStats()
+
+
+def _trend_down(s: Dict[str, Any]) -> bool:
+    # цена под MA, MA смотрит вниз, MACD под сигнальной — тренд вниз без оговорок
+    return (
+        not s.get("price_above_ma")
+        and not s.get("ma_trend_up")
+        and float(s.get("macd", 0.0)) < float(s.get("macd_signal", 0.0))
+    )
+
+
+def _macd_bearish(s: Dict[str, Any]) -> bool:
+    macd = float(s.get("macd", 0.0))
+    return macd < 0 and macd <= float(s.get("macd_signal", 0.0)) and not s.get("macd_cross_up")
+
+
+def _no_trigger(s: Dict[str, Any]) -> bool:
+    return (
+        not s.get("macd_cross_up")
+        and not s.get("volume_spike")
+        and not s.get("price_above_ma")
+        and float(s.get("macd_hist", 0.0)) < 0
+    )
+
+
+# Те же правила над массивами (по элементу на свечу, поля как у indicators.snapshot_series) — для бэктеста
+
+def trend_down_series(s: Dict[str, np.ndarray]) -> np.ndarray:
+    return ~s["price_above_ma"] & ~s["ma_trend_up"] & (s["macd"] < s["macd_signal"])
+
+
+def macd_bearish_series(s: Dict[str, np.ndarray]) -> np.ndarray:
+    return (s["macd"] < 0) & (s["macd"] <= s["macd_signal"]) & ~s["macd_cross_up"]
+
+
+def no_trigger_series(s: Dict[str, np.ndarray]) -> np.ndarray:
+    return ~s["macd_cross_up"] & ~s["volume_spike"] & ~s["price_above_ma"] & (s["macd_hist"] < 0)
+
+
+def reject_series(series: Dict[str, Dict[str, np.ndarray]], sensitivity: str = "medium") -> np.ndarray:
+    """
+    Маска «гейт отрезал бы как явный NO_BUY» для каждой свечи; series — {"1w": ..., "1d": ..., "4h": ...},
+    выровненные по одной оси времени. Решения совпадают с TripleScreenGate.evaluate.
+    """
+    weekly_down = trend_down_series(series["1w"])
+    daily_bear = macd_bearish_series(series["1d"])
+    h4_dead = no_trigger_series(series["4h"])
+    if sensitivity == "low":
+        return weekly_down | (daily_bear & h4_dead)
+    if sensitivity == "high":
+        return weekly_down & daily_bear & h4_dead
+    return weekly_down & daily_bear
+
+
+class TripleScreenGate:
+    """
+    evaluate() -> GateVerdict(escalate=False) для явных NO_BUY, иначе escalate=True.
+    Чем выше чувствительность, тем меньше случаев режем локально.
+    """
+
+    def __init__(self, enabled: bool = True, stats: GateStats = gate_stats):
+        self.enabled = enabled
+        self.stats = stats
+
+    def evaluate(self, snapshots: Dict[str, Dict[str, Any]], sensitivity: str = "medium") -> GateVerdict:
+        w = snapshots.get("1w") or {}
+        d = snapshots.get("1d") or {}
+        h4 = snapshots.get("4h") or {}
+        checks = {
+            "weekly_trend_ok": not _trend_down(w) if w else None,
+            "daily_macd_ok": not _macd_bearish(d) if d else None,
+            "h4_volume_confirmation": bool(h4.get("volume_spike")) if h4 else None,
+        }
+        if not self.enabled or not (w and d and h4):
+            return GateVerdict(True, "", checks)
+
+        reasons = []
+        weekly_down = _trend_down(w)
+        daily_bear = _macd_bearish(d)
+        h4_dead = _no_trigger(h4)
+        if sensitivity == "low":
+            # строгий режим: против недельного тренда не покупаем вовсе
+            if weekly_down:
+                reasons.append("недельный тренд вниз")
+            if daily_bear and h4_dead:
+                reasons.append("D1 MACD ниже нуля и нет триггера на H4")
+        elif sensitivity == "high":
+            if weekly_down and daily_bear and h4_dead:
+                reasons.append("все три экрана медвежьи")
+        else:
+            # откат D1 при растущей неделе — это как раз сетап, его решает LLM
+            if weekly_down and daily_bear:
+                reasons.append("недельный тренд вниз и D1 MACD ниже нуля")
+
+        verdict = GateVerdict(not reasons, "Префильтр: " + "; ".join(reasons) if reasons else "", checks)
+        self.stats.record(verdict.escalate)
+        return verdict
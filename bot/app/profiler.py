@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from types import CodeType, FrameType
+from typing import Dict, Iterable, List, Optional, Tuple
+
+log = logging.getLogger("profiler")
+
+# Сэмплирующий профайлер по запросу: отдельный тред раз в `interval` снимает стеки нужных тредов
+# через sys._current_frames() и считает одинаковые стеки. Пока профайлер не запущен, его нет вовсе —
+# ни хуков, ни settrace, ни фонового треда. Результат — collapsed stacks (flamegraph.pl, speedscope).
+
+DEFAULT_THREAD_PREFIXES = ("run_sync", "storage-db")
+
+# листовые кадры, в которых тред просто ждёт работу — в «горячие» не попадают
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+}
+
+# «обвязка» цикла событий и тредов есть почти в каждом стеке — в топе «вместе с вызовами» она не нужна
+_PLUMBING_FILES = {"asyncio/base_events.py", "asyncio/events.py", "asyncio/runners.py", "futures/thread.py"}
+
+Stack = Tuple[str, ...]
+
+
+def _short_path(path: str) -> str:
+    parent, name = os.path.split(path)
+    return f"{os.path.basename(parent)}/{name}" if parent else name
+
+
+class ProfileResult:
+    def __init__(self, stacks: Counter, samples: int, seconds: float, interval: float):
+        self.stacks = stacks          # (тред, внешний кадр, ..., лист) -> число сэмплов
+        self.samples = samples        # сколько раз снимали стеки
+        self.seconds = seconds
+        self.interval = interval
+
+    def busy(self) -> Dict[str, Tuple[int, int]]:
+        """Тред -> (сэмплов «в работе», всего сэмплов)."""
+        out: Dict[str, List[int]] = {}
+        for stack, n in self.stacks.items():
+            acc = out.setdefault(stack[0], [0, 0])
+            acc[1] += n
+            if not _is_idle(stack):
+                acc[0] += n
+        return {k: (v[0], v[1]) for k, v in out.items()}
+
+    def top_self(self, n: int = 10) -> List[Tuple[str, int]]:
+        """Кадры, в которых сэмпл застал тред (собственное время), без простоя."""
+        c: Counter = Counter()
+        for stack, k in self.stacks.items():
+            if len(stack) > 1 and not _is_idle(stack):
+                c[stack[-1]] += k
+        return c.most_common(n)
+
+    def top_total(self, n: int = 10) -> List[Tuple[str, int]]:
+        """Кадры, которые были где-то в стеке (время вместе с вызванными), без простоя."""
+        c: Counter = Counter()
+        for stack, k in self.stacks.items():
+            if len(stack) > 1 and not _is_idle(stack):
+                for frame in set(stack[1:]):
+                    if not _is_plumbing(frame):
+                        c[frame] += k
+        return c.most_common(n)
+
+    def collapsed(self) -> Iterable[str]:
+        for stack, n in sorted(self.stacks.items()):
+            yield ";".join(s.replace(";", ":") for s in stack) + f" {n}"
+
+    def write(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(directory, f"profile-{stamp}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for line in self.collapsed():
+                f.write(line + "\n")
+        return path
+
+
+def _parse(label: str) -> Tuple[str, str]:
+    """Метка кадра "func (dir/file.py:line)" -> (func, dir/file.py)."""
+    name, _, rest = label.partition(" (")
+    return name, rest.rsplit(":", 1)[0]
+
+
+def _is_plumbing(label: str) -> bool:
+    name, path = _parse(label)
+    return name == "<module>" or path in _PLUMBING_FILES or path.endswith("/threading.py")
+
+
+def _is_idle(stack: Stack) -> bool:
+    name, path = _parse(stack[-1])
+    return (path.rsplit("/", 1)[-1], name) in _IDLE_LEAVES
+
+
+class SamplingProfiler:
+    """
+    Профилирует тред event loop (из которого вызван start) и треды с именами на thread_prefixes
+    (тредпул run_sync, поток БД). Одновременно в процессе работает не больше одного профайлера.
+    """
+
+    _running = threading.Lock()
+
+    def __init__(self, interval: float = 0.01, thread_prefixes: Iterable[str] = DEFAULT_THREAD_PREFIXES,
+                 max_depth: int = 64):
+        self.interval = max(0.001, interval)
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.max_depth = max_depth
+        self._labels: Dict[CodeType, str] = {}
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._loop_tid: Optional[int] = None
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _targets(self) -> Dict[int, str]:
+        targets = {}
+        for t in threading.enumerate():
+            if t.ident == self._loop_tid:
+                targets[t.ident] = "event-loop"
+            elif t.ident is not None and t.name.startswith(self.thread_prefixes):
+                # все треды пула — в одну группу, иначе стеки дробятся по номерам тредов
+                targets[t.ident] = next(p for p in self.thread_prefixes if t.name.startswith(p))
+        return targets
+
+    def _sample_loop(self) -> None:
+        targets = self._targets()
+        refreshed = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            if now - refreshed > 1.0:
+                # пул создаёт треды лениво — список целей обновляем раз в секунду
+                targets = self._targets()
+                refreshed = now
+            frames = sys._current_frames()
+            self._samples += 1
+            for tid, group in targets.items():
+                frame: Optional[FrameType] = frames.get(tid)
+                if frame is None:
+                    continue
+                stack: List[str] = []
+                depth = 0
+                while frame is not None and depth < self.max_depth:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                    depth += 1
+                stack.append(group)
+                stack.reverse()
+                self._stacks[tuple(stack)] += 1
+            del frames
+
+    def start(self) -> None:
+        if not SamplingProfiler._running.acquire(blocking=False):
+            raise RuntimeError("profiler is already running")
+        self._loop_tid = threading.get_ident()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> ProfileResult:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        SamplingProfiler._running.release()
+        return ProfileResult(self._stacks, self._samples, time.monotonic() - self._started, self.interval)
+
+
+async def profile_for(seconds: float, interval: float = 0.01) -> ProfileResult:
+    """Профилировать текущий event loop и рабочие треды seconds секунд (loop в это время работает как обычно)."""
+    profiler = SamplingProfiler(interval=interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        result = profiler.stop()
+    log.info("profile: %.0fs, %d samples, %d unique stacks", result.seconds, result.samples, len(result.stacks))
+    return result
@@ -0,0 +1,398 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger("recorder")
+
+# Запись и воспроизведение внешнего I/O бота: свечи с биржи (fetch_ohlcv объекта ccxt внутри клиента)
+# и решения LLM (analyze_triple / analyze_batch). Файл только дописывается:
+#   заголовок _MAGIC, затем кадры: длина (uint32 LE) | zlib(JSON одной записи).
+# Оборванный последний кадр (процесс убили посреди записи) при чтении просто отбрасывается.
+#
+# Запись: {"k": "ohlcv", "s": пара, "tf": TF, "full": без since, "t": старт от начала записи, "d": длительность,
+#          "r": строки свечей} или {"k": "llm", "s": пара, "t", "d", "r": решение}; при исключении вместо "r" — "e".
+
+_MAGIC = b"BOTREC\x00\x01"
+_FRAME = struct.Struct("<I")
+
+
+class RecordedError(Exception):
+    """Ошибка, которая случилась при записи, — при воспроизведении поднимается в том же месте."""
+
+
+class Recorder:
+    """
+    Запись в фоне (как write-behind в storage): write() только ставит запись в очередь,
+    JSON, zlib и файл — в отдельном потоке, event loop с диском не работает. close() дописывает очередь.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._f = open(path, "ab")
+        if self._f.tell() == 0:
+            self._f.write(_MAGIC)
+            self._f.flush()
+        self._queue: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self._closed = False
+        self._t0 = time.monotonic()
+        self.records = 0
+        self._thread = threading.Thread(target=self._writer, name="recorder", daemon=True)
+        self._thread.start()
+
+    def write(self, record: Dict[str, Any], started: float) -> None:
+        """started — time.monotonic() в начале вызова; длительность считается здесь."""
+        if self._closed:
+            return
+        record["t"] = round(started - self._t0, 4)
+        record["d"] = round(time.monotonic() - started, 4)
+        self._queue.put(record)
+
+    def _writer(self) -> None:
+        done = False
+        while not done:
+            batch = [self._queue.get()]
+            # всё, что накопилось, — одной записью в файл
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            chunks = []
+            for record in batch:
+                if record is None:
+                    done = True
+                    continue
+                try:
+                    data = zlib.compress(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode())
+                except Exception as e:
+                    log.warning("recorder: не удалось сериализовать запись %s: %s", record.get("k"), e)
+                    continue
+                chunks.append(_FRAME.pack(len(data)) + data)
+            if not chunks:
+                continue
+            try:
+                self._f.write(b"".join(chunks))
+                self._f.flush()
+                self.records += len(chunks)
+            except Exception as e:
+                log.warning("recorder: не удалось записать %d кадров в %s: %s", len(chunks), self.path, e)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._f.close()
+        log.info("recorder: %d записей в %s", self.records, self.path)
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path}: not a bot recording")
+        while True:
+            head = f.read(_FRAME.size)
+            if len(head) < _FRAME.size:
+                return
+            (size,) = _FRAME.unpack(head)
+            data = f.read(size)
+            if len(data) < size:
+                log.warning("recorder: оборванный последний кадр в %s — пропускаю", path)
+                return
+            yield json.loads(zlib.decompress(data))
+
+
+def _record_call(recorder: Recorder, record: Dict[str, Any], started: float, fn):
+    try:
+        result = fn()
+    except Exception as e:
+        recorder.write({**record, "e": f"{type(e).__name__}: {e}"}, started)
+        raise
+    return result
+
+
+# ---------- запись ----------
+class RecordingExchange:
+    """Обёртка над объектом ccxt (client.ex): fetch_ohlcv пишется в файл, остальное — как есть."""
+
+    def __init__(self, inner: Any, recorder: Recorder):
+        self._inner = inner
+        self._recorder = recorder
+        self._async = inspect.iscoroutinefunction(inner.fetch_ohlcv)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._inner, name)
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since: Optional[int] = None,
+                    limit: Optional[int] = None, params: Optional[dict] = None):
+        if self._async:
+            return self._afetch(symbol, timeframe, since, limit, params or {})
+        record = {"k": "ohlcv", "s": symbol, "tf": timeframe, "full": since is None}
+        started = time.monotonic()
+        rows = _record_call(self._recorder, record, started, lambda: self._inner.fetch_ohlcv(
+            symbol, timeframe=timeframe, since=since, limit=limit, params=params or {}))
+        self._recorder.write({**record, "r": rows}, started)
+        return rows
+
+    async def _afetch(self, symbol: str, timeframe: str, since: Optional[int], limit: Optional[int], params: dict):
+        record = {"k": "ohlcv", "s": symbol, "tf": timeframe, "full": since is None}
+        started = time.monotonic()
+        try:
+            rows = await self._inner.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit, params=params)
+        except Exception as e:
+            self._recorder.write({**record, "e": f"{type(e).__name__}: {e}"}, started)
+            raise
+        self._recorder.write({**record, "r": rows}, started)
+        return rows
+
+
+class RecordingLLM:
+    """Обёртка над LLMAnalyzer: каждое решение пишется в файл (пакет — по записи на пару с общей длительностью)."""
+
+    def __init__(self, inner: Any, recorder: Recorder):
+        self._inner = inner
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._inner, name)
+
+    def _write(self, symbol: str, started: float, result: Dict[str, Any]) -> None:
+        # копия: решение дальше может дополняться, а сериализуется оно в потоке записи
+        self._recorder.write({"k": "llm", "s": symbol, "r": dict(result)}, started)
+
+    def analyze_triple(self, symbol: str, snapshots, *args, **kwargs) -> Dict[str, Any]:
+        started = time.monotonic()
+        res = _record_call(self._recorder, {"k": "llm", "s": symbol}, started,
+                           lambda: self._inner.analyze_triple(symbol, snapshots, *args, **kwargs))
+        self._write(symbol, started, res)
+        return res
+
+    async def aanalyze_triple(self, symbol: str, snapshots, *args, **kwargs) -> Dict[str, Any]:
+        started = time.monotonic()
+        try:
+            res = await self._inner.aanalyze_triple(symbol, snapshots, *args, **kwargs)
+        except Exception as e:
+            self._recorder.write({"k": "llm", "s": symbol, "e": f"{type(e).__name__}: {e}"}, started)
+            raise
+        self._write(symbol, started, res)
+        return res
+
+    def analyze_batch(self, items, *args, **kwargs) -> Dict[str, Dict[str, Any]]:
+        started = time.monotonic()
+        results = self._inner.analyze_batch(items, *args, **kwargs)
+        for symbol, res in results.items():
+            self._write(symbol, started, res)
+        return results
+
+    async def aanalyze_batch(self, items, *args, **kwargs) -> Dict[str, Dict[str, Any]]:
+        started = time.monotonic()
+        results = await self._inner.aanalyze_batch(items, *args, **kwargs)
+        for symbol, res in results.items():
+            self._write(symbol, started, res)
+        return results
+
+
+def install_recorder(ex: Any, llm: Any, path: str) -> Tuple[Recorder, Any]:
+    """Подменить ccxt внутри клиента биржи записывающей обёрткой; вернуть (recorder, обёрнутый llm)."""
+    recorder = Recorder(path)
+    ex.ex = RecordingExchange(ex.ex, recorder)
+    log.info("recorder: пишу запросы к бирже и LLM в %s", path)
+    return recorder, RecordingLLM(llm, recorder)
+
+
+# ---------- воспроизведение ----------
+class Replay:
+    """
+    Записи из файла по ключам: (ohlcv, пара, TF, full) и (llm, пара). Вызовы с одним ключом получают
+    записи по порядку, после последней — её же. speed — во сколько раз быстрее исходных задержек
+    (1 — как записано, 10 — в 10 раз быстрее, 0 — без задержек).
+    Воспроизводится только время обслуживания вызова ("d"); моменты прихода запросов ("t") не
+    повторяются — поток запросов задаёт сам сценарий (цикл бота / бенчмарк).
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self._queues: Dict[tuple, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.symbols: List[str] = []
+        seen = set()
+        for rec in read_records(path):
+            self._queues[self._key(rec)].append(rec)
+            if rec["s"] not in seen:
+                seen.add(rec["s"])
+                self.symbols.append(rec["s"])
+        self._lock = threading.Lock()
+        self.served = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(rec: Dict[str, Any]) -> tuple:
+        if rec["k"] == "ohlcv":
+            return ("ohlcv", rec["s"], rec["tf"], bool(rec["full"]))
+        return ("llm", rec["s"])
+
+    def take(self, *keys: tuple) -> Optional[Dict[str, Any]]:
+        """Следующая запись по первому ключу, для которого она есть."""
+        with self._lock:
+            for key in keys:
+                q = self._queues.get(key)
+                if q:
+                    self.served += 1
+                    return q.popleft() if len(q) > 1 else q[0]
+            self.misses += 1
+            return None
+
+    def delay(self, rec: Optional[Dict[str, Any]]) -> float:
+        if rec is None or self.speed <= 0:
+            return 0.0
+        return float(rec.get("d", 0.0)) / self.speed
+
+
+def _result(rec: Optional[Dict[str, Any]], default: Any) -> Any:
+    if rec is None:
+        return default
+    if "e" in rec:
+        raise RecordedError(rec["e"])
+    return rec["r"]
+
+
+class ReplayExchange:
+    """Вместо объекта ccxt.async_support (client.ex): свечи и задержки из записи."""
+
+    def __init__(self, replay: Replay, exchange_id: str):
+        self.id = exchange_id
+        self.replay = replay
+        self.markets = {
+            s: {"id": s.replace("/", ""), "symbol": s, "spot": True, "active": True} for s in replay.symbols
+        }
+        self.requests = 0
+
+    def _take(self, symbol: str, timeframe: str, since: Optional[int]) -> Optional[Dict[str, Any]]:
+        self.requests += 1
+        full = since is None
+        # нет записи нужного вида (полная история / хвост) — отдаём другой: клиент сам разберётся по длине
+        return self.replay.take(("ohlcv", symbol, timeframe, full), ("ohlcv", symbol, timeframe, not full))
+
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since: Optional[int] = None,
+                          limit: Optional[int] = None, params: Optional[dict] = None) -> list:
+        rec = self._take(symbol, timeframe, since)
+        delay = self.replay.delay(rec)
+        if delay:
+            await asyncio.sleep(delay)
+        return _result(rec, [])
+
+    async def load_markets(self, *args, **kwargs) -> dict:
+        return self.markets
+
+    def market(self, symbol: str) -> dict:
+        return self.markets[symbol]
+
+    async def fetch_tickers(self, *args, **kwargs) -> dict:
+        return {}
+
+    async def close(self) -> None:
+        pass
+
+
+class SyncReplayExchange(ReplayExchange):
+    """То же для синхронного ExchangeClient (вызовы идут из тредпула run_sync)."""
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since: Optional[int] = None,
+                    limit: Optional[int] = None, params: Optional[dict] = None) -> list:
+        rec = self._take(symbol, timeframe, since)
+        delay = self.replay.delay(rec)
+        if delay:
+            time.sleep(delay)
+        return _result(rec, [])
+
+    def load_markets(self, *args, **kwargs) -> dict:
+        return self.markets
+
+    def fetch_tickers(self, *args, **kwargs) -> dict:
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+def _missing(symbol: str) -> Dict[str, Any]:
+    return {
+        "buy_signal": False,
+        "confidence": 0.0,
+        "reason": "нет записи решения LLM для пары",
+        "checks": {},
+        "source": "replay",
+    }
+
+
+class ReplayLLM:
+    """Вместо LLMAnalyzer: решения и задержки из записи (пакет ждёт самую долгую из записанных)."""
+
+    def __init__(self, replay: Replay):
+        self.replay = replay
+        self.retries = 0
+        self.hedged = 0
+        self._latencies: List[float] = []
+
+    def _take(self, symbol: str) -> Tuple[Dict[str, Any], float]:
+        rec = self.replay.take(("llm", symbol))
+        delay = self.replay.delay(rec)
+        self._latencies.append(delay)
+        return _result(rec, _missing(symbol)), delay
+
+    def analyze_triple(self, symbol: str, snapshots, *args, **kwargs) -> Dict[str, Any]:
+        res, delay = self._take(symbol)
+        if delay:
+            time.sleep(delay)
+        return res
+
+    async def aanalyze_triple(self, symbol: str, snapshots, *args, **kwargs) -> Dict[str, Any]:
+        res, delay = self._take(symbol)
+        if delay:
+            await asyncio.sleep(delay)
+        return res
+
+    def _batch(self, items) -> Tuple[Dict[str, Dict[str, Any]], float]:
+        results, longest = {}, 0.0
+        for symbol, _ in items:
+            results[symbol], delay = self._take(symbol)
+            longest = max(longest, delay)
+        return results, longest
+
+    def analyze_batch(self, items, *args, **kwargs) -> Dict[str, Dict[str, Any]]:
+        results, delay = self._batch(items)
+        if delay:
+            time.sleep(delay)
+        return results
+
+    async def aanalyze_batch(self, items, *args, **kwargs) -> Dict[str, Dict[str, Any]]:
+        results, delay = self._batch(items)
+        if delay:
+            await asyncio.sleep(delay)
+        return results
+
+    def latency_stats(self) -> Dict[str, Any]:
+        return {"samples": len(self._latencies), "replayed": self.replay.served, "missing": self.replay.misses}
+
+    async def aclose(self) -> None:
+        pass
+
+
+def install_replay(ex: Any, path: str, speed: float = 1.0) -> Tuple[Replay, ReplayLLM]:
+    """Подменить ccxt внутри клиента биржи воспроизведением записи; вернуть (replay, LLM из записи)."""
+    replay = Replay(path, speed)
+    is_async = inspect.iscoroutinefunction(ex.ex.fetch_ohlcv)
+    ex.ex = (ReplayExchange if is_async else SyncReplayExchange)(replay, ex.exchange_id)
+    log.info("replay: %s, %d пар, скорость x%g", path, len(replay.symbols), speed)
+    return replay, ReplayLLM(replay)
@@ -0,0 +1,67 @@
+from typing import Optional
+
+import numpy as np
+
+from .exchange import FETCH_PAGE_LIMIT, timeframe_ms
+
+# Дневные и недельные бары — точная агрегация 4h/1h потока, если совпадает граница сессии.
+# Почти все биржи режут сутки по 00:00 UTC, а неделю — с понедельника 00:00 UTC.
+# Исключения, которые знаем, перечислены ниже; для остальных берём UTC/понедельник.
+_DAY_MS = 24 * 60 * 60 * 1000
+_MONDAY_ANCHOR_MS = 4 * _DAY_MS          # 1970-01-05 — первый понедельник после эпохи
+_SESSION_OFFSET_MS: dict[str, int] = {}  # биржа -> сдвиг начала суток относительно 00:00 UTC
+_WEEK_ANCHOR_MS: dict[str, int] = {
+    "kraken": 0,  # недельные свечи Kraken выровнены по эпохе (четверг)
+}
+
+# Больше этого за один запрос большинство бирж не отдаёт
+MAX_BASE_LIMIT = FETCH_PAGE_LIMIT
+
+
+def can_resample(base_tf: str, target_tf: str) -> bool:
+    try:
+        base, target = timeframe_ms(base_tf), timeframe_ms(target_tf)
+    except ValueError:
+        return False
+    # месяц/год неравномерные — их не собираем
+    if target_tf[-1] in {"M", "y"}:
+        return False
+    return target > base and target % base == 0 and _DAY_MS % base == 0
+
+
+def base_candles_needed(base_tf: str, target_tf: str, bars: int) -> int:
+    """Сколько базовых свечей нужно, чтобы собрать `bars` старших (+1 бар на неполный первый)."""
+    return (bars + 1) * (timeframe_ms(target_tf) // timeframe_ms(base_tf))
+
+
+def bucket_starts(ts_ms: np.ndarray, target_tf: str, exchange_id: str) -> np.ndarray:
+    tf_ms = timeframe_ms(target_tf)
+    origin = _SESSION_OFFSET_MS.get(exchange_id, 0)
+    if target_tf.endswith("w"):
+        origin += _WEEK_ANCHOR_MS.get(exchange_id, _MONDAY_ANCHOR_MS)
+    ts = ts_ms.astype(np.int64)
+    return (ts - origin) // tf_ms * tf_ms + origin
+
+
+def resample_candles(candles: np.ndarray, base_tf: str, target_tf: str, exchange_id: str) -> Optional[np.ndarray]:
+    """
+    Собирает старший TF из массива свечей (n, 6) [ts, o, h, l, c, v].
+    Первый бар отбрасывается, если история начинается не с его начала; последний остаётся
+    формирующимся — так же, как его отдаёт биржа.
+    """
+    if candles is None or len(candles) == 0 or not can_resample(base_tf, target_tf):
+        return None
+    starts = bucket_starts(candles[:, 0], target_tf, exchange_id)
+    seg = np.flatnonzero(np.diff(starts)) + 1
+    first = np.concatenate(([0], seg))
+    last = np.concatenate((seg, [len(candles)])) - 1
+    out = np.empty((len(first), 6), dtype=np.float64)
+    out[:, 0] = starts[first]
+    out[:, 1] = candles[first, 1]
+    out[:, 2] = np.maximum.reduceat(candles[:, 2], first)
+    out[:, 3] = np.minimum.reduceat(candles[:, 3], first)
+    out[:, 4] = candles[last, 4]
+    out[:, 5] = np.add.reduceat(candles[:, 5], first)
+    if candles[0, 0] != starts[0]:
+        out = out[1:]
+    return out
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Tuple
+
+from .storage import Storage
+
+log = logging.getLogger("retention")
+
+# Обслуживание истории сигналов в state.db:
+#  * тексты причин переносятся в signal_reasons (одинаковые — одной строкой), в signals остаётся reason_id;
+#  * NO_BUY старше keep_days сворачиваются в signals_daily (счётчик и сумма уверенности за день) и удаляются;
+#  * BUY не трогаем — по ним считается cooldown и смотрится история.
+# Работа идёт порциями по `chunk` строк, каждая — своя короткая транзакция в потоке БД,
+# так что запись сигналов и команды бота между порциями не ждут.
+
+_KV_INTERN_WATERMARK = "retention_intern_id"
+
+# порция старых NO_BUY: идёт по индексу idx_signals_retention (decision, ts_utc) в его же порядке
+_SQL_ROLLUP_SELECT = """
+    SELECT id, ts_utc, symbol, timeframe, confidence FROM signals
+    WHERE decision='NO_BUY' AND ts_utc < ?
+    ORDER BY ts_utc LIMIT ?
+"""
+
+
+class Retention:
+    def __init__(self, storage: Storage, keep_days: int = 30, chunk: int = 500):
+        self.storage = storage
+        self.keep_days = keep_days
+        self.chunk = max(1, chunk)
+        self.rolled_up = 0
+        self.interned = 0
+
+    # ---------- порции (выполняются в потоке БД) ----------
+    def _rollup_chunk(self, con: sqlite3.Connection) -> int:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.keep_days)).isoformat(timespec="seconds")
+        rows = con.execute(_SQL_ROLLUP_SELECT, (cutoff, self.chunk)).fetchall()
+        if not rows:
+            return 0
+        agg: Dict[Tuple[str, str, str], list] = defaultdict(lambda: [0, 0.0])
+        for _, ts, symbol, timeframe, conf in rows:
+            a = agg[(ts[:10], symbol, timeframe)]
+            a[0] += 1
+            a[1] += float(conf)
+        with con:
+            con.executemany("""
+                INSERT INTO signals_daily(day, symbol, timeframe, decision, n, confidence_sum)
+                VALUES(?, ?, ?, 'NO_BUY', ?, ?)
+                ON CONFLICT(day, symbol, timeframe, decision) DO UPDATE SET
+                    n = n + excluded.n,
+                    confidence_sum = confidence_sum + excluded.confidence_sum
+            """, [(day, symbol, tf, n, s) for (day, symbol, tf), (n, s) in agg.items()])
+            con.executemany("DELETE FROM signals WHERE id=?", [(r[0],) for r in rows])
+        return len(rows)
+
+    def _intern_chunk(self, con: sqlite3.Connection) -> int:
+        row = con.execute("SELECT v FROM app_kv WHERE k=?", (_KV_INTERN_WATERMARK,)).fetchone()
+        after = int(row[0]) if row else 0
+        rows = con.execute("""
+            SELECT id, reason FROM signals
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (after, self.chunk)).fetchall()
+        if not rows:
+            return 0
+        with con:
+            texts = {r for _, r in rows if r}
+            con.executemany("INSERT OR IGNORE INTO signal_reasons(text) VALUES(?)", [(t,) for t in texts])
+            con.executemany("""
+                UPDATE signals
+                SET reason_id = (SELECT id FROM signal_reasons WHERE text=?), reason = NULL
+                WHERE id=?
+            """, [(r, i) for i, r in rows if r])
+            con.execute("""
+                INSERT INTO app_kv(k, v) VALUES(?, ?)
+                ON CONFLICT(k) DO UPDATE SET v=excluded.v
+            """, (_KV_INTERN_WATERMARK, str(rows[-1][0])))
+        return len(rows)
+
+    def step(self) -> bool:
+        """Одна порция свёртки и одна порция переноса причин; True — работа ещё осталась."""
+        self.storage.flush()
+        rolled = self.storage.call(self._rollup_chunk)
+        # причины переносим после свёртки, чтобы не интернировать строки, которые тут же удалятся
+        interned = self.storage.call(self._intern_chunk) if rolled < self.chunk else 0
+        self.rolled_up += rolled
+        self.interned += interned
+        return rolled >= self.chunk or interned >= self.chunk
+
+    # ---------- фоновая задача ----------
+    async def run_forever(self, interval_seconds: float = 3600.0, pause_seconds: float = 0.2) -> None:
+        while True:
+            try:
+                more = await self.storage.run(self.step)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("retention step failed: %s", e)
+                more = False
+            if more:
+                # есть ещё работа: короткая пауза, чтобы не занимать поток БД подряд
+                await asyncio.sleep(pause_seconds)
+                continue
+            if self.rolled_up or self.interned:
+                log.info("retention: свернуто NO_BUY %d, причин перенесено %d", self.rolled_up, self.interned)
+                self.rolled_up = self.interned = 0
+            await asyncio.sleep(interval_seconds)
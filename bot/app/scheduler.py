@@ -1,10 +1,92 @@
 import asyncio
+import logging
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import Callable
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+from .exchange import timeframe_ms
+from .resample import bucket_starts
+
+log = logging.getLogger("scheduler")
 
 # Хелпер: безопасно выполнять sync-функции CCXT/Pandas в тредпуле
-_executor = ThreadPoolExecutor(max_workers=8)
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="run_sync")  # имя — для профайлера
 
 async def run_sync(func: Callable, *args, **kwargs):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(_executor, lambda: func(*args, **kwargs))
+
+
+# ----------------- Запуск по закрытию свечи -----------------
+
+def next_close_ms(timeframe: str, now_ms: int, exchange_id: str = "") -> int:
+    """Время закрытия текущей (формирующейся) свечи TF — с учётом якоря недели биржи."""
+    start = int(bucket_starts(np.array([now_ms], dtype=np.int64), timeframe, exchange_id)[0])
+    return start + timeframe_ms(timeframe)
+
+
+class CandleCloseScheduler:
+    """
+    Таймер по закрытию свечей: просыпается сразу после закрытия решающего TF (+ grace на задержку биржи),
+    собирает в одну пачку все пары, у которых закрылся бар в этот момент, и вызывает handler.
+    Пара, по которой последний закрытый бар уже обработан, в пачку не попадает.
+    handler(close_ms, symbols) возвращает пары, которые реально обработаны; остальные повторяются
+    через retry_seconds, пока не закроется следующий бар.
+    """
+
+    def __init__(self, exchange_id: str, grace_seconds: float = 15.0, retry_seconds: float = 60.0):
+        self.exchange_id = exchange_id
+        self.grace_ms = int(grace_seconds * 1000)
+        self.retry_seconds = retry_seconds
+        self._done: Dict[str, int] = {}  # пара -> время закрытия последнего обработанного бара
+
+    def last_closed_ms(self, timeframe: str, now_ms: int) -> int:
+        return next_close_ms(timeframe, now_ms, self.exchange_id) - timeframe_ms(timeframe)
+
+    def due(self, jobs: Dict[str, str], now_ms: int) -> Dict[int, list]:
+        """Пачки {время закрытия: [пары]} по парам с ещё не обработанным закрытым баром."""
+        batches: Dict[int, list] = {}
+        for symbol, tf in jobs.items():
+            closed = self.last_closed_ms(tf, now_ms - self.grace_ms)
+            if self._done.get(symbol, 0) < closed:
+                batches.setdefault(closed, []).append(symbol)
+        return batches
+
+    def next_wake_ms(self, jobs: Dict[str, str], now_ms: int) -> int:
+        closes = [next_close_ms(tf, now_ms - self.grace_ms, self.exchange_id) for tf in set(jobs.values())]
+        return (min(closes) if closes else now_ms + 60_000) + self.grace_ms
+
+    def mark_done(self, symbols: Iterable[str], close_ms: int) -> None:
+        for s in symbols:
+            if self._done.get(s, 0) < close_ms:
+                self._done[s] = close_ms
+
+    async def run(
+        self,
+        get_jobs: Callable[[], Awaitable[Dict[str, str]]],
+        handler: Callable[[int, list], Awaitable[Optional[Iterable[str]]]],
+    ) -> None:
+        """get_jobs() -> {пара: решающий TF}; запрашивается на каждом пробуждении (список пар мог смениться)."""
+        while True:
+            pending = False
+            try:
+                jobs = await get_jobs()
+                now_ms = int(time.time() * 1000)
+                for close_ms, symbols in sorted(self.due(jobs, now_ms).items()):
+                    done = await handler(close_ms, symbols)
+                    done = set(symbols) if done is None else set(done) & set(symbols)
+                    self.mark_done(done, close_ms)
+                    pending = pending or len(done) < len(symbols)
+                wake_ms = self.next_wake_ms(jobs, int(time.time() * 1000))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("scheduler error: %s", e)
+                pending = True
+                wake_ms = 0
+            delay = max(0.0, wake_ms / 1000 - time.time())
+            if pending:
+                delay = min(delay, self.retry_seconds)
+            await asyncio.sleep(delay)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .exchange import AsyncExchangeClient, ExchangeClient
+from .scheduler import run_sync
+from .snapshots import fetch_candles
+
+log = logging.getLogger("screener")
+
+# Скринер рынка: один fetch_tickers по всем парам биржи, дешёвые векторные фильтры (оборот, % изменения,
+# отклонение от средней) по тысячам пар сразу — и только top K идут в три экрана и LLM.
+
+# Плечевые токены, которые не анализируем (…UP не режем: под него попадают обычные монеты вроде JUP)
+_EXCLUDED_SUFFIXES = ("DOWN", "BULL", "BEAR", "3L", "3S", "5L", "5S")
+
+
+@dataclass(frozen=True)
+class ScreenerParams:
+    quote: str = "USDT"
+    min_quote_volume: float = 5_000_000.0   # оборот за 24ч в валюте котировки
+    min_change: float = -5.0                # % изменения за 24ч
+    max_change: float = 40.0                # выше — обычно памп, не наш сетап
+    top_k: int = 10
+    use_klines: bool = False                # уточнять отклонение от MA по дневным свечам кандидатов
+    kline_tf: str = "1d"
+    ma_window: int = 50
+    kline_candidates: int = 30              # сколько лучших по тикерам проверять свечами
+
+
+def _f(x: Any) -> float:
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _zscore(x: np.ndarray) -> np.ndarray:
+    sd = np.nanstd(x)
+    if not sd or np.isnan(sd):
+        return np.zeros_like(x)
+    return (x - np.nanmean(x)) / sd
+
+
+def rank_tickers(
+    tickers: Dict[str, Dict[str, Any]],
+    params: ScreenerParams,
+    markets: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> List[Tuple[str, float]]:
+    """
+    [(пара, score)] по убыванию score — все прошедшие фильтры.
+    score = z(log оборота) + z(% изменения) + z(отклонения цены от VWAP за 24ч).
+    """
+    suffix = "/" + params.quote
+    symbols = []
+    for s in tickers:
+        if not s.endswith(suffix):
+            continue
+        base = s[: -len(suffix)]
+        if base.endswith(_EXCLUDED_SUFFIXES):
+            continue
+        m = (markets or {}).get(s)
+        if m is not None and (not m.get("spot", True) or m.get("active") is False):
+            continue
+        symbols.append(s)
+    if not symbols:
+        return []
+
+    t = [tickers[s] for s in symbols]
+    last = np.fromiter((_f(x.get("last") or x.get("close")) for x in t), dtype=np.float64, count=len(t))
+    qvol = np.fromiter((_f(x.get("quoteVolume")) for x in t), dtype=np.float64, count=len(t))
+    bvol = np.fromiter((_f(x.get("baseVolume")) for x in t), dtype=np.float64, count=len(t))
+    change = np.fromiter((_f(x.get("percentage")) for x in t), dtype=np.float64, count=len(t))
+    vwap = np.fromiter((_f(x.get("vwap")) for x in t), dtype=np.float64, count=len(t))
+
+    # у части бирж нет quoteVolume — оцениваем как baseVolume * цена
+    qvol = np.where(np.isnan(qvol), bvol * np.where(np.isnan(vwap), last, vwap), qvol)
+    # отклонение от VWAP обрезаем: единичный выброс не должен перевешивать оборот и динамику
+    dist = np.clip(np.where(vwap > 0, last / vwap - 1.0, 0.0), -0.2, 0.2)
+
+    ok = (
+        (last > 0)
+        & (qvol >= params.min_quote_volume)
+        & (change >= params.min_change)
+        & (change <= params.max_change)
+    )
+    if not ok.any():
+        return []
+    idx = np.flatnonzero(ok)
+    score = _zscore(np.log(qvol[idx])) + _zscore(change[idx]) + _zscore(dist[idx])
+    perm = np.argsort(-score, kind="stable")
+    return [(symbols[idx[i]], float(score[i])) for i in perm]
+
+
+def ma_distance(closes: np.ndarray, window: int) -> np.ndarray:
+    """Отклонение последней цены от SMA(window) по матрице (пары, свечи); одна операция на все пары."""
+    ma = closes[:, -window:].mean(axis=1)
+    return closes[:, -1] / ma - 1.0
+
+
+class Screener:
+    def __init__(self, ex: ExchangeClient | AsyncExchangeClient, params: ScreenerParams, refresh_seconds: float = 900.0):
+        self.ex = ex
+        self.params = params
+        self.refresh_seconds = refresh_seconds
+        self._cached: Optional[Tuple[float, List[str]]] = None
+        self.last_universe = 0
+        self.last_passed = 0
+
+    async def _tickers(self) -> Dict[str, Dict[str, Any]]:
+        if isinstance(self.ex, AsyncExchangeClient):
+            return await self.ex.fetch_tickers()
+        return await run_sync(self.ex.fetch_tickers)
+
+    async def _refine_with_klines(self, candidates: List[str]) -> List[str]:
+        p = self.params
+        limit = p.ma_window + 1
+        sem = asyncio.Semaphore(8)
+
+        async def one(symbol: str):
+            async with sem:
+                try:
+                    return await fetch_candles(self.ex, symbol, p.kline_tf, limit)
+                except Exception as e:
+                    log.warning("screener: %s %s candles failed: %s", symbol, p.kline_tf, e)
+                    return None
+
+        arrays = await asyncio.gather(*[one(s) for s in candidates])
+        have = [(s, a) for s, a in zip(candidates, arrays) if a is not None and len(a) >= p.ma_window]
+        if not have:
+            return candidates
+        closes = np.stack([a[-p.ma_window:, 4] for _, a in have])
+        dist = ma_distance(closes, p.ma_window)
+        # выше дневной MA — первый экран «за»; порядок по отклонению не меняем, только фильтр
+        return [s for (s, _), d in zip(have, dist) if d > 0]
+
+    async def screen(self) -> List[str]:
+        """Top K пар рынка. Результат кэшируется на refresh_seconds."""
+        now = time.monotonic()
+        if self._cached is not None and now - self._cached[0] < self.refresh_seconds:
+            return self._cached[1]
+        tickers = await self._tickers()
+        markets = getattr(self.ex.ex, "markets", None) or None
+        ranked = rank_tickers(tickers, self.params, markets)
+        self.last_universe = len(tickers)
+        self.last_passed = len(ranked)
+        symbols = [s for s, _ in ranked]
+        if self.params.use_klines:
+            symbols = await self._refine_with_klines(symbols[: max(self.params.top_k, self.params.kline_candidates)])
+        top = symbols[: self.params.top_k]
+        self._cached = (now, top)
+        log.info("screener: %d tickers -> %d passed -> top %d", len(tickers), len(ranked), len(top))
+        return top
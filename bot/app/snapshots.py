@@ -0,0 +1,134 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .exchange import ExchangeClient, AsyncExchangeClient, timeframe_ms
+from .indicator_state import IndicatorBook
+from .metrics import METRICS
+from .resample import base_candles_needed, can_resample, resample_candles
+from .scheduler import run_sync
+
+# Свечи по трём экранам и снапшоты индикаторов по ним. Общие для хендлеров бота и воркер-процессов.
+
+# Потоковое состояние индикаторов по (биржа, пара, TF): новая свеча — O(1), а не пересчёт всей истории.
+# У каждого процесса своё.
+indicator_book = IndicatorBook()
+
+# те же гистограммы, что наполняет конвейер (pipeline -> METRICS.stage_observer в main)
+_FETCH_SECONDS = METRICS.histogram("bot_stage_seconds", stage="fetch")
+_INDICATORS_SECONDS = METRICS.histogram("bot_stage_seconds", stage="indicators")
+
+
+async def fetch_candles(ex: ExchangeClient | AsyncExchangeClient, symbol: str, tf: str, limit: int):
+    # асинхронный клиент ходит в сеть сам, синхронный — через тредпул
+    if isinstance(ex, AsyncExchangeClient):
+        return await ex.fetch_candles(symbol, tf, limit)
+    return await run_sync(ex.fetch_candles, symbol, tf, limit)
+
+
+def closed_candles(candles: Dict[str, np.ndarray], closed_by_ms: int) -> Dict[str, np.ndarray]:
+    """Только бары, закрытые к closed_by_ms (ts + длина TF <= closed_by_ms): формирующийся отбрасывается."""
+    out = {}
+    for tf, arr in candles.items():
+        n = int(np.searchsorted(arr[:, 0], closed_by_ms - timeframe_ms(tf), side="right"))
+        out[tf] = arr[:n]
+    return out
+
+
+async def fetch_triple(
+    ex: ExchangeClient | AsyncExchangeClient,
+    symbol: str,
+    tfs: List[str],
+    min_len: int,
+    derive: bool = False,
+    closed_by_ms: Optional[int] = None,
+) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Свечи по всем TF сразу (запросы идут параллельно). None — если где-то не хватает данных.
+    derive=True: старшие TF (1d/1w) собираются локально из младшего (4h). Под 1w нужно ~2350 баров 4h —
+    холодный старт качает их страницами, дальше в кэше докачивается только хвост (один запрос на пару).
+    Если нужная история не помещается в кэш свечей (CANDLE_CACHE_MAX) — TF берётся с биржи.
+    closed_by_ms: на решающем (младшем) TF только бары, закрытые к этому моменту (цикл по закрытию свечи:
+    только что открывшийся бар с объёмом за несколько секунд в снапшот не попадает). Старшие TF остаются
+    как есть, с формирующимся баром, — так же, как их видят /check и интервальный режим.
+    """
+    limit = 300
+    base_tf = min(tfs, key=timeframe_ms)
+    base_key = (ex.exchange_id, symbol, base_tf)
+    base_limit = limit
+    derived_tfs = []
+    if derive:
+        depth = ex.cache.max_candles
+        for tf in tfs:
+            if tf == base_tf or not can_resample(base_tf, tf):
+                continue
+            if base_candles_needed(base_tf, tf, min_len) > depth:
+                continue  # столько базовых свечей кэш не держит — старший TF с биржи, базу не раздуваем
+            # берём с запасом (до тех же `limit` старших баров), чтобы EMA успели «разогреться»
+            base_limit = max(base_limit, min(depth, base_candles_needed(base_tf, tf, limit)))
+            derived_tfs.append(tf)
+
+    direct = [tf for tf in tfs if tf not in derived_tfs]
+    fetched = await asyncio.gather(*[
+        fetch_candles(ex, symbol, tf, base_limit if tf == base_tf else limit) for tf in direct
+    ])
+    result = dict(zip(direct, fetched))
+
+    base = result.get(base_tf)
+    if derived_tfs and base is not None:
+        history = ex.cache.get(base_key)
+        if history is None or len(history) < len(base):
+            history = base
+        for tf in derived_tfs:
+            arr = resample_candles(history, base_tf, tf, ex.exchange_id)
+            if arr is None or len(arr) < min_len:
+                # истории не хватило — этот TF берём с биржи
+                arr = await fetch_candles(ex, symbol, tf, limit)
+            result[tf] = arr
+    if base is not None:
+        result[base_tf] = base[-limit:]
+
+    if closed_by_ms is not None and result.get(base_tf) is not None:
+        result[base_tf] = closed_candles({base_tf: result[base_tf]}, closed_by_ms)[base_tf]
+    candles = [result.get(tf) for tf in tfs]
+    if any(c is None or len(c) < min_len for c in candles):
+        return None
+    return {tf: c[-limit:] for tf, c in zip(tfs, candles)}
+
+
+def snapshots_from_candles(
+    exchange_id: str,
+    symbol: str,
+    candles: Dict[str, np.ndarray],
+    ma_window: int,
+    macd_fast: int,
+    macd_slow: int,
+    macd_signal: int,
+) -> Dict[str, dict]:
+    return {
+        tf: indicator_book.snapshot((exchange_id, symbol, tf), arr, ma_window, macd_fast, macd_slow, macd_signal)
+        for tf, arr in candles.items()
+    }
+
+
+async def build_snapshots_triple(
+    ex: ExchangeClient | AsyncExchangeClient,
+    symbol: str,
+    tfs: List[str],
+    ma_window: int,
+    macd_fast: int,
+    macd_slow: int,
+    macd_signal: int,
+    derive: bool = False,
+):
+    """
+    Возвращает dict: { '1w': snapshot, '1d': snapshot, '4h': snapshot }
+    или None если по какому-то TF не хватает данных.
+    """
+    with _FETCH_SECONDS.time():
+        candles = await fetch_triple(ex, symbol, tfs, max(ma_window, macd_slow) + 5, derive=derive)
+    if candles is None:
+        return None
+    with _INDICATORS_SECONDS.time():
+        return snapshots_from_candles(ex.exchange_id, symbol, candles, ma_window, macd_fast, macd_slow, macd_signal)
@@ -1,16 +1,162 @@
+import asyncio
 import sqlite3
 import os
-from typing import Optional, List
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional, List
 from datetime import datetime, timezone
 
+from .cooldown import CooldownIndex
+from .metrics import METRICS
+
+log = logging.getLogger("storage")
+
+# Запросы — константы модуля: sqlite3 кэширует подготовленные выражения по тексту SQL,
+# так что на горячем пути они не перекомпилируются.
+_SQL_INSERT_SIGNAL = """
+    INSERT INTO signals (ts_utc, symbol, timeframe, decision, confidence, reason)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+_SQL_LAST_BUY = """
+    SELECT ts_utc FROM signals
+    WHERE symbol=? AND timeframe=? AND decision='BUY'
+    ORDER BY id DESC LIMIT 1
+"""
+# последний BUY по каждой паре/TF — целиком из покрывающего индекса idx_signals_cooldown
+_SQL_LAST_BUYS = """
+    SELECT symbol, timeframe, ts_utc FROM signals
+    WHERE id IN (
+        SELECT MAX(id) FROM signals WHERE decision='BUY' GROUP BY symbol, timeframe
+    )
+"""
+_SQL_GET_KV = "SELECT v FROM app_kv WHERE k=?"
+_SQL_SET_KV = """
+    INSERT INTO app_kv(k, v)
+    VALUES(?, ?)
+    ON CONFLICT(k) DO UPDATE SET v=excluded.v
+"""
+_SQL_PUT_LLM_CACHE = """
+    INSERT INTO llm_cache(k, v, expires_at)
+    VALUES(?, ?, ?)
+    ON CONFLICT(k) DO UPDATE SET v=excluded.v, expires_at=excluded.expires_at
+"""
+
+# write-behind: сигналы копятся в памяти и пишутся одной транзакцией
+_FLUSH_MAX_PENDING = 256
+_FLUSH_MAX_AGE_SECONDS = 5.0
+
+_FLUSH_SECONDS = METRICS.histogram("bot_db_flush_seconds", "Запись пачки сигналов в SQLite")
+_FLUSH_ROWS = METRICS.counter("bot_db_signals_written_total", "Сигналов записано в SQLite")
+
+
+class _Db:
+    """
+    Одно долгоживущее соединение на файл БД (WAL, synchronous=NORMAL) и один поток, через который
+    идёт весь доступ к нему. Event loop с диском не работает: он только ставит задачи в этот поток.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-db")
+        self._ident: Optional[int] = None
+        self._con: Optional[sqlite3.Connection] = None
+        self._pending: list[tuple] = []
+        self._pending_since = 0.0
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+        self.cooldown = CooldownIndex()
+        self.call(self._open)
+
+    def _open(self, _con) -> None:
+        self._ident = threading.get_ident()
+        con = sqlite3.connect(self.path, cached_statements=256)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA busy_timeout=5000")
+        self._con = con
+
+    def call(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполнить fn(con) в потоке БД и дождаться результата (из любого потока, кроме event loop)."""
+        if threading.get_ident() == self._ident:
+            return fn(self._con)
+        return self._executor.submit(lambda: fn(self._con)).result()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]) -> Future:
+        """Поставить fn(con) в поток БД, не дожидаясь результата."""
+        return self._executor.submit(lambda: fn(self._con))
+
+    def enqueue_signal(self, row: tuple) -> None:
+        with self._pending_lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append(row)
+            due = (
+                len(self._pending) >= _FLUSH_MAX_PENDING
+                or time.monotonic() - self._pending_since >= _FLUSH_MAX_AGE_SECONDS
+            )
+            if not due or self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self.submit(self.flush_pending)
+
+    def flush_pending(self, con: sqlite3.Connection) -> int:
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+            self._flush_scheduled = False
+        if not rows:
+            return 0
+        try:
+            with _FLUSH_SECONDS.time(), con:
+                con.executemany(_SQL_INSERT_SIGNAL, rows)
+        except Exception:
+            log.exception("storage: не удалось записать %d сигналов", len(rows))
+            with self._pending_lock:
+                self._pending[:0] = rows
+            raise
+        _FLUSH_ROWS.inc(len(rows))
+        return len(rows)
+
+    def pending(self) -> int:
+        with self._pending_lock:
+            return len(self._pending)
+
+    def close(self) -> None:
+        def _close(con):
+            self.flush_pending(con)
+            con.close()
+            self._con = None
+        try:
+            self.call(_close)
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+_dbs: dict[str, _Db] = {}
+_dbs_lock = threading.Lock()
+
+
 class Storage:
+    """
+    Фасад над state.db. Экземпляры дешёвые: все Storage с одним путём делят одно соединение,
+    поток БД и очередь отложенной записи сигналов.
+    Синхронные методы блокируют вызывающий поток — из корутин их зовут через `await storage.run(...)`.
+    """
+
     def __init__(self, state_dir: str):
         os.makedirs(state_dir, exist_ok=True)
         self.path = os.path.join(state_dir, "state.db")
-        self._init_db()
+        with _dbs_lock:
+            db = _dbs.get(self.path)
+            if db is None:
+                db = _dbs[self.path] = _Db(self.path)
+                db.call(self._init_db)
+                db.cooldown.load(db.call(lambda con: con.execute(_SQL_LAST_BUYS).fetchall()))
+        self._db = db
 
-    def _init_db(self):
-        with sqlite3.connect(self.path) as con:
+    def _init_db(self, con: sqlite3.Connection):
+        with con:
             con.execute("""
             CREATE TABLE IF NOT EXISTS signals (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,7 +168,11 @@ class Storage:
                 reason TEXT
             )
             """)
-            con.execute("CREATE INDEX IF NOT EXISTS idx_symbol_tf ON signals(symbol, timeframe)")
+            # (symbol, timeframe, decision, id): последний BUY пары — один проход по индексу
+            con.execute("DROP INDEX IF EXISTS idx_symbol_tf")
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS idx_signals_cooldown ON signals(symbol, timeframe, decision, id)"
+            )
             con.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 chat_id INTEGER PRIMARY KEY,
@@ -37,63 +187,149 @@ class Storage:
                 v TEXT
             )
             """)
+            # Ретеншн (retention.py): повторяющиеся тексты причин хранятся один раз,
+            # старые NO_BUY сворачиваются в дневные агрегаты
+            cols = {row[1] for row in con.execute("PRAGMA table_info(signals)")}
+            if "reason_id" not in cols:
+                con.execute("ALTER TABLE signals ADD COLUMN reason_id INTEGER")
+            # свёртка старых NO_BUY выбирает их по (decision, ts_utc) — без индекса это полный скан signals
+            con.execute("CREATE INDEX IF NOT EXISTS idx_signals_retention ON signals(decision, ts_utc)")
+            con.execute("""
+            CREATE TABLE IF NOT EXISTS signal_reasons (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL UNIQUE
+            )
+            """)
+            con.execute("""
+            CREATE TABLE IF NOT EXISTS signals_daily (
+                day TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                decision TEXT NOT NULL,
+                n INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (day, symbol, timeframe, decision)
+            )
+            """)
+            # полная история для чтения: причина либо в строке, либо в signal_reasons
+            con.execute("""
+            CREATE VIEW IF NOT EXISTS signals_full AS
+            SELECT s.id, s.ts_utc, s.symbol, s.timeframe, s.decision, s.confidence,
+                   COALESCE(s.reason, r.text) AS reason
+            FROM signals s LEFT JOIN signal_reasons r ON r.id = s.reason_id
+            """)
+            # Кэш решений LLM (переживает рестарт)
+            con.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                k TEXT PRIMARY KEY,
+                v TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+
+    # ---------- доступ из asyncio ----------
+    async def run(self, fn: Callable, *args):
+        """Выполнить синхронный метод Storage в потоке БД, не блокируя event loop."""
+        return await asyncio.wrap_future(self._db.submit(lambda _con: fn(*args)))
+
+    def call(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """fn(con) на общем соединении в потоке БД (для обслуживающих задач вроде retention)."""
+        return self._db.call(fn)
+
+    def pending_signals(self) -> int:
+        """Сколько сигналов ждут записи (write-behind)."""
+        return self._db.pending()
+
+    def flush(self) -> int:
+        """Записать накопленные сигналы одной транзакцией (зовётся в конце цикла/команды)."""
+        return self._db.call(self._db.flush_pending)
+
+    def close(self) -> None:
+        with _dbs_lock:
+            if _dbs.get(self.path) is self._db:
+                del _dbs[self.path]
+        self._db.close()
 
     # ---------- signals ----------
     def last_buy_ts(self, symbol: str, timeframe: str) -> Optional[str]:
-        with sqlite3.connect(self.path) as con:
-            cur = con.execute("""
-                SELECT ts_utc FROM signals
-                WHERE symbol=? AND timeframe=? AND decision='BUY'
-                ORDER BY id DESC LIMIT 1
-            """, (symbol, timeframe))
-            row = cur.fetchone()
+        def q(con):
+            self._db.flush_pending(con)
+            row = con.execute(_SQL_LAST_BUY, (symbol, timeframe)).fetchone()
             return row[0] if row else None
+        return self._db.call(q)
 
     def insert_signal(self, symbol: str, timeframe: str, decision: str, confidence: float, reason: str):
-        with sqlite3.connect(self.path) as con:
-            con.execute("""
-                INSERT INTO signals (ts_utc, symbol, timeframe, decision, confidence, reason)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (datetime.now(timezone.utc).isoformat(timespec="seconds"),
-                  symbol, timeframe, decision, float(confidence), reason))
+        # не ждём диска: строка уходит в очередь, запись — пачкой в потоке БД
+        now = datetime.now(timezone.utc)
+        if decision == "BUY":
+            self._db.cooldown.record_buy(symbol, timeframe, now.timestamp())
+        self._db.enqueue_signal((now.isoformat(timespec="seconds"),
+                                 symbol, timeframe, decision, float(confidence), reason))
+
+    def within_cooldown(self, symbol: str, timeframe: str, hours: float) -> bool:
+        """Был ли BUY по паре/TF за последние `hours` часов. Только память — можно звать из event loop."""
+        return self._db.cooldown.within(symbol, timeframe, hours, datetime.now(timezone.utc).timestamp())
+
+    # ---------- llm_cache ----------
+    def load_llm_cache(self, now: float, limit: int) -> List[tuple[str, str, float]]:
+        """Живые записи кэша решений (самые свежие — последними); протухшие заодно удаляем."""
+        def q(con):
+            with con:
+                con.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+            cur = con.execute("""
+                SELECT k, v, expires_at FROM (
+                    SELECT k, v, expires_at FROM llm_cache ORDER BY expires_at DESC LIMIT ?
+                ) ORDER BY expires_at ASC
+            """, (limit,))
+            return cur.fetchall()
+        return self._db.call(q)
+
+    def put_llm_cache(self, key: str, value: str, expires_at: float) -> None:
+        # кэш — не критичные данные: пишем в фоне, не дожидаясь
+        def q(con):
+            with con:
+                con.execute(_SQL_PUT_LLM_CACHE, (key, value, expires_at))
+        self._db.submit(q)
 
     # ---------- user prefs (персистентные личные) ----------
     def get_user_prefs(self, chat_id: int) -> tuple[Optional[str], Optional[str]]:
-        with sqlite3.connect(self.path) as con:
-            cur = con.execute("SELECT symbol, timeframe FROM users WHERE chat_id=?", (chat_id,))
-            row = cur.fetchone()
+        def q(con):
+            row = con.execute("SELECT symbol, timeframe FROM users WHERE chat_id=?", (chat_id,)).fetchone()
             return (row[0], row[1]) if row else (None, None)
+        return self._db.call(q)
 
     def set_user_symbol(self, chat_id: int, symbol: str) -> None:
-        with sqlite3.connect(self.path) as con:
-            con.execute("""
-                INSERT INTO users(chat_id, symbol)
-                VALUES(?, ?)
-                ON CONFLICT(chat_id) DO UPDATE SET symbol=excluded.symbol
-            """, (chat_id, symbol))
+        def q(con):
+            with con:
+                con.execute("""
+                    INSERT INTO users(chat_id, symbol)
+                    VALUES(?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET symbol=excluded.symbol
+                """, (chat_id, symbol))
+        self._db.call(q)
 
     def set_user_timeframe(self, chat_id: int, timeframe: str) -> None:
-        with sqlite3.connect(self.path) as con:
-            con.execute("""
-                INSERT INTO users(chat_id, timeframe)
-                VALUES(?, ?)
-                ON CONFLICT(chat_id) DO UPDATE SET timeframe=excluded.timeframe
-            """, (chat_id, timeframe))
+        def q(con):
+            with con:
+                con.execute("""
+                    INSERT INTO users(chat_id, timeframe)
+                    VALUES(?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET timeframe=excluded.timeframe
+                """, (chat_id, timeframe))
+        self._db.call(q)
 
     # ---------- app_kv (глобальные пары для автоциклов) ----------
     def _get_kv(self, key: str) -> Optional[str]:
-        with sqlite3.connect(self.path) as con:
-            cur = con.execute("SELECT v FROM app_kv WHERE k=?", (key,))
-            row = cur.fetchone()
+        def q(con):
+            row = con.execute(_SQL_GET_KV, (key,)).fetchone()
             return row[0] if row else None
+        return self._db.call(q)
 
     def _set_kv(self, key: str, val: str) -> None:
-        with sqlite3.connect(self.path) as con:
-            con.execute("""
-                INSERT INTO app_kv(k, v)
-                VALUES(?, ?)
-                ON CONFLICT(k) DO UPDATE SET v=excluded.v
-            """, (key, val))
+        def q(con):
+            with con:
+                con.execute(_SQL_SET_KV, (key, val))
+        self._db.call(q)
 
     def set_global_symbols(self, symbols_csv: str) -> None:
         # Храним как CSV в верхнем регистре, с нормализацией разделителя
@@ -101,8 +337,10 @@ class Storage:
         self._set_kv("global_symbols", norm)
 
     def clear_global_symbols(self) -> None:
-        with sqlite3.connect(self.path) as con:
-            con.execute("DELETE FROM app_kv WHERE k='global_symbols'")
+        def q(con):
+            with con:
+                con.execute("DELETE FROM app_kv WHERE k='global_symbols'")
+        self._db.call(q)
 
     def get_global_symbols(self) -> List[str]:
         raw = self._get_kv("global_symbols")
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import random
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import aiohttp
+
+from .exchange import AsyncExchangeClient, ExchangeClient, _shared_http_session, timeframe_ms
+from .scheduler import run_sync
+from .snapshots import fetch_candles
+
+log = logging.getLogger("streaming")
+
+# Потоковый режим свечей: kline-стримы биржи по всем парам/TF через несколько мультиплексированных
+# WebSocket-соединений (combined streams Binance). Закрытая свеча сразу попадает в кэш свечей
+# (и на диск), каждое обновление держит ряд «свежим» — автоцикл и команды берут данные из кэша без REST.
+# Пропуски (обрыв соединения, пропавшие бары) досинхронизируются обычным REST-запросом хвоста.
+# На диск закрытые бары пишутся пачками в тредпуле, чтобы всплеск закрытий не стопорил event loop.
+# Если поток замолчал дольше CANDLE_CACHE_FRESH_SECONDS, кэш сам вернётся к REST.
+
+DEFAULT_STREAM_URLS = {
+    "binance": "wss://stream.binance.com:9443/stream",
+    "binanceus": "wss://stream.binance.us:9443/stream",
+}
+
+
+def stream_name(market_id: str, timeframe: str) -> str:
+    return f"{market_id.lower()}@kline_{timeframe}"
+
+
+@dataclass(eq=False)
+class _Shard:
+    """Одно WebSocket-соединение и его набор стримов."""
+    names: Set[str]
+    task: Optional[asyncio.Task] = None
+
+
+class KlineStreamer:
+    def __init__(
+        self,
+        ex: ExchangeClient | AsyncExchangeClient,
+        url: Optional[str] = None,
+        max_streams_per_conn: int = 200,
+        resync_limit: int = 300,
+        resync_concurrency: int = 8,
+    ):
+        self.ex = ex
+        self.url = url or DEFAULT_STREAM_URLS.get(ex.exchange_id)
+        self.max_streams_per_conn = max(1, max_streams_per_conn)
+        self.resync_limit = resync_limit
+        self._resync_sem = asyncio.Semaphore(max(1, resync_concurrency))
+        self._targets: Dict[str, Tuple[str, str]] = {}  # имя стрима -> (пара, TF)
+        self._shards: List[_Shard] = []
+        self._bg: set = set()
+        self._pending: Dict[tuple, List[list]] = {}  # закрытые бары, ждущие записи на диск
+        self._flusher: Optional[asyncio.Task] = None
+        self.messages = 0
+        self.closed_bars = 0
+        self.gaps = 0
+        self.reconnects = 0
+        self.resubscribes = 0
+
+    @property
+    def supported(self) -> bool:
+        return bool(self.url)
+
+    def _market_id(self, symbol: str) -> str:
+        try:
+            return self.ex.ex.market(symbol)["id"]
+        except Exception:
+            return symbol.replace("/", "")
+
+    def set_targets(self, symbols: Iterable[str], timeframes: Iterable[str]) -> None:
+        """
+        Что слушать. Переподключаются только соединения, чей набор стримов изменился:
+        ушедшие стримы вынимаются из своих шардов, новые добавляются в шарды со свободным местом
+        (сначала в те, что и так переподключаются), остаток — в новые соединения.
+        """
+        targets = {
+            stream_name(self._market_id(s), tf): (s, tf)
+            for s in symbols for tf in timeframes
+        }
+        if targets == self._targets and self._shards:
+            return
+        self._targets = targets
+        cap = self.max_streams_per_conn
+        changed: List[_Shard] = []
+        for shard in self._shards:
+            kept = {n for n in shard.names if n in targets}
+            if kept != shard.names:
+                shard.names = kept
+                changed.append(shard)
+        placed = set().union(*(sh.names for sh in self._shards))
+        added = sorted(n for n in targets if n not in placed)
+        candidates = changed + [sh for sh in self._shards if sh not in changed]
+        for shard in candidates:
+            if not added:
+                break
+            room = cap - len(shard.names)
+            if room > 0:
+                shard.names.update(added[:room])
+                del added[:room]
+                if shard not in changed:
+                    changed.append(shard)
+        for i in range(0, len(added), cap):
+            shard = _Shard(set(added[i:i + cap]))
+            self._shards.append(shard)
+            changed.append(shard)
+        for shard in changed:
+            self._resubscribe(shard)
+        self._shards = [sh for sh in self._shards if sh.names]
+        log.info("kline streams: %d streams over %d connections (%d resubscribed)",
+                 len(targets), len(self._shards), len(changed))
+
+    def _resubscribe(self, shard: _Shard) -> None:
+        if shard.task is not None:
+            shard.task.cancel()
+            self.resubscribes += 1
+        shard.task = asyncio.create_task(self._connection(sorted(shard.names))) if shard.names else None
+
+    async def close(self) -> None:
+        tasks = [sh.task for sh in self._shards if sh.task is not None] + list(self._bg)
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
+            try:
+                await t
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._shards = []
+        # закрытые бары, что ещё не на диске, дописываем
+        if self._flusher is not None:
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            await run_sync(self._write_batch, batch)
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._targets),
+            "connections": len(self._shards),
+            "messages": self.messages,
+            "closed_bars": self.closed_bars,
+            "gaps": self.gaps,
+            "reconnects": self.reconnects,
+            "resubscribes": self.resubscribes,
+        }
+
+    # ---------- соединение ----------
+    async def _connection(self, names: List[str]) -> None:
+        url = f"{self.url}?streams={'/'.join(names)}"
+        delay = 1.0
+        while True:
+            try:
+                async with _shared_http_session().ws_connect(url, heartbeat=30) as ws:
+                    delay = 1.0
+                    # пока нас не было, бары могли закрыться — добираем их через REST
+                    self._spawn(self._resync_many(names))
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._on_message(msg.data)
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("kline stream connection error: %s", e)
+            self.reconnects += 1
+            await asyncio.sleep(delay + random.random())
+            delay = min(delay * 2, 60.0)
+
+    def _on_message(self, raw: str) -> None:
+        try:
+            payload = json.loads(raw)
+            target = self._targets.get(payload.get("stream", ""))
+            k = payload["data"]["k"]
+        except Exception:
+            return
+        if target is None:
+            return
+        self.messages += 1
+        symbol, tf = target
+        key = (self.ex.exchange_id, symbol, tf)
+        cache = self.ex.cache
+        if not k.get("x"):
+            # формирующаяся свеча: если кэш заканчивается закрытой свечой, он актуален и REST не нужен.
+            # Если в кэше ещё висит формирующийся бар из REST, свежесть не продлеваем — его обновит REST.
+            have = cache.get(key)
+            if have is not None and len(have) and have[-1, 0] + timeframe_ms(tf) <= float(k["t"]):
+                cache.touch(key)
+            return
+        row = [float(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"])]
+        have = cache.get(key)
+        if have is None or len(have) == 0 or have[-1, 0] < row[0] - timeframe_ms(tf):
+            # истории нет или между кэшем и этой свечой дыра — сначала REST, свеча придёт вместе с хвостом
+            self.gaps += 1
+            self._spawn(self._resync(symbol, tf))
+            return
+        cache.put_bar(key, row)
+        self._queue_persist(key, row)
+        self.closed_bars += 1
+
+    # ---------- запись на диск ----------
+    def _queue_persist(self, key: tuple, row: list) -> None:
+        if getattr(self.ex, "store", None) is None:
+            return
+        self._pending.setdefault(key, []).append(row)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        # пока пишется одна пачка, следующая копится в _pending
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await run_sync(self._write_batch, batch)
+            except Exception as e:
+                log.warning("kline persist failed: %s", e)
+
+    def _write_batch(self, batch: Dict[tuple, List[list]]) -> None:
+        for key, rows in batch.items():
+            self.ex.persist(key, rows)
+
+    # ---------- REST-досинхронизация ----------
+    def _spawn(self, coro) -> None:
+        t = asyncio.create_task(coro)
+        self._bg.add(t)
+        t.add_done_callback(self._bg.discard)
+
+    async def _resync(self, symbol: str, tf: str) -> None:
+        key = (self.ex.exchange_id, symbol, tf)
+        async with self._resync_sem:
+            self.ex.cache.expire(key)
+            try:
+                await fetch_candles(self.ex, symbol, tf, self.resync_limit)
+            except Exception as e:
+                log.warning("kline resync %s %s failed: %s", symbol, tf, e)
+
+    async def _resync_many(self, names: List[str]) -> None:
+        await asyncio.gather(*[
+            self._resync(*self._targets[n]) for n in names if n in self._targets
+        ])
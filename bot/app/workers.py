@@ -0,0 +1,268 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing as mp
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from .config import Settings
+
+log = logging.getLogger("workers")
+
+# Режим воркеров: свечи и индикаторы считаются в N отдельных процессах (мимо GIL основного),
+# решение LLM, БД и Telegram остаются в процессе бота. Пары раскладываются по воркерам
+# консистентным хэшированием: пара всегда приходит в один и тот же воркер (его кэш свечей и
+# состояние индикаторов остаются тёплыми), а смена числа воркеров двигает лишь ~1/N пар.
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[int] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self._keys: List[int] = []
+        self._nodes: List[int] = []
+        for n in nodes:
+            self.add(n)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def add(self, node: int) -> None:
+        for v in range(self.vnodes):
+            h = self._hash(f"{node}#{v}")
+            i = bisect.bisect(self._keys, h)
+            self._keys.insert(i, h)
+            self._nodes.insert(i, node)
+
+    def remove(self, node: int) -> None:
+        keep = [(k, n) for k, n in zip(self._keys, self._nodes) if n != node]
+        self._keys = [k for k, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def node_for(self, key: str) -> Optional[int]:
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[i]
+
+
+# ----------------- процесс-воркер -----------------
+
+def _worker_main(worker_id: int, settings: Settings, requests: mp.Queue, results: mp.Queue) -> None:
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s %(levelname)s worker{worker_id} %(name)s: %(message)s")
+    try:
+        asyncio.run(_worker_loop(worker_id, settings, requests, results))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_loop(worker_id: int, settings: Settings, requests: mp.Queue, results: mp.Queue) -> None:
+    from .exchange import AsyncExchangeClient, ExchangeClient, close_http_session
+    from .snapshots import fetch_triple, indicator_book, snapshots_from_candles
+
+    if settings.exchange_async:
+        ex = AsyncExchangeClient(settings.exchange_id, state_dir=settings.state_dir)
+    else:
+        ex = ExchangeClient(settings.exchange_id, state_dir=settings.state_dir)
+    min_len = max(settings.ma_window, settings.macd_slow) + 5
+    sem = asyncio.Semaphore(max(1, settings.pipeline_fetch_concurrency))
+    loop = asyncio.get_running_loop()
+    inbox: asyncio.Queue = asyncio.Queue()
+    owned: set = set()
+
+    def reader():
+        # mp.Queue.get блокирующий — читаем в отдельном треде и перекладываем в loop
+        while True:
+            msg = requests.get()
+            loop.call_soon_threadsafe(inbox.put_nowait, msg)
+            if msg[0] == "stop":
+                return
+
+    threading.Thread(target=reader, name=f"worker{worker_id}-reader", daemon=True).start()
+
+    async def handle(req_id: int, symbol: str, closed_by_ms: Optional[int]) -> None:
+        try:
+            async with sem:
+                candles = await fetch_triple(
+                    ex, symbol, settings.triple_timeframes, min_len, derive=settings.derive_timeframes,
+                    closed_by_ms=closed_by_ms,
+                )
+            snaps = None
+            if candles is not None:
+                # в воркере индикаторы считаются прямо в его потоке: процесс свой, GIL свой
+                snaps = snapshots_from_candles(
+                    ex.exchange_id, symbol, candles,
+                    settings.ma_window, settings.macd_fast, settings.macd_slow, settings.macd_signal,
+                )
+            results.put((worker_id, req_id, True, snaps))
+        except Exception as e:
+            log.exception("worker %d: %s failed: %s", worker_id, symbol, e)
+            results.put((worker_id, req_id, False, f"{type(e).__name__}: {e}"))
+
+    tasks: set = set()
+    try:
+        while True:
+            msg = await inbox.get()
+            kind = msg[0]
+            if kind == "stop":
+                break
+            if kind == "snap":
+                _, req_id, symbol, closed_by_ms = msg
+                owned.add(symbol)
+                t = asyncio.create_task(handle(req_id, symbol, closed_by_ms))
+                tasks.add(t)
+                t.add_done_callback(tasks.discard)
+            elif kind == "retain":
+                # пары ушли к другим воркерам — освобождаем их состояние
+                keep = set(msg[1])
+                for symbol in owned - keep:
+                    for tf in settings.triple_timeframes:
+                        indicator_book.drop((ex.exchange_id, symbol, tf))
+                        ex.cache.drop((ex.exchange_id, symbol, tf))
+                owned &= keep
+    finally:
+        for t in tasks:
+            t.cancel()
+        if isinstance(ex, AsyncExchangeClient):
+            await ex.close()
+            await close_http_session()
+
+
+# ----------------- сторона бота -----------------
+
+class WorkerPool:
+    """
+    N процессов-воркеров. snapshots(symbol) — снапшоты трёх экранов от воркера, которому принадлежит пара
+    (None — не хватило данных). Упавший воркер перезапускается сторожем независимо от остальных;
+    его запросы в полёте завершаются ошибкой (пара повторится на следующем пробуждении автоцикла).
+    """
+
+    def __init__(self, settings: Settings, processes: int, restart_delay: float = 2.0):
+        self.settings = settings
+        self.n = max(1, processes)
+        self.restart_delay = restart_delay
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._procs: Dict[int, Any] = {}
+        self._requests: Dict[int, Any] = {}
+        self._ring = HashRing()
+        self._pending: Dict[int, tuple[int, asyncio.Future]] = {}
+        self._ids = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader: Optional[threading.Thread] = None
+        self._watchdog: Optional[asyncio.Task] = None
+        self._closing = False
+        self.restarts = 0
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        for wid in range(self.n):
+            self._spawn(wid)
+        self._reader = threading.Thread(target=self._read_results, name="workers-results", daemon=True)
+        self._reader.start()
+        self._watchdog = asyncio.create_task(self._watch())
+
+    def _spawn(self, wid: int) -> None:
+        requests = self._ctx.Queue()
+        proc = self._ctx.Process(
+            target=_worker_main, args=(wid, self.settings, requests, self._results),
+            name=f"signal-worker-{wid}", daemon=True,
+        )
+        proc.start()
+        self._procs[wid] = proc
+        self._requests[wid] = requests
+        self._ring.add(wid)
+        log.info("worker %d started (pid %s)", wid, proc.pid)
+
+    def owner(self, symbol: str) -> Optional[int]:
+        return self._ring.node_for(symbol)
+
+    def assignment(self, symbols: Iterable[str]) -> Dict[int, List[str]]:
+        out: Dict[int, List[str]] = {}
+        for s in symbols:
+            wid = self.owner(s)
+            if wid is not None:
+                out.setdefault(wid, []).append(s)
+        return out
+
+    def rebalance(self, symbols: Iterable[str]) -> None:
+        """Сообщить воркерам актуальный список их пар: чужие и удалённые пары они забывают."""
+        plan = self.assignment(symbols)
+        for wid, q in self._requests.items():
+            if self._procs[wid].is_alive():
+                q.put(("retain", plan.get(wid, [])))
+
+    async def snapshots(self, symbol: str, closed_by_ms: Optional[int] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+        wid = self.owner(symbol)
+        if wid is None:
+            raise RuntimeError("no live workers")
+        req_id = next(self._ids)
+        fut = self._loop.create_future()
+        self._pending[req_id] = (wid, fut)
+        self._requests[wid].put(("snap", req_id, symbol, closed_by_ms))
+        try:
+            return await fut
+        finally:
+            self._pending.pop(req_id, None)
+
+    def _read_results(self) -> None:
+        while True:
+            try:
+                msg = self._results.get()
+            except (EOFError, OSError):
+                return
+            if msg is None:
+                return
+            self._loop.call_soon_threadsafe(self._resolve, msg)
+
+    def _resolve(self, msg) -> None:
+        _, req_id, ok, payload = msg
+        item = self._pending.get(req_id)
+        if item is None or item[1].done():
+            return
+        if ok:
+            item[1].set_result(payload)
+        else:
+            item[1].set_exception(RuntimeError(payload))
+
+    async def _watch(self) -> None:
+        while not self._closing:
+            await asyncio.sleep(self.restart_delay)
+            for wid, proc in list(self._procs.items()):
+                if proc.is_alive():
+                    continue
+                log.warning("worker %d died (exit %s), restarting", wid, proc.exitcode)
+                self._ring.remove(wid)
+                for req_id, (owner, fut) in list(self._pending.items()):
+                    if owner == wid and not fut.done():
+                        fut.set_exception(RuntimeError(f"worker {wid} died"))
+                self._spawn(wid)
+                self.restarts += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.n,
+            "alive": sum(1 for p in self._procs.values() if p.is_alive()),
+            "in_flight": len(self._pending),
+            "restarts": self.restarts,
+        }
+
+    async def close(self, timeout: float = 5.0) -> None:
+        self._closing = True
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        for q in self._requests.values():
+            try:
+                q.put(("stop",))
+            except Exception:
+                pass
+        for proc in self._procs.values():
+            await asyncio.to_thread(proc.join, timeout)
+            if proc.is_alive():
+                proc.terminate()
+        self._results.put(None)
+        for _, fut in self._pending.values():
+            if not fut.done():
+                fut.cancel()
@@ -0,0 +1,174 @@
+"""
+Офлайн-бенчмарк цикла бота: синтетические свечи + локальный фейковый OpenAI-сервер.
+
+    cd bot
+    python -m bench                                   # 10/100/1000 пар, автоцикл и /checkall
+    python -m bench --pairs 100 --modes cycle --llm-latency 0.5 --out bench.json
+    python -m bench --compare old.json new.json       # сравнение двух прогонов (разных коммитов)
+    python -m bench --replay rec.bin --speed 20       # свечи и решения LLM из записи бота (RECORD_PATH)
+
+Каждый сценарий — отдельный процесс (чистый кэш свечей/решений и честный пиковый RSS).
+Настройки бота (LLM_BATCH_SIZE, PIPELINE_*, PREFILTER, DERIVE_HTF, ...) берутся из окружения.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from app.recorder import Replay
+
+from .fake_llm import FakeLLMServer
+from .scenario import MODES
+from .synthetic import symbol_names
+
+# Значения по умолчанию для дочернего процесса; явно заданные в окружении не перетираются
+_CHILD_DEFAULTS = {
+    "TELEGRAM_BOT_TOKEN": "0:bench",
+    "TELEGRAM_CHANNEL_ID": "-1000000000000",
+    "OPENAI_API_KEY": "bench",
+    # новые режимы в боте включаются явно — бенчмарк меряет их
+    "EXCHANGE_ASYNC": "1",
+    "PREFILTER": "1",
+    "DERIVE_HTF": "1",
+    "LLM_CACHE_PERSIST": "0",
+    # бенчмарк меряет пакетный путь (в боте он включается явно)
+    "LLM_BATCH_SIZE": "8",
+    # свечи не считаются «свежими» между циклами — второй цикл честно докачивает хвост
+    "CANDLE_CACHE_FRESH_SECONDS": "0",
+}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def _run_child(mode: str, symbols: List[str], args, llm_url: str) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="bench-state-") as state_dir:
+        env = dict(os.environ)
+        for k, v in _CHILD_DEFAULTS.items():
+            env.setdefault(k, v)
+        env.update({
+            "OPENAI_BASE_URL": llm_url,
+            "BOT_STATE_DIR": state_dir,
+            "SYMBOLS": ",".join(symbols),
+        })
+        extra = ["--replay", args.replay, "--speed", str(args.speed)] if args.replay else []
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "bench", "--child", mode,
+            "--cycles", str(args.cycles), "--exchange-latency", str(args.exchange_latency), *extra,
+            env=env, stdout=asyncio.subprocess.PIPE,
+        )
+        out, _ = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"scenario {mode}/{len(symbols)} failed with exit code {proc.returncode}")
+        return json.loads(out.decode().strip().splitlines()[-1])
+
+
+async def _drive(args) -> Dict[str, Any]:
+    server = FakeLLMServer(latency=args.llm_latency, jitter=args.llm_jitter)
+    await server.start()
+    # с записью — один набор пар, тот, что в ней есть
+    symbol_sets = [Replay(args.replay).symbols] if args.replay else [symbol_names(n) for n in args.pairs]
+    scenarios: List[Dict[str, Any]] = []
+    try:
+        for symbols in symbol_sets:
+            for mode in args.modes:
+                pairs = len(symbols)
+                t0 = time.perf_counter()
+                res = await _run_child(mode, symbols, args, server.base_url)
+                scenarios.append(res)
+                last = res["cycles"][-1]
+                print(
+                    f"{mode:>8} {pairs:>5} pairs: {last['pairs_per_sec']:>8} pairs/s (last cycle), "
+                    f"peak RSS {res['peak_rss_mb']} MB, {time.perf_counter() - t0:.1f}s",
+                    file=sys.stderr,
+                )
+    finally:
+        await server.close()
+    return {
+        "commit": _git_commit(),
+        "created_utc": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "cycles": args.cycles,
+            "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter,
+            "exchange_latency": args.exchange_latency,
+            "replay": args.replay,
+            "speed": args.speed if args.replay else None,
+        },
+        "llm_server": {"requests": server.requests, "symbols": server.symbols},
+        "scenarios": scenarios,
+    }
+
+
+def _compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    base = {(s["mode"], s["pairs"]): s for s in old["scenarios"]}
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for s in new["scenarios"]:
+        o = base.get((s["mode"], s["pairs"]))
+        if o is None:
+            continue
+        for oc, nc in zip(o["cycles"], s["cycles"]):
+            ratio = (nc["pairs_per_sec"] or 0) / (oc["pairs_per_sec"] or 1)
+            print(f"{s['mode']:>8} {s['pairs']:>5} pairs, cycle {nc['cycle']}: "
+                  f"{oc['pairs_per_sec']} -> {nc['pairs_per_sec']} pairs/s ({ratio:.2f}x)")
+            for stage, st in nc["stages"].items():
+                ost = oc["stages"].get(stage)
+                if ost and ost.get("n") and st.get("n"):
+                    print(f"{'':>16}{stage:>11} p95 {ost['p95_ms']:.2f} -> {st['p95_ms']:.2f} ms")
+        print(f"{'':>16}peak RSS {o['peak_rss_mb']} -> {s['peak_rss_mb']} MB")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(prog="python -m bench", description="Офлайн-бенчмарк цикла бота")
+    p.add_argument("--pairs", type=int, nargs="+", default=[10, 100, 1000])
+    p.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    p.add_argument("--cycles", type=int, default=2, help="циклов подряд: первый холодный, дальше — хвосты свечей")
+    p.add_argument("--llm-latency", type=float, default=0.3)
+    p.add_argument("--llm-jitter", type=float, default=0.1)
+    p.add_argument("--exchange-latency", type=float, default=0.02)
+    p.add_argument("--replay", help="файл записи RECORD_PATH: свечи и решения LLM вместо синтетики")
+    p.add_argument("--speed", type=float, default=1.0,
+                   help="ускорение записанных задержек ответов биржи/LLM (0 — без задержек); воспроизводится "
+                        "только время обслуживания вызовов, моменты запросов из записи не повторяются")
+    p.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    p.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    p.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.compare:
+        _compare(*args.compare)
+        return
+    if args.child:
+        from .scenario import run
+        # в stdout — только результат, логи бота уходят в stderr
+        print(json.dumps(run(args.child, args.cycles, args.exchange_latency, args.replay, args.speed)))
+        return
+
+    result = asyncio.run(_drive(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from aiohttp import web
+
+# Локальный OpenAI-совместимый сервер (POST /v1/chat/completions) для бенчмарка:
+# отвечает валидным JSON решения (одиночным или {"decisions": [...]} для пакета) с задержкой
+# latency ± jitter. Решение детерминировано по тикеру: каждая четвёртая пара — BUY.
+# script — сценарий сбоев для тестов: каждый запрос забирает очередной шаг
+# ({"status": 503}, {"status": 429, "retry_after": 0.2}, {"delay": 2.0}); пустой — обычный ответ.
+
+_SYMBOL_RE = re.compile(r"^\[([^\]\s]+)\]", re.MULTILINE)
+# одиночный промпт (_render_user_prompt) блоков [SYMBOL] не содержит — тикер берём из текста
+_SINGLE_RE = re.compile(r"^Symbol:\s*(\S+)|Проанализируй (\S+) по", re.MULTILINE)
+
+
+def _single_symbol(prompt: str) -> str:
+    m = _SINGLE_RE.search(prompt)
+    return (m.group(1) or m.group(2)) if m else "?"
+
+
+def _decision(symbol: str) -> Dict[str, Any]:
+    h = zlib.crc32(symbol.encode())
+    buy = h % 4 == 0
+    return {
+        "symbol": symbol,
+        "buy_signal": buy,
+        "confidence": round(0.55 + (h % 40) / 100, 2) if buy else round((h % 50) / 100, 2),
+        "reason": f"synthetic decision for {symbol}",
+    }
+
+
+class FakeLLMServer:
+    def __init__(self, latency: float = 0.3, jitter: float = 0.1, host: str = "127.0.0.1", port: int = 0,
+                 seed: int = 42):
+        self.latency = latency
+        self.jitter = jitter
+        self.host = host
+        self.port = port
+        self._rng = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.requests = 0
+        self.symbols = 0
+        self.script: Deque[Dict[str, Any]] = deque()
+        self.inflight = 0
+        self.max_inflight = 0
+        self.cancelled = 0
+        self.prompts: Deque[str] = deque(maxlen=256)  # последние промпты — для тестов
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self._completions)
+        # клиент оборвал соединение (отменённый хедж) — обработчик тоже отменяется
+        self._runner = web.AppRunner(app, access_log=None, handler_cancellation=True)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # порт 0 — берём тот, что выдала ОС
+        self.port = self._runner.addresses[0][1]
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _completions(self, request: web.Request) -> web.Response:
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            return await self._respond(request)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.inflight -= 1
+
+    async def _respond(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.requests += 1
+        step = self.script.popleft() if self.script else {}
+        if step.get("status"):
+            headers = {"retry-after": str(step["retry_after"])} if "retry_after" in step else None
+            await asyncio.sleep(step.get("delay", 0.0))
+            return web.json_response(
+                {"error": {"message": "scripted failure", "type": "server_error", "code": step["status"]}},
+                status=step["status"], headers=headers,
+            )
+        prompt = "\n".join(
+            m.get("content", "") for m in body.get("messages", []) if isinstance(m.get("content"), str)
+        )
+        self.prompts.append(prompt)
+        symbols: List[str] = _SYMBOL_RE.findall(prompt)
+        if '"decisions"' in prompt and symbols:
+            content = {"decisions": [_decision(s) for s in symbols]}
+            self.symbols += len(symbols)
+        else:
+            content = _decision(symbols[0] if symbols else _single_symbol(prompt))
+            self.symbols += 1
+
+        delay = step.get("delay", max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+        await asyncio.sleep(delay)
+        text = json.dumps(content, ensure_ascii=False)
+        return web.json_response({
+            "id": f"chatcmpl-bench-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(text) // 4,
+                "total_tokens": (len(prompt) + len(text)) // 4,
+            },
+        })
@@ -0,0 +1,171 @@
+import asyncio
+import resource
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app import main as bot_main
+from app.analyzer import LLMAnalyzer
+from app.config import load_settings
+from app.decision_cache import DECISION_CACHE
+from app.exchange import AsyncExchangeClient, close_http_session, timeframe_ms
+from app.outbox import Outbox
+from app.pipeline import add_stage_observer, remove_stage_observer
+from app.prefilter import gate_stats
+from app.recorder import install_replay
+from app.storage import Storage
+
+from .synthetic import SyntheticExchange
+
+# Один сценарий бенчмарка в текущем процессе: настоящие run_cycle (тело periodic_task) или cmd_checkall,
+# биржа — синтетическая, LLM — фейковый сервер по OPENAI_BASE_URL, Telegram — заглушка без сети.
+# Настройки берутся из окружения, как у бота (их выставляет драйвер в __main__).
+
+MODES = ("cycle", "checkall")
+
+
+class _NullBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+class _Message:
+    """Минимум от aiogram Message, который трогает /checkall."""
+
+    def __init__(self, text: str, chat_id: int = 1):
+        self.text = text
+        self.chat = SimpleNamespace(id=chat_id)
+        self.answers = 0
+
+    async def answer(self, text: str, **kwargs):
+        self.answers += 1
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"n": 0}
+    arr = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {
+        "n": len(samples),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(arr.max()), 3),
+        "total_s": round(float(arr.sum()) / 1000.0, 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в Linux — в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+async def run_scenario(mode: str, cycles: int, exchange_latency: float,
+                       replay_path: Optional[str] = None, speed: float = 1.0) -> Dict[str, Any]:
+    """replay_path — вместо синтетики свечи и решения LLM из записи (RECORD_PATH), задержки / speed."""
+    settings = load_settings()
+    symbols = list(settings.symbols)
+
+    storage = Storage(state_dir=settings.state_dir)
+    if settings.llm_cache_persist:
+        DECISION_CACHE.attach_storage(storage)
+        await DECISION_CACHE.warm()
+    ex = AsyncExchangeClient(settings.exchange_id, state_dir=settings.state_dir)
+    await ex.ex.close()  # настоящий ccxt-объект не нужен: сеть ему не даём
+    if replay_path:
+        _, llm = install_replay(ex, replay_path, speed)
+        fake = ex.ex
+    else:
+        fake = ex.ex = SyntheticExchange(symbols, latency=exchange_latency)
+        # advance() двигает часы биржи — клиент должен планировать докачку хвоста по ним же
+        ex.clock = fake.clock
+        llm = LLMAnalyzer(settings.openai_api_key, settings.openai_model)
+    bot = _NullBot()
+    outbox = Outbox(bot, global_rate=settings.outbox_global_rate, chat_rate=settings.outbox_chat_rate,
+                    group_per_minute=settings.outbox_group_per_minute)
+    outbox.start()
+
+    stages: Dict[str, List[float]] = defaultdict(list)
+
+    def observe(stage: str, seconds: float) -> None:
+        stages[stage].append(seconds)
+
+    # запись в БД вызывается из обработчиков напрямую — оборачиваем методы этого экземпляра
+    def timed(name: str, fn):
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stages[name].append(time.perf_counter() - t0)
+        return wrapper
+
+    storage.insert_signal = timed("storage", storage.insert_signal)
+    storage.flush = timed("flush", storage.flush)
+
+    base_tf_ms = min(timeframe_ms(tf) for tf in settings.triple_timeframes)
+    results = []
+    add_stage_observer(observe)
+    try:
+        for n in range(cycles):
+            if n and not replay_path:
+                # следующий цикл — как после закрытия очередной свечи младшего TF
+                fake.advance(base_tf_ms)
+            stages.clear()
+            requests_before = fake.requests
+            full_before = ex.cache.full_fetches  # полные выгрузки истории (в т.ч. постраничные)
+            gate_before = gate_stats.as_dict()
+            t0 = time.perf_counter()
+            if mode == "cycle":
+                batch = await bot_main._cycle_symbols(settings, storage)
+                processed = len(await bot_main.run_cycle(settings, outbox, storage, ex, llm, batch))
+            else:
+                msg = _Message("/checkall")
+                await bot_main.cmd_checkall(msg, settings, storage, ex, llm, outbox)
+                processed = len(symbols)
+            elapsed = time.perf_counter() - t0
+            full_loads = ex.cache.full_fetches - full_before
+            if n and not replay_path and full_loads:
+                # тёплый цикл обязан обходиться докачкой хвоста — иначе меряем путь, которого нет в проде
+                raise AssertionError(f"warm cycle {n + 1}: {full_loads} full history loads")
+            gate_after = gate_stats.as_dict()
+            results.append({
+                "cycle": n + 1,
+                "seconds": round(elapsed, 4),
+                "pairs_per_sec": round(processed / elapsed, 2) if elapsed else None,
+                "processed": processed,
+                "exchange_requests": fake.requests - requests_before,
+                "full_history_loads": full_loads,
+                "escalated_to_llm": gate_after.get("escalated", 0) - gate_before.get("escalated", 0),
+                "stages": {name: percentiles(v) for name, v in sorted(stages.items())},
+            })
+    finally:
+        remove_stage_observer(observe)
+        queued = outbox.sent + outbox.pending()
+        await outbox.close(timeout=0)
+        await llm.aclose()
+        await ex.close()
+        await close_http_session()
+        storage.close()
+
+    return {
+        "mode": mode,
+        "pairs": len(symbols),
+        "cycles": results,
+        "llm_cache": DECISION_CACHE.stats(),
+        "llm": llm.latency_stats(),
+        "telegram_queued": queued,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run(mode: str, cycles: int, exchange_latency: float,
+        replay_path: Optional[str] = None, speed: float = 1.0) -> Dict[str, Any]:
+    return asyncio.run(run_scenario(mode, cycles, exchange_latency, replay_path, speed))
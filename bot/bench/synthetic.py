@@ -0,0 +1,102 @@
+import asyncio
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.exchange import timeframe_ms
+
+# Детерминированные свечи: ряд пары/TF зависит только от (пара, TF) и якорного времени,
+# так что прогоны на разных коммитах видят одни и те же данные и одни и те же решения гейта.
+
+HISTORY_BARS = 3200   # хватает на всю глубину кэша младшего TF при derive (1w из 4h) и на 300 старших баров
+FUTURE_BARS = 64      # запас свечей «в будущее» для advance() между циклами
+
+
+def symbol_names(n: int, quote: str = "USDT") -> List[str]:
+    return [f"S{i:04d}/{quote}" for i in range(n)]
+
+
+def _seed(symbol: str, timeframe: str) -> int:
+    return zlib.crc32(f"{symbol}|{timeframe}".encode())
+
+
+def synthetic_ohlcv(symbol: str, timeframe: str, start_ms: int, bars: int) -> np.ndarray:
+    """
+    Массив (bars, 6) [ts, o, h, l, c, v], первая свеча — в start_ms (выровнено по TF).
+    Геометрическое блуждание с трендом: у трети пар рост, у трети падение, остальные — боковик.
+    """
+    tf = timeframe_ms(timeframe)
+    first = start_ms - start_ms % tf
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    # направление тренда общее для всех TF пары — иначе старший и младший экраны «спорили» бы случайно
+    drift = (int(rng.integers(0, 3)) - 1) * 3.0 / bars
+    vol = float(rng.uniform(0.01, 0.04)) * (tf / 86_400_000) ** 0.5
+    base = float(rng.uniform(0.5, 50_000))
+
+    rng = np.random.default_rng(_seed(symbol, timeframe))
+    rets = drift + vol * rng.standard_normal(bars)
+    close = base * np.exp(np.cumsum(rets))
+    open_ = np.concatenate(([base], close[:-1]))
+    spread = np.abs(rng.standard_normal(bars)) * vol * close * 0.5
+    high = np.maximum(open_, close) + spread
+    low = np.maximum(np.minimum(open_, close) - spread, close * 1e-3)
+    volume = rng.lognormal(10.0, 0.5, bars)
+    ts = first + tf * np.arange(bars, dtype=np.float64)
+    return np.column_stack((ts, open_, high, low, close, volume))
+
+
+class SyntheticExchange:
+    """
+    Подменяет объект ccxt.async_support внутри AsyncExchangeClient (client.ex): тот же fetch_ohlcv,
+    но свечи синтетические и отвечает с заданной задержкой «сети».
+    """
+
+    def __init__(self, symbols: List[str], latency: float = 0.0, anchor_ms: Optional[int] = None):
+        self.id = "synthetic"
+        self.latency = latency
+        # ряды привязаны к якорю, «текущее время» биржи — now_ms; advance() открывает следующие свечи
+        self.anchor_ms = anchor_ms if anchor_ms is not None else int(time.time() * 1000)
+        self.now_ms = self.anchor_ms
+        self.markets: Dict[str, Dict[str, Any]] = {
+            s: {"id": s.replace("/", ""), "symbol": s, "spot": True, "active": True} for s in symbols
+        }
+        self.requests = 0
+
+    def clock(self) -> float:
+        """Часы биржи в секундах — для client.clock, чтобы клиент планировал хвост по ним, а не по стенным."""
+        return self.now_ms / 1000.0
+
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since: Optional[int] = None,
+                          limit: Optional[int] = None, params: Optional[dict] = None) -> list:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        tf = timeframe_ms(timeframe)
+        arr = synthetic_ohlcv(symbol, timeframe, self.anchor_ms - HISTORY_BARS * tf, HISTORY_BARS + FUTURE_BARS)
+        arr = arr[arr[:, 0] <= self.now_ms]
+        if since is not None:
+            arr = arr[arr[:, 0] >= since]
+            if limit:
+                arr = arr[:limit]
+        elif limit:
+            arr = arr[-limit:]
+        # ccxt отдаёт списки — конвертация входит в честную стоимость стадии
+        return arr.tolist()
+
+    def advance(self, ms: int) -> None:
+        """Сдвинуть часы биржи (новые закрытые свечи для следующего цикла)."""
+        self.now_ms += ms
+
+    async def load_markets(self, reload: bool = False) -> Dict[str, Dict[str, Any]]:
+        return self.markets
+
+    def market(self, symbol: str) -> Dict[str, Any]:
+        return self.markets[symbol]
+
+    async def fetch_tickers(self, symbols=None, params=None) -> Dict[str, Dict[str, Any]]:
+        return {}
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,14 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# тесты запускаются из bot/: python -m pytest tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def run():
+    """run(coro) — выполнить корутину в новом event loop (без pytest-asyncio)."""
+    return asyncio.run
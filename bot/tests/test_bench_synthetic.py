@@ -0,0 +1,77 @@
+import asyncio
+import fcntl
+import os
+import threading
+
+from app.exchange import AsyncExchangeClient, CandleCache, close_http_session, timeframe_ms
+from bench.synthetic import SyntheticExchange
+
+
+def test_warm_cycle_fetches_only_tail_on_synthetic_clock(run):
+    async def scenario():
+        ex = AsyncExchangeClient("binance", cache=CandleCache(fresh_seconds=0))
+        await ex.ex.close()
+        fake = ex.ex = SyntheticExchange(["AAA/USDT"])
+        ex.clock = fake.clock
+        calls = []
+        inner = fake.fetch_ohlcv
+
+        async def traced(symbol, timeframe="1m", since=None, limit=None, params=None):
+            rows = await inner(symbol, timeframe, since, limit, params)
+            calls.append((timeframe, since is None, limit, len(rows)))
+            return rows
+
+        fake.fetch_ohlcv = traced
+        try:
+            for tf in ("4h", "1d", "1w"):
+                await ex.fetch_candles("AAA/USDT", tf, 300)
+            cold = list(calls)
+            calls.clear()
+            # часы биржи ушли на бар младшего TF вперёд (в т.ч. далеко от стенных часов)
+            fake.advance(timeframe_ms("4h") * 5)
+            for tf in ("4h", "1d", "1w"):
+                arr = await ex.fetch_candles("AAA/USDT", tf, 300)
+                assert arr[-1, 0] <= fake.now_ms
+        finally:
+            await ex.close()
+            await close_http_session()
+        return cold, calls
+
+    cold, warm = run(scenario())
+    assert all(full for _, full, _, _ in cold)
+    assert warm and not any(full for _, full, _, _ in warm), warm
+    assert warm[0][0] == "4h" and warm[0][3] == 6  # бар, бывший формирующимся, + 5 новых
+
+
+def test_async_persist_does_not_block_loop_on_locked_series(run, tmp_path):
+    async def scenario():
+        ex = AsyncExchangeClient("binance", cache=CandleCache(fresh_seconds=0), state_dir=str(tmp_path))
+        await ex.ex.close()
+        ex.ex = SyntheticExchange(["AAA/USDT"])
+        path = ex.store.path("binance", "AAA/USDT", "4h")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # серию держит «другой процесс»: отдельный flock на тот же lock-файл
+        lock = open(path + ".lock", "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        threading.Timer(0.3, lambda: fcntl.flock(lock, fcntl.LOCK_UN)).start()
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        hb = asyncio.create_task(heartbeat())
+        try:
+            arr = await ex.fetch_candles("AAA/USDT", "4h", 100)
+        finally:
+            hb.cancel()
+            lock.close()
+            await ex.close()
+            await close_http_session()
+        return ticks, len(arr), ex.store.load("binance", "AAA/USDT", "4h")
+
+    ticks, n, stored = run(scenario())
+    assert n == 100 and stored is not None and len(stored) == 100
+    assert ticks >= 10  # loop жил, пока запись ждала блокировку
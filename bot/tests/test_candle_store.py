@@ -0,0 +1,55 @@
+import multiprocessing as mp
+import os
+
+import numpy as np
+
+from app.candle_store import CandleStore
+
+_N = 3000  # > _MIN_CAPACITY: по дороге серия несколько раз переписывается целиком
+
+
+def _bars(lo: int, hi: int) -> np.ndarray:
+    idx = np.arange(lo, hi, dtype=np.float64)
+    return np.column_stack((idx * 60_000, idx, idx + 1, idx - 1, idx + 0.5, idx * 10))
+
+
+def _writer(state_dir: str, offset: int) -> None:
+    store = CandleStore(state_dir)
+    # писатели идут с разным шагом, хвосты перекрываются и перезаписываются
+    step = 7 + offset
+    for lo in range(0, _N, step):
+        store.write("binance", "BTC/USDT", "1m", _bars(max(0, lo - offset), min(_N, lo + step)))
+
+
+def test_concurrent_writers_keep_series_consistent(tmp_path):
+    ctx = mp.get_context("fork")
+    procs = [ctx.Process(target=_writer, args=(str(tmp_path), k)) for k in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    store = CandleStore(str(tmp_path))
+    got = store.load("binance", "BTC/USDT", "1m")
+    assert got is not None
+    np.testing.assert_array_equal(got, _bars(0, len(got)))
+    assert len(got) == _N
+    folder = os.path.dirname(store.path("binance", "BTC/USDT", "1m"))
+    assert not [f for f in os.listdir(folder) if f.endswith(".tmp")]
+
+
+def test_failed_rewrite_leaves_no_temp_file(tmp_path, monkeypatch):
+    store = CandleStore(str(tmp_path))
+    path = store.path("binance", "ETH/USDT", "1h")
+
+    def boom(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", boom)
+    try:
+        store.write("binance", "ETH/USDT", "1h", _bars(0, 10))
+    except OSError:
+        pass
+    assert not os.path.exists(path)
+    assert not [f for f in os.listdir(os.path.dirname(path)) if f.endswith(".tmp")]
@@ -0,0 +1,40 @@
+from app.cooldown import CooldownIndex
+from app.storage import Storage
+
+
+def test_index_keeps_latest_buy_per_pair_and_tf():
+    idx = CooldownIndex()
+    idx.load([
+        ("A/USDT", "4h", "2026-01-01T00:00:00+00:00"),
+        ("A/USDT", "4h", "2026-01-02T00:00:00+00:00"),
+        ("A/USDT", "1d", "2025-12-31T00:00:00Z"),
+        ("B/USDT", "4h", "не дата"),
+    ])
+    jan2 = idx.last_buy("A/USDT", "4h")
+    assert jan2 - idx.last_buy("A/USDT", "1d") == 2 * 86400
+    assert idx.last_buy("B/USDT", "4h") is None
+    idx.record_buy("A/USDT", "4h", jan2 - 3600)  # более старый BUY не откатывает время
+    assert idx.last_buy("A/USDT", "4h") == jan2
+    assert idx.within("A/USDT", "4h", hours=6, now=jan2 + 5 * 3600)
+    assert not idx.within("A/USDT", "4h", hours=6, now=jan2 + 6 * 3600)
+    assert not idx.within("B/USDT", "4h", hours=6, now=jan2)
+
+
+def test_storage_cooldown_survives_restart(tmp_path):
+    storage = Storage(state_dir=str(tmp_path))
+    try:
+        storage.insert_signal("A/USDT", "4h", "BUY", 0.8, "r")
+        storage.insert_signal("B/USDT", "4h", "NO_BUY", 0.1, "r")
+        assert storage.within_cooldown("A/USDT", "4h", 1)
+        assert not storage.within_cooldown("A/USDT", "1d", 1)
+        storage.flush()
+    finally:
+        storage.close()
+
+    # после рестарта индекс поднимается из БД
+    storage = Storage(state_dir=str(tmp_path))
+    try:
+        assert storage.within_cooldown("A/USDT", "4h", 1)
+        assert not storage.within_cooldown("B/USDT", "4h", 1)
+    finally:
+        storage.close()
@@ -0,0 +1,83 @@
+import itertools
+
+import numpy as np
+
+from app import decision_cache
+from app.decision_cache import DecisionCache, snapshot_fingerprint
+from app.prefilter import GateStats, TripleScreenGate, reject_series
+
+_SNAP = {"close": 100.0, "ma": 98.0, "macd": 0.5, "macd_signal": 0.4, "macd_hist": 0.1,
+         "volume": 30.0, "volume_ma": 20.0, "ma_trend_up": True, "price_above_ma": True,
+         "macd_cross_up": False, "volume_spike": False}
+
+
+def test_ttl_and_lru_eviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(decision_cache.time, "time", lambda: now[0])
+    cache = DecisionCache(ttl_seconds=60, max_entries=2)
+    cache.put("a", {"buy_signal": True})
+    cache.put("b", {"buy_signal": False})
+    assert cache.get("a") == {"buy_signal": True}  # "a" теперь самый свежий
+    cache.put("c", {"buy_signal": False})
+    assert cache.get("b") is None and cache.get("a") is not None
+    now[0] += 61
+    assert cache.get("a") is None and cache.get("c") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["size"]) == (2, 3, 1, 0)
+
+
+def test_cached_value_is_a_copy():
+    cache = DecisionCache(ttl_seconds=60)
+    cache.put("k", {"reason": "x"})
+    cache.get("k")["reason"] = "changed"
+    assert cache.get("k") == {"reason": "x"}
+
+
+def test_fingerprint_ignores_noise_but_not_signal_changes():
+    base = {"4h": dict(_SNAP)}
+    jitter = {"4h": dict(_SNAP, close=100.001, macd=0.50001)}
+    assert snapshot_fingerprint(base) == snapshot_fingerprint(jitter)
+    assert snapshot_fingerprint(base) != snapshot_fingerprint({"4h": dict(_SNAP, macd_cross_up=True)})
+    assert snapshot_fingerprint(base) != snapshot_fingerprint({"4h": dict(_SNAP, close=101.0)})
+    key = DecisionCache.make_key("A/USDT", "m", "medium", "h", base)
+    assert key != DecisionCache.make_key("A/USDT", "m", "high", "h", base)
+
+
+def _bearish():
+    return dict(_SNAP, close=90.0, macd=-1.0, macd_signal=-0.5, macd_hist=-0.5,
+                ma_trend_up=False, price_above_ma=False)
+
+
+def test_gate_rejects_by_sensitivity():
+    bear = {"1w": _bearish(), "1d": _bearish(), "4h": dict(_SNAP)}
+    stats = GateStats()
+    gate = TripleScreenGate(stats=stats)
+    assert not gate.evaluate(bear, "low").escalate
+    assert not gate.evaluate(bear, "medium").escalate
+    assert gate.evaluate(bear, "high").escalate  # на H4 есть жизнь — решает LLM
+    assert stats.as_dict()["rejected"] == 2
+
+    bullish_week = dict(bear, **{"1w": dict(_SNAP)})
+    verdict = gate.evaluate(bullish_week, "medium")
+    assert verdict.escalate and verdict.checks["weekly_trend_ok"] is True
+    assert TripleScreenGate(enabled=False).evaluate(bear, "low").escalate
+    assert gate.evaluate({"4h": dict(_SNAP)}, "low").escalate  # без старших TF не режем
+
+
+def test_reject_series_matches_gate():
+    flags = ("ma_trend_up", "price_above_ma", "macd_cross_up", "volume_spike")
+    snaps = []
+    for bits in itertools.product((False, True), repeat=4):
+        for macd, sig in ((-1.0, -0.5), (-0.5, -1.0), (1.0, 0.5)):
+            snaps.append(dict(_SNAP, macd=macd, macd_signal=sig, macd_hist=macd - sig, **dict(zip(flags, bits))))
+
+    def series(rows):
+        return {k: np.array([r[k] for r in rows]) for k in _SNAP}
+
+    rows = list(itertools.product(snaps[::5], repeat=3))
+    gate = TripleScreenGate(stats=GateStats())
+    for sens in ("low", "medium", "high"):
+        mask = reject_series({tf: series([r[j] for r in rows]) for j, tf in enumerate(("1w", "1d", "4h"))}, sens)
+        expected = [not gate.evaluate(dict(zip(("1w", "1d", "4h"), r)), sens).escalate for r in rows]
+        assert mask.tolist() == expected
+        assert 0 < sum(expected) < len(rows)
@@ -0,0 +1,67 @@
+from app.exchange import AsyncExchangeClient, CandleCache, close_http_session, timeframe_ms
+from app.snapshots import fetch_triple
+from bench.synthetic import SyntheticExchange
+
+_TFS = ["1w", "1d", "4h"]
+
+
+def test_derived_triple_needs_one_request_per_symbol_when_warm(run):
+    async def scenario():
+        ex = AsyncExchangeClient("binance", cache=CandleCache(max_candles=3000, fresh_seconds=0))
+        await ex.ex.close()
+        fake = ex.ex = SyntheticExchange(["AAA/USDT"])
+        ex.clock = fake.clock
+        calls = []
+        inner = fake.fetch_ohlcv
+
+        async def traced(symbol, timeframe="1m", since=None, limit=None, params=None):
+            calls.append((timeframe, since is None, limit))
+            return await inner(symbol, timeframe, since, limit, params)
+
+        fake.fetch_ohlcv = traced
+        try:
+            cold = await fetch_triple(ex, "AAA/USDT", _TFS, 55, derive=True)
+            cold_calls = list(calls)
+            calls.clear()
+            fake.advance(timeframe_ms("4h"))
+            warm = await fetch_triple(ex, "AAA/USDT", _TFS, 55, derive=True)
+        finally:
+            await ex.close()
+            await close_http_session()
+        return cold, cold_calls, warm, calls
+
+    cold, cold_calls, warm, warm_calls = run(scenario())
+    # холодный старт: только база, 3000 баров 4h тремя страницами; 1d и 1w собраны локально
+    assert [tf for tf, *_ in cold_calls] == ["4h"] * 3
+    assert all(limit == 1000 and not full for _, full, limit in cold_calls)
+    assert cold is not None and min(len(cold["1w"]), len(cold["1d"])) >= 55
+    # тёплый цикл: один хвост 4h на пару
+    assert warm_calls == [("4h", False, 3)]
+    assert warm["4h"][-1, 0] == cold["4h"][-1, 0] + timeframe_ms("4h")
+
+
+def test_base_is_not_enlarged_when_cache_cannot_hold_weekly_history(run):
+    async def scenario():
+        ex = AsyncExchangeClient("binance", cache=CandleCache(max_candles=1000, fresh_seconds=0))
+        await ex.ex.close()
+        fake = ex.ex = SyntheticExchange(["AAA/USDT"])
+        ex.clock = fake.clock
+        calls = []
+        inner = fake.fetch_ohlcv
+
+        async def traced(symbol, timeframe="1m", since=None, limit=None, params=None):
+            calls.append((timeframe, limit))
+            return await inner(symbol, timeframe, since, limit, params)
+
+        fake.fetch_ohlcv = traced
+        try:
+            res = await fetch_triple(ex, "AAA/USDT", _TFS, 55, derive=True)
+        finally:
+            await ex.close()
+            await close_http_session()
+        return res, calls
+
+    res, calls = run(scenario())
+    assert res is not None
+    # 1w — с биржи; база растёт только ради 1d (в пределах кэша)
+    assert sorted(calls) == [("1w", 300), ("4h", 1000)]
@@ -0,0 +1,69 @@
+import math
+
+import numpy as np
+
+from app.indicator_state import IndicatorBook
+from app.indicators import compute_snapshot
+
+_PARAMS = (50, 12, 26, 9)
+_H4 = 4 * 60 * 60 * 1000
+
+
+def _candles(n: int, seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.01, n)))
+    out = np.empty((n, 6))
+    out[:, 0] = np.arange(n) * _H4
+    out[:, 1] = close
+    out[:, 2] = close * 1.01
+    out[:, 3] = close * 0.99
+    out[:, 4] = close
+    out[:, 5] = rng.uniform(10.0, 100.0, n)
+    return out
+
+
+def _assert_same(incremental: dict, full: dict) -> None:
+    assert incremental.keys() == full.keys()
+    for k, v in full.items():
+        if isinstance(v, bool):
+            assert incremental[k] == v, k
+        elif math.isnan(v):
+            assert math.isnan(incremental[k]), k
+        else:
+            assert math.isclose(incremental[k], v, rel_tol=1e-9, abs_tol=1e-12), k
+
+
+def test_incremental_matches_full_recompute_on_new_bars():
+    book = IndicatorBook()
+    candles = _candles(260)
+    for n in (200, 201, 205, 260):
+        _assert_same(book.snapshot(("x", "A/USDT", "4h"), candles[:n], *_PARAMS),
+                     compute_snapshot(candles[:n], *_PARAMS))
+
+
+def test_incremental_matches_full_recompute_when_last_bar_revised():
+    book = IndicatorBook()
+    key = ("x", "A/USDT", "4h")
+    candles = _candles(220)
+    book.snapshot(key, candles[:200], *_PARAMS)
+
+    # формирующаяся свеча дорисовалась: другой close и объём у того же ts
+    revised = candles[:200].copy()
+    revised[-1, 4] *= 1.05
+    revised[-1, 5] *= 3.0
+    _assert_same(book.snapshot(key, revised, *_PARAMS), compute_snapshot(revised, *_PARAMS))
+
+    # ещё раз та же свеча, затем новые бары поверх пересчитанной
+    revised[-1, 4] = candles[199, 4] * 0.97
+    _assert_same(book.snapshot(key, revised, *_PARAMS), compute_snapshot(revised, *_PARAMS))
+    grown = np.vstack((revised, candles[200:]))
+    _assert_same(book.snapshot(key, grown, *_PARAMS), compute_snapshot(grown, *_PARAMS))
+
+
+def test_diverged_history_rebuilds_state():
+    book = IndicatorBook()
+    key = ("x", "A/USDT", "4h")
+    book.snapshot(key, _candles(200), *_PARAMS)
+    other = _candles(200, seed=11)
+    other[:, 0] += 10_000 * _H4  # другой хвост: прежнего last_ts в нём нет
+    _assert_same(book.snapshot(key, other, *_PARAMS), compute_snapshot(other, *_PARAMS))
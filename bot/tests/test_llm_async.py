@@ -0,0 +1,147 @@
+import asyncio
+import json
+import time
+
+import openai
+import pytest
+
+from app import analyzer as analyzer_mod
+from app.analyzer import LLMAnalyzer, _retry_delay
+from bench.fake_llm import FakeLLMServer
+
+
+def _make_llm(monkeypatch, server: FakeLLMServer, **env) -> LLMAnalyzer:
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setenv("LLM_RETRY_BASE_DELAY", "0.05")
+    for k, v in env.items():
+        monkeypatch.setenv(k, str(v))
+    return LLMAnalyzer("test", "test-model")
+
+
+async def _with_server(fn, latency: float = 0.0):
+    server = FakeLLMServer(latency=latency, jitter=0.0)
+    await server.start()
+    try:
+        return await fn(server)
+    finally:
+        await server.close()
+
+
+def _prompt(symbol: str = "BTC/USDT") -> str:
+    return f"[{symbol}]\nW1: ...\nD1: ...\nH4: ..."
+
+
+def test_retry_on_503_and_429(run, monkeypatch):
+    async def body(server):
+        llm = _make_llm(monkeypatch, server, LLM_MAX_RETRIES=3)
+        server.script.extend([{"status": 503}, {"status": 429, "retry_after": 0.2}])
+        t0 = time.monotonic()
+        text = await llm._acomplete(_prompt(), "medium")
+        elapsed = time.monotonic() - t0
+        await llm.aclose()
+        return json.loads(text), elapsed, llm.retries, server.requests
+
+    decision, elapsed, retries, requests = run(_with_server(body))
+    assert decision["symbol"] == "BTC/USDT"
+    assert retries == 2 and requests == 3
+    assert elapsed >= 0.2  # retry-after соблюдён
+
+
+def test_retry_gives_up_and_does_not_retry_4xx(run, monkeypatch):
+    async def body(server):
+        llm = _make_llm(monkeypatch, server, LLM_MAX_RETRIES=1)
+        server.script.extend([{"status": 503}, {"status": 503}])
+        with pytest.raises(openai.InternalServerError):
+            await llm._acomplete(_prompt(), "medium")
+        server.script.append({"status": 400})
+        with pytest.raises(openai.BadRequestError):
+            await llm._acomplete(_prompt(), "medium")
+        await llm.aclose()
+        return server.requests
+
+    assert run(_with_server(body)) == 3  # 503 + повтор, 400 — без повтора
+
+
+def test_retry_delay_has_full_jitter():
+    err = asyncio.TimeoutError()
+    delays = [_retry_delay(err, 3, 0.5) for _ in range(200)]
+    assert all(0.0 <= d <= 0.5 * 2 ** 3 for d in delays)
+    assert len(set(delays)) > 100
+
+
+def test_request_deadline(run, monkeypatch):
+    async def body(server):
+        llm = _make_llm(monkeypatch, server, LLM_TIMEOUT_SECONDS=0.2, LLM_MAX_RETRIES=0)
+        server.script.append({"delay": 2.0})
+        t0 = time.monotonic()
+        with pytest.raises((asyncio.TimeoutError, openai.APITimeoutError)):
+            await llm._acomplete(_prompt(), "medium")
+        elapsed = time.monotonic() - t0
+        await llm.aclose()
+        return elapsed
+
+    assert run(_with_server(body)) < 1.0
+
+
+def test_hedge_fires_and_cancels_slow_primary(run, monkeypatch):
+    async def body(server):
+        llm = _make_llm(monkeypatch, server, LLM_HEDGE=1)
+        # история задержек: p95 = 50 мс, хедж уйдёт через 50 мс
+        llm._latencies.extend([0.05] * analyzer_mod._HEDGE_MIN_SAMPLES)
+        server.script.append({"delay": 3.0})  # основной запрос «завис», хедж отвечает сразу
+        t0 = time.monotonic()
+        text = await llm._acomplete(_prompt("ETH/USDT"), "medium")
+        elapsed = time.monotonic() - t0
+        await asyncio.sleep(0.2)  # сервер замечает разрыв соединения
+        await llm.aclose()
+        return json.loads(text), elapsed, llm.hedged, llm.hedge_wins, server.cancelled
+
+    decision, elapsed, hedged, wins, cancelled = run(_with_server(body))
+    assert decision["symbol"] == "ETH/USDT"
+    assert elapsed < 1.0
+    assert hedged == 1 and wins == 1
+    assert cancelled == 1
+
+
+def test_concurrency_limit_covers_hedges(run, monkeypatch):
+    async def body(server):
+        llm = _make_llm(monkeypatch, server, LLM_HEDGE=1, LLM_MAX_CONCURRENCY=2)
+        llm._latencies.extend([0.01] * analyzer_mod._HEDGE_MIN_SAMPLES)
+        await asyncio.gather(*[llm._acomplete(_prompt(f"S{i}/USDT"), "medium") for i in range(6)])
+        await llm.aclose()
+        return server.max_inflight, llm.hedged
+
+    max_inflight, hedged = run(_with_server(body, latency=0.1))
+    assert hedged > 0
+    assert max_inflight <= 2
+
+
+def test_backoff_releases_slot(run, monkeypatch):
+    async def body(server):
+        llm = _make_llm(monkeypatch, server, LLM_MAX_CONCURRENCY=1, LLM_MAX_RETRIES=2)
+        server.script.append({"status": 429, "retry_after": 0.5})
+        finished = []
+
+        async def call(name: str, delay: float):
+            await asyncio.sleep(delay)
+            await llm._acomplete(_prompt(), "medium")
+            finished.append(name)
+
+        # первый ловит 429 и ждёт 0.5с; второй за это время успевает занять слот и ответить
+        await asyncio.gather(call("throttled", 0.0), call("other", 0.05))
+        await llm.aclose()
+        return finished
+
+    assert run(_with_server(body)) == ["other", "throttled"]
+
+
+def test_fake_server_echoes_symbol_of_single_prompt(run, monkeypatch):
+    prompt = analyzer_mod._render_user_prompt("ETH/USDT", {}, 20, 12, 26, 9, "medium", None, None)
+
+    async def body(server):
+        llm = _make_llm(monkeypatch, server)
+        text = await llm._acomplete(prompt, "medium")
+        await llm.aclose()
+        return json.loads(text)
+
+    assert run(_with_server(body))["symbol"] == "ETH/USDT"
@@ -0,0 +1,89 @@
+import json
+
+from app.analyzer import _BATCH_OUT_TOKENS_PER_SYMBOL, _parse_batch, _split_by_budget
+from app.decision_cache import DECISION_CACHE
+from bench.fake_llm import FakeLLMServer
+from test_llm_async import _make_llm
+
+_SYMBOLS = ["AAA/USDT", "BBB/USDT", "CCC/USDT"]
+
+
+def _items(tag: float):
+    # префильтр выключен — в LLM уходит всё; tag делает снимки (и ключи кэша) уникальными для теста
+    return [(s, {"4h": {"close": tag + i}}) for i, s in enumerate(_SYMBOLS)]
+
+
+async def _batch_then_single(server, llm, items):
+    batch = await llm.aanalyze_batch(items, None)
+    after_batch = server.requests
+    single = await llm.aanalyze_triple(items[0][0], items[0][1], None)
+    await llm.aclose()
+    return batch, after_batch, single
+
+
+def test_batch_without_template_uses_one_request_and_own_cache_key(run, monkeypatch):
+    async def body():
+        server = FakeLLMServer(latency=0.0, jitter=0.0)
+        await server.start()
+        try:
+            llm = _make_llm(monkeypatch, server, PREFILTER=0)
+            return server, await _batch_then_single(server, llm, _items(1.0))
+        finally:
+            await server.close()
+
+    server, (batch, after_batch, single) = run(body())
+    assert set(batch) == set(_SYMBOLS)
+    assert after_batch == 1 and '"decisions"' in server.prompts[0]
+    # решение пакета не выдаётся одиночному запросу: у него другой промпт и другой ключ
+    assert server.requests == 2
+    assert "Проанализируй AAA/USDT" in server.prompts[1]
+    assert single["buy_signal"] == batch["AAA/USDT"]["buy_signal"]
+
+
+def test_user_template_disables_batching(run, monkeypatch):
+    monkeypatch.setenv("PROMPT_USER_TEMPLATE", "TEMPLATE for {{symbol}}")
+
+    async def body():
+        server = FakeLLMServer(latency=0.0, jitter=0.0)
+        await server.start()
+        try:
+            llm = _make_llm(monkeypatch, server, PREFILTER=0)
+            return server, await _batch_then_single(server, llm, _items(2.0))
+        finally:
+            await server.close()
+
+    server, (batch, after_batch, single) = run(body())
+    assert set(batch) == set(_SYMBOLS)
+    assert after_batch == len(_SYMBOLS)
+    assert all(any(f"TEMPLATE for {s}" in p for p in server.prompts) for s in _SYMBOLS)
+    assert not any('"decisions"' in p for p in server.prompts)
+    # одиночный запрос той же пары берёт решение из кэша: оно сделано с тем же шаблоном
+    assert server.requests == len(_SYMBOLS)
+    assert json.dumps(single, sort_keys=True) == json.dumps(batch["AAA/USDT"], sort_keys=True)
+    assert DECISION_CACHE.hits > 0
+
+
+def test_parse_batch_normalizes_symbols_and_skips_junk():
+    raw = "Ответ:\n" + json.dumps({"decisions": [
+        {"symbol": "aaa:usdt", "buy_signal": "yes", "confidence": "0.7", "rationale": "ok"},
+        {"symbol": "AAA/USDT", "buy_signal": False},   # повтор — берём первое
+        {"symbol": "ZZZ/USDT", "buy_signal": True},    # не спрашивали
+        {"symbol": "BBB/USDT", "confidence": 0.9},     # нет buy_signal — не решение
+        "мусор",
+    ]})
+    out = _parse_batch(raw, set(_SYMBOLS))
+    assert list(out) == ["AAA/USDT"]
+    assert out["AAA/USDT"]["buy_signal"] is True
+    assert out["AAA/USDT"]["confidence"] == 0.7 and out["AAA/USDT"]["reason"] == "ok"
+    assert _parse_batch(json.dumps([{"symbol": "CCC/USDT", "buy_signal": False}]), set(_SYMBOLS)).keys() == {"CCC/USDT"}
+    assert _parse_batch("не JSON", set(_SYMBOLS)) == {}
+
+
+def test_split_by_budget_respects_tokens_and_symbol_cap():
+    pending = [(s, None, None, "x" * 300) for s in "ABCDE"]  # 100 токенов входа на пару
+    cost = 100 + _BATCH_OUT_TOKENS_PER_SYMBOL
+    chunks = _split_by_budget(pending, token_budget=2 * cost, max_symbols=8)
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert [len(c) for c in _split_by_budget(pending, token_budget=10 ** 6, max_symbols=3)] == [3, 2]
+    # пара дороже бюджета всё равно уходит — одна в своём пакете
+    assert [len(c) for c in _split_by_budget(pending[:2], token_budget=1, max_symbols=8)] == [1, 1]
@@ -0,0 +1,73 @@
+import asyncio
+import re
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendMessage
+
+from app.outbox import Outbox, split_text
+
+
+def _balanced(part: str) -> bool:
+    stack = []
+    for close, name in re.findall(r"<(/?)([a-z-]+)[^>]*>", part):
+        if close:
+            if not stack or stack.pop() != name:
+                return False
+        else:
+            stack.append(name)
+    return not stack
+
+
+def test_split_prefers_card_boundaries():
+    card = "<b>Card</b>\nline one\nline two"
+    text = "\n\n".join([card] * 10)
+    parts = split_text(text, limit=len(card) * 3 + 4)
+    assert all(p.count("<b>Card</b>") == 3 or p == parts[-1] for p in parts)
+    assert "\n\n".join(parts) == text
+
+
+def test_split_never_cuts_inside_tags_or_entities():
+    body = "\n".join(f"row {i} &lt;x&gt;" for i in range(200))
+    text = "<b>Метрики</b>\n<pre>" + body + "</pre>"
+    parts = split_text(text, limit=300)
+    assert len(parts) > 1
+    for p in parts:
+        assert len(p) <= 300
+        assert _balanced(p)
+        assert not re.search(r"&[#\w]*$", p) and not re.search(r"<[^>]*$", p)
+    # переоткрытый <pre> сохраняет моноширинный блок во всех частях
+    assert all("<pre>" in p for p in parts[1:])
+
+
+def test_split_plain_text_ignores_markup():
+    text = "a<b " * 50
+    parts = split_text(text, limit=40, html=False)
+    assert "".join(parts) == text and all(len(p) <= 40 for p in parts)
+
+
+class _Bot:
+    def __init__(self, bad: str):
+        self.bad = bad
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kw):
+        if self.bad in text:
+            raise TelegramBadRequest(SendMessage(chat_id=chat_id, text=text), "can't parse entities")
+        self.sent.append(text)
+
+
+def test_rejected_merge_is_resent_piece_by_piece(run):
+    async def scenario():
+        bot = _Bot(bad="BROKEN")
+        outbox = Outbox(bot, global_rate=1000, chat_rate=1000)
+        futs = [outbox.send(1, t) for t in ("first", "BROKEN", "third")]
+        outbox.start()
+        done = await asyncio.gather(*futs, return_exceptions=True)
+        await outbox.close(timeout=1)
+        return bot, outbox, done
+
+    bot, outbox, done = run(scenario())
+    assert outbox.merged == 2
+    assert bot.sent == ["first", "third"]
+    assert done[0] is None and done[2] is None
+    assert isinstance(done[1], TelegramBadRequest)
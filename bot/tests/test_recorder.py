@@ -0,0 +1,42 @@
+import threading
+import time
+
+from app.recorder import Recorder, Replay, read_records
+
+
+def test_writes_are_queued_and_drained_on_close(tmp_path):
+    path = str(tmp_path / "io.rec")
+    rec = Recorder(path)
+
+    def producer(k: int):
+        for i in range(200):
+            rec.write({"k": "ohlcv", "s": f"P{k}/USDT", "tf": "1h", "full": True, "r": [[i, 1, 2, 0, 1, 5]]},
+                      time.monotonic())
+
+    threads = [threading.Thread(target=producer, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    rec.close()
+    rec.write({"k": "llm", "s": "LATE/USDT", "r": {}}, time.monotonic())  # после close — молча игнорируется
+
+    records = list(read_records(path))
+    assert rec.records == len(records) == 800
+    for k in range(4):
+        seq = [r["r"][0][0] for r in records if r["s"] == f"P{k}/USDT"]
+        assert seq == list(range(200))  # порядок одного источника сохраняется
+
+
+def test_replay_serves_recorded_results_and_service_time(tmp_path):
+    path = str(tmp_path / "io.rec")
+    rec = Recorder(path)
+    result = {"buy_signal": True, "confidence": 0.7}
+    rec.write({"k": "llm", "s": "BTC/USDT", "r": result}, time.monotonic() - 0.5)
+    rec.close()
+
+    replay = Replay(path, speed=10)
+    got = replay.take(("llm", "BTC/USDT"))
+    assert got["r"] == result
+    assert abs(replay.delay(got) - 0.05) < 0.01
+    assert replay.take(("llm", "ETH/USDT")) is None and replay.misses == 1
@@ -0,0 +1,53 @@
+import numpy as np
+
+from app.resample import base_candles_needed, bucket_starts, can_resample, resample_candles
+
+_H4 = 4 * 60 * 60 * 1000
+_DAY = 24 * 60 * 60 * 1000
+_MONDAY = 1767571200000  # 2026-01-05 00:00 UTC
+
+
+def _h4(start_ms: int, n: int) -> np.ndarray:
+    out = np.empty((n, 6))
+    out[:, 0] = start_ms + np.arange(n) * _H4
+    out[:, 1] = np.arange(n) + 100.0
+    out[:, 2] = out[:, 1] + 5.0
+    out[:, 3] = out[:, 1] - 5.0
+    out[:, 4] = out[:, 1] + 1.0
+    out[:, 5] = 1.0 + np.arange(n)
+    return out
+
+
+def _by_hand(candles: np.ndarray) -> list:
+    return [candles[0, 0], candles[0, 1], candles[:, 2].max(), candles[:, 3].min(),
+            candles[-1, 4], candles[:, 5].sum()]
+
+
+def test_daily_bars_equal_hand_aggregation_and_drop_partial_first_day():
+    # история начинается в 08:00 — первые сутки неполные и отбрасываются
+    candles = _h4(_MONDAY + 2 * _H4, 4 + 6 * 3 + 2)
+    out = resample_candles(candles, "4h", "1d", "binance")
+    assert out[:, 0].tolist() == [_MONDAY + _DAY * i for i in (1, 2, 3, 4)]
+    for i, day in enumerate(out[:3]):
+        np.testing.assert_array_equal(day, _by_hand(candles[4 + 6 * i:4 + 6 * (i + 1)]))
+    # последний бар — формирующийся, из двух 4h-свечей
+    np.testing.assert_array_equal(out[-1], _by_hand(candles[-2:]))
+
+
+def test_weekly_bars_start_on_monday_and_kraken_on_epoch_thursday():
+    candles = _h4(_MONDAY, 6 * 21)
+    weekly = resample_candles(candles, "4h", "1w", "binance")
+    assert weekly[:, 0].tolist() == [_MONDAY, _MONDAY + 7 * _DAY, _MONDAY + 14 * _DAY]
+    np.testing.assert_array_equal(weekly[0], _by_hand(candles[:42]))
+
+    kraken = bucket_starts(candles[:, 0], "1w", "kraken")
+    assert ((kraken // _DAY) % 7 == 0).all()  # 1970-01-01 — четверг
+    assert resample_candles(candles, "4h", "1w", "kraken")[0, 0] == _MONDAY + 3 * _DAY
+
+
+def test_can_resample_and_base_depth():
+    assert can_resample("4h", "1d") and can_resample("4h", "1w")
+    assert not can_resample("4h", "1M") and not can_resample("1d", "4h")
+    assert not can_resample("5h", "1d")  # сутки не делятся на 5h
+    assert base_candles_needed("4h", "1w", 300) == 301 * 42
+    assert resample_candles(np.empty((0, 6)), "4h", "1d", "binance") is None
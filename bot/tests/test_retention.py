@@ -0,0 +1,56 @@
+from app.retention import _SQL_ROLLUP_SELECT, Retention
+from app.storage import Storage
+
+
+def test_rollup_scan_uses_retention_index(tmp_path):
+    storage = Storage(state_dir=str(tmp_path))
+    try:
+        plan = storage.call(lambda con: con.execute(
+            "EXPLAIN QUERY PLAN " + _SQL_ROLLUP_SELECT, ("2026-01-01", 10)).fetchall())
+    finally:
+        storage.close()
+    detail = " ".join(str(row[-1]) for row in plan)
+    assert "idx_signals_retention" in detail
+    assert "TEMP B-TREE" not in detail  # порядок берётся из индекса, без сортировки
+
+
+def _seed(storage, rows):
+    def q(con):
+        with con:
+            con.executemany(
+                "INSERT INTO signals(ts_utc, symbol, timeframe, decision, confidence, reason) VALUES(?, ?, ?, ?, ?, ?)",
+                rows)
+    storage.call(q)
+
+
+def test_rollup_counts_and_interned_reasons_survive_retention(tmp_path):
+    storage = Storage(state_dir=str(tmp_path))
+    try:
+        old = [("2020-01-01T%02d:00:00+00:00" % h, "A/USDT", "4h", "NO_BUY", 0.25, "тренд вниз") for h in range(5)]
+        old += [("2020-01-02T00:00:00+00:00", "A/USDT", "4h", "NO_BUY", 0.5, "тренд вниз"),
+                ("2020-01-01T12:00:00+00:00", "A/USDT", "4h", "BUY", 0.9, "пробой")]
+        _seed(storage, old)
+        storage.insert_signal("A/USDT", "4h", "NO_BUY", 0.3, "тренд вниз")  # свежий — не сворачивается
+
+        retention = Retention(storage, keep_days=30, chunk=2)
+        steps = 0
+        while retention.step():
+            steps += 1
+            assert steps < 20
+        assert retention.rolled_up == 6 and retention.interned == 2
+
+        daily = storage.call(lambda con: con.execute(
+            "SELECT day, n, confidence_sum FROM signals_daily ORDER BY day").fetchall())
+        assert daily == [("2020-01-01", 5, 1.25), ("2020-01-02", 1, 0.5)]
+        rows = storage.call(lambda con: con.execute(
+            "SELECT decision, reason FROM signals_full ORDER BY ts_utc").fetchall())
+        assert rows[0] == ("BUY", "пробой") and rows[1] == ("NO_BUY", "тренд вниз") and len(rows) == 2
+        assert storage.call(lambda con: con.execute(
+            "SELECT COUNT(*) FROM signals WHERE reason IS NOT NULL").fetchone()[0]) == 0
+        assert storage.call(lambda con: con.execute("SELECT COUNT(*) FROM signal_reasons").fetchone()[0]) == 2
+
+        # повторный прогон ничего не трогает
+        assert not retention.step()
+        assert retention.rolled_up == 6
+    finally:
+        storage.close()
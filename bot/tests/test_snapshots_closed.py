@@ -0,0 +1,76 @@
+import numpy as np
+
+from app.exchange import CandleCache, ExchangeClient, timeframe_ms
+from app.indicators import compute_snapshot
+from app.snapshots import closed_candles, fetch_triple, snapshots_from_candles
+from bench.synthetic import synthetic_ohlcv
+
+H4 = timeframe_ms("4h")
+CLOSE_MS = 1_760_000_400_000 - 1_760_000_400_000 % H4  # граница 4h-бара
+NOW_MS = CLOSE_MS + 15_000                               # пробуждение планировщика: закрытие + grace
+TFS = ["1w", "1d", "4h"]
+
+
+class _Exchange:
+    """Синхронный «ccxt»: история до NOW_MS; последний бар каждого TF только открылся (15 секунд объёма)."""
+
+    def __init__(self, symbol: str):
+        self.data = {}
+        for tf in TFS:
+            tf_ms = timeframe_ms(tf)
+            arr = synthetic_ohlcv(symbol, tf, NOW_MS - 400 * tf_ms, 420)
+            arr = arr[arr[:, 0] <= NOW_MS].copy()
+            arr[-1, 2:5] = arr[-1, 1]  # формирующийся бар: один тик
+            arr[-1, 5] = 1e-3
+            self.data[tf] = arr
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params=None):
+        arr = self.data[timeframe]
+        return (arr[-limit:] if limit else arr).tolist()
+
+
+def _client(symbol: str) -> ExchangeClient:
+    ex = ExchangeClient("binance", cache=CandleCache(fresh_seconds=0))
+    ex.ex = _Exchange(symbol)
+    return ex
+
+
+def test_closed_candles_drops_forming_bar():
+    arr = np.array([[CLOSE_MS - 2 * H4, 1, 1, 1, 1, 1], [CLOSE_MS - H4, 1, 1, 1, 1, 1], [CLOSE_MS, 1, 1, 1, 1, 1]],
+                   dtype=np.float64)
+    out = closed_candles({"4h": arr}, NOW_MS)["4h"]
+    assert len(out) == 2 and out[-1, 0] + H4 == CLOSE_MS
+    # ровно на закрытии бар уже закрыт
+    assert len(closed_candles({"4h": arr}, CLOSE_MS + H4)["4h"]) == 3
+
+
+def test_snapshot_after_close_equals_closed_bar_snapshot(run):
+    symbol = "BTC/USDT"
+    ex = _client(symbol)
+    candles = run(fetch_triple(ex, symbol, TFS, 55, closed_by_ms=CLOSE_MS))
+    assert candles is not None
+    assert candles["4h"][-1, 0] + H4 == CLOSE_MS  # последний — бар, закрывшийся в CLOSE_MS
+    # старшие экраны не отстают: формирующиеся 1d/1w те же, что видит /check
+    plain = run(fetch_triple(_client(symbol), symbol, TFS, 55))
+    for tf in ("1w", "1d"):
+        np.testing.assert_array_equal(candles[tf], plain[tf])
+        assert candles[tf][-1, 0] + timeframe_ms(tf) > CLOSE_MS
+
+    snaps = snapshots_from_candles("binance", symbol, candles, 50, 12, 26, 9)
+    closed_4h = ex.ex.data["4h"][:-1][-300:]
+    expected = compute_snapshot(closed_4h, 50, 12, 26, 9)
+    assert snaps["4h"].keys() == expected.keys()
+    for k, v in expected.items():
+        if isinstance(v, bool):
+            assert snaps["4h"][k] is v, k
+        else:
+            assert np.isclose(snaps["4h"][k], v), k
+    # у формирующегося бара объём ~0 — с ним volume_spike и цена были бы «с одного тика»
+    assert snaps["4h"]["volume"] == closed_4h[-1, 5]
+
+
+def test_without_closed_by_ms_last_row_is_forming(run):
+    symbol = "ETH/USDT"
+    ex = _client(symbol)
+    candles = run(fetch_triple(ex, symbol, TFS, 55))
+    assert candles["4h"][-1, 0] == CLOSE_MS
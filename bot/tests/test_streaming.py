@@ -0,0 +1,164 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from app import streaming
+from app.candle_store import CandleStore
+from app.exchange import CandleCache, _CandleSource, close_http_session
+from app.streaming import KlineStreamer
+
+_M = 60_000
+
+
+def _bar(i: int) -> list:
+    return [float(i * _M), 1.0 + i, 2.0 + i, 0.5 + i, 1.5 + i, 10.0 * i]
+
+
+class _Rest(_CandleSource):
+    """«Биржа» для REST-досинхронизации: отдаёт заранее заданные бары и пишет их в кэш/хранилище."""
+
+    def __init__(self, store: CandleStore):
+        self.exchange_id = "binance"
+        self.cache = CandleCache(fresh_seconds=60)
+        self.store = store
+        self.ex = None  # market() нет — id стрима берётся из символа
+        self.bars = {}
+        self.calls = []
+
+    def fetch_candles(self, symbol, tf, limit):
+        self.calls.append((symbol, tf))
+        rows = self.bars[(symbol, tf)][-limit:]
+        arr, write = self._apply_full((self.exchange_id, symbol, tf), rows, limit)
+        if write:
+            self.persist(*write)
+        return arr
+
+
+class _FakeStream:
+    """Combined-streams endpoint: запоминает подписки, тест сам шлёт kline-сообщения."""
+
+    def __init__(self):
+        self.conns = []  # (streams, ws)
+        self.runner = None
+        self.url = ""
+
+    async def _ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.conns.append((request.query["streams"], ws))
+        async for _ in ws:
+            pass
+        return ws
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/stream", self._ws)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}/stream"
+
+    async def kline(self, stream: str, row: list, closed: bool, conn: int = -1):
+        t, o, h, low, c, v = row
+        k = {"t": int(t), "o": str(o), "h": str(h), "l": str(low), "c": str(c), "v": str(v), "x": closed}
+        await self.conns[conn][1].send_str(json.dumps({"stream": stream, "data": {"k": k}}))
+
+
+async def _until(cond, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_stream_close_gap_and_reconnect(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(streaming.random, "random", lambda: 0.0)
+    store = CandleStore(str(tmp_path))
+    rest = _Rest(store)
+    key = ("binance", "BTC/USDT", "1m")
+    rest.bars[("BTC/USDT", "1m")] = [_bar(i) for i in range(10)]
+
+    async def scenario():
+        server = _FakeStream()
+        await server.start()
+        streamer = KlineStreamer(rest, server.url)
+        try:
+            # подписка: одно соединение со стримом пары, сразу REST-досинхронизация
+            streamer.set_targets(["BTC/USDT"], ["1m"])
+            await _until(lambda: server.conns and rest.cache.get(key) is not None)
+            assert server.conns[0][0] == "btcusdt@kline_1m"
+            assert rest.calls == [("BTC/USDT", "1m")]
+
+            # формирующийся бар не пишется, закрытый — в кэш и (пачкой) на диск
+            await server.kline("btcusdt@kline_1m", _bar(10), closed=False)
+            await server.kline("btcusdt@kline_1m", _bar(10), closed=True)
+            await _until(lambda: streamer.closed_bars == 1)
+            assert rest.cache.get(key)[-1].tolist() == _bar(10)
+            await _until(lambda: len(store.load(*key)) == 11)
+
+            # дыра (бары 11-12 пропали) — свеча не кладётся, хвост берётся через REST
+            rest.bars[("BTC/USDT", "1m")] = [_bar(i) for i in range(14)]
+            await server.kline("btcusdt@kline_1m", _bar(13), closed=True)
+            await _until(lambda: streamer.gaps == 1 and rest.cache.get(key)[-1, 0] == 13 * _M)
+            assert len(rest.calls) == 2 and streamer.closed_bars == 1
+
+            # обрыв: переподключение с той же подпиской и повторной досинхронизацией
+            await server.conns[0][1].close()
+            await _until(lambda: len(server.conns) == 2 and len(rest.calls) == 3)
+            assert server.conns[1][0] == "btcusdt@kline_1m"
+            assert streamer.reconnects == 1
+            await server.kline("btcusdt@kline_1m", _bar(14), closed=True)
+            await _until(lambda: streamer.closed_bars == 2)
+        finally:
+            await streamer.close()
+            await close_http_session()
+            await server.runner.cleanup()
+        assert store.load(*key)[-1].tolist() == _bar(14)
+
+    run(scenario())
+
+
+def test_set_targets_resubscribes_only_changed_shards(run, monkeypatch):
+    started = []
+
+    async def fake_connection(self, names):
+        started.append(tuple(names))
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(KlineStreamer, "_connection", fake_connection)
+
+    async def scenario():
+        streamer = KlineStreamer(_Rest(None), "ws://unused", max_streams_per_conn=2)
+        streamer.set_targets(["AAA/USDT", "BBB/USDT", "CCC/USDT"], ["1h"])
+        await asyncio.sleep(0)
+        first = list(started)
+        tasks = {sh.task for sh in streamer._shards}
+
+        # новая пара: в шард со свободным местом, первый шард не трогаем
+        started.clear()
+        streamer.set_targets(["AAA/USDT", "BBB/USDT", "CCC/USDT", "DDD/USDT"], ["1h"])
+        await asyncio.sleep(0)
+        added = list(started)
+        kept = {sh.task for sh in streamer._shards} & tasks
+
+        # ушедшая пара: переподключается только её шард, освободившееся место занимает новая
+        started.clear()
+        streamer.set_targets(["BBB/USDT", "CCC/USDT", "DDD/USDT", "EEE/USDT"], ["1h"])
+        await asyncio.sleep(0)
+        swapped = list(started)
+        shards = sorted(tuple(sorted(sh.names)) for sh in streamer._shards)
+        stats = streamer.stats()
+        await streamer.close()
+        return first, added, len(kept), swapped, shards, stats
+
+    first, added, kept, swapped, shards, stats = run(scenario())
+    assert first == [("aaausdt@kline_1h", "bbbusdt@kline_1h"), ("cccusdt@kline_1h",)]
+    assert added == [("cccusdt@kline_1h", "dddusdt@kline_1h")]
+    assert kept == 1
+    assert swapped == [("bbbusdt@kline_1h", "eeeusdt@kline_1h")]
+    assert shards == [("bbbusdt@kline_1h", "eeeusdt@kline_1h"), ("cccusdt@kline_1h", "dddusdt@kline_1h")]
+    assert stats["connections"] == 2 and stats["resubscribes"] == 2